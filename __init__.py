@@ -7,8 +7,9 @@ Parsing:
 
 parsed, errors = bbcode.parse(content, strict=True)
 
-This might raise a bbocde.PaserError if strict is True (default). Otherwise on a
-ParserError the content is returned unparsed and errors contains the reason.
+This might raise a bbocde.PaserError if strict is True (default). Otherwise
+closing tags without an opening tag are kept as text and errors contains the
+reason.
 
 Validation:
 
@@ -16,6 +17,40 @@ errors = bbcode.validate(content)
 
 Returns errors caused by parsing the code or an empty sequence.
 
+errors = bbcode.validate(content, quick=True, fail_fast=True)
+
+Only checks the arguments and nesting of the tags (see Node.validate) instead of
+parsing the content, and stops at the first error.
+
+Both at once:
+
+parsed, errors, tree = bbcode.parse_and_validate(content)
+
+Parses the content only once, useful when it is validated before being saved
+together with its parsed version.
+
+Plain text:
+
+text = bbcode.to_text(content)
+
+Renders the content as plain text (eg. for search indexes or e-mails), see
+Node.text.
+
+Excerpts:
+
+html = bbcode.excerpt(content, max_chars)
+
+Renders the beginning of the content with at most max_chars characters of text,
+without tokenizing the rest of it.
+
+Live previews:
+
+document = bbcode.Document(content)
+document.edit(start, end, new_text)
+
+Keeps the rendered content and only re-renders the tags around an edit, see
+Document.
+
 Extending:
 
 Subclassing bbcode.TagNode and bbcode.register the class adds new BB Code Tags.
@@ -25,6 +60,12 @@ strings of the TagNode class.
 """
 import re
 import cgi
+import ast
+import time
+import hashlib
+import imp
+import threading
+from itertools import izip
 
 try:
     from django.utils.translation import ugettext as _
@@ -33,7 +74,19 @@ except ImportError:
 
 AUTODISCOVERED = False
 
+# Guards the tags of the library and its lazy tag modules: registering tags,
+# importing lazy modules and computing the fingerprint. Reentrant, as
+# importing a lazy module registers its tags. The import lock is always
+# acquired first, see Library.load_module.
+LIBRARY_LOCK = threading.RLock()
+
 LINEFEED_PATTERN = re.compile('\n\s*\n', re.MULTILINE)
+# A blank line and the whitespace following it, see Parser.render_chunks
+BLANK_LINE_PATTERN = re.compile(r'\n[ \t\r]*\n\s*')
+ARGUMENT_PATTERN = re.compile(r' (\w+)=([^\] ]+)')
+# the quotes VariableScope.resolve strips around the separated text nodes, see
+# escape_text_nodes
+SEPARATED_QUOTES_PATTERN = re.compile(u'"*\0"*')
 def convert_linefeeds(content):
     content = LINEFEED_PATTERN.sub('<br /><br />', content)
     return content.replace('\n', '<br />')
@@ -49,7 +102,7 @@ class UnmatchablePseudoPattern(object):
     def search(self, content):
         return False
     
-    def finditer(self, content):
+    def finditer(self, content, pos=0, endpos=None):
         return iter([])
     
     def sub(self, replacement, content):
@@ -63,10 +116,22 @@ class patterns:
     no_argument = r'\[%s\]'
     self_closing_tag = r'\[%s\s*/\]'
     single_argument = r'\[%s(\]|="?(?P<argument>[^\]]+)"?\])'
-    argument = r'( (\w+)=([^\] ]+))?'
+    argument = r'( (\w+)=([^\] ]+))?' # one per argument, prefer arguments
+    arguments = r'((?: \w+=[^\] ]+)*)'
     closing = r'\[/%s\]'
     unmatchable = UnmatchablePseudoPattern()
      
+def get_setting(name, default):
+    """
+    Get a setting from django settings or return default if django is not
+    available.
+    """
+    try:
+        from django.conf import settings
+        return getattr(settings, name, default)
+    except (ImportError, EnvironmentError):
+        return default
+
 def get_tag_name(klass):
     """
     Convert a class to tagname
@@ -75,6 +140,8 @@ def get_tag_name(klass):
 
 class NeedsSubclassingError(Exception): pass
 class ParserError(Exception): pass
+class StopValidation(Exception): pass
+class BudgetExceeded(Exception): pass
 
 
 class SoftException(object):
@@ -87,6 +154,34 @@ class SoftException(object):
     __unicode__ = __str__
 
 
+class Event(object):
+    """
+    Passed to the listeners of a Library (see Library.add_listener).
+    
+    phase is 'tokenize', 'tree' or 'parse' (the parse method of a tag, whose
+    class is tag). size and output_size are the lengths of the input and the
+    output (None for 'tokenize' and 'tree'), elapsed is the time it took in
+    seconds and own_elapsed the part of it not spent in nested tags.
+    
+    Parsers also send 'render' and 'validate' events for a whole content and
+    bbcode.cache 'cache hit' and 'cache miss' events, these have the namespaces
+    of the parser and the number of errors. output_size is None for 'validate'
+    and if the content could not be parsed. 'parse' events have the node.
+    """
+    def __init__(self, phase, tag, size, output_size, elapsed, own_elapsed,
+                 lineno=None, namespaces=None, errors=0, node=None):
+        self.phase = phase
+        self.tag = tag
+        self.size = size
+        self.output_size = output_size
+        self.elapsed = elapsed
+        self.own_elapsed = own_elapsed
+        self.lineno = lineno
+        self.namespaces = namespaces
+        self.errors = errors
+        self.node = node
+
+
 class SoftExceptionManager(object):
     """
     Allows 'soft exceptions'. Soft exceptions are exceptions which don't break
@@ -120,8 +215,98 @@ class SoftExceptionManager(object):
         self.exceptions = []
         return old
 
-sem = SoftExceptionManager()
-soft_raise = sem.soft_raise
+
+class ParseContext(SoftExceptionManager):
+    """
+    The state of a single parse or validate run. Each call to parse or validate
+    creates its own ParseContext which is handed to every node of the parse
+    tree, so concurrent runs never share errors or line numbers.
+    
+    While a run is in progress its context is also the active context of the
+    current thread, which is used by the module level soft_raise for tags not
+    using Node.soft_raise.
+    
+    If fail_fast is True, the first soft exception raises StopValidation. If a
+    deadline (a timestamp) is given, rendering raises BudgetExceeded once it is
+    passed. It is checked after tokenizing, between nodes and while running
+    brainfuck programs, so a single step (eg. tokenizing the content or
+    highlighting a code block) is not interrupted and can run past it.
+    """
+    def __init__(self, fail_fast=False, deadline=None):
+        SoftExceptionManager.__init__(self)
+        self.fail_fast = fail_fast
+        self.deadline = deadline
+        # listeners of the parse events of tags and the time spent in the
+        # tags being parsed, see parse_nodes
+        self.tag_listeners = []
+        self.nested_elapsed = []
+        # set by Library.build_tree, see SubtreeCache
+        self.subtree_cache = None
+        
+    def check_budget(self):
+        """
+        Raise BudgetExceeded if the deadline has passed.
+        """
+        if self.deadline is not None and time.time() > self.deadline:
+            raise BudgetExceeded, "Rendering exceeded its time budget"
+        
+    def soft_raise(self, exception):
+        SoftExceptionManager.soft_raise(self, exception)
+        if self.fail_fast:
+            raise StopValidation
+        
+    def activate(self):
+        """
+        Make this the active context of the current thread.
+        """
+        _get_context_stack().append(self)
+        
+    def deactivate(self):
+        """
+        Restore the previously active context of the current thread.
+        """
+        stack = _get_context_stack()
+        if self in stack:
+            stack.remove(self)
+
+
+_local = threading.local()
+
+def _get_context_stack():
+    if not hasattr(_local, 'stack'):
+        _local.stack = [ParseContext()]
+    return _local.stack
+
+def get_parse_context():
+    """
+    Get the active ParseContext of the current thread.
+    """
+    return _get_context_stack()[-1]
+
+
+class ActiveContextProxy(object):
+    """
+    Backwards compatible replacement for the former global
+    SoftExceptionManager instance. Delegates to the active ParseContext of the
+    current thread.
+    """
+    def set_line_number(self, number):
+        get_parse_context().set_line_number(number)
+        
+    def soft_raise(self, exception):
+        get_parse_context().soft_raise(exception)
+        
+    def pull(self):
+        return get_parse_context().pull()
+    
+sem = ActiveContextProxy()
+
+def soft_raise(exception):
+    """
+    Soft raise an exception in the active ParseContext of the current thread.
+    """
+    get_parse_context().soft_raise(exception)
+
 
 class VariableScope(dict):
     def add(self, name, value):
@@ -149,6 +334,283 @@ class VariableScope(dict):
         return Lazy(self.resolve, context)
 
 
+class SubtreeCache(object):
+    """
+    The html of parse subtrees shared by all parses, so a block appearing in
+    many contents (eg. a post quoted by every reply of a thread) is only
+    rendered once. Entries are keyed by the digests of the subtrees (see
+    get_digest). Only subtrees of at least min_size characters which are
+    rendered without errors and without variables are kept, and only html of
+    at most max_size characters, so the cache holds at most size * max_size
+    characters (nested tags each keep their own html).
+    
+    Enable it with settings.BBCODE_SUBTREE_CACHE (the number of entries, see
+    autodiscover) or by setting lib.subtree_cache. Entries are kept in two
+    generations of size / 2 entries: when the recent one is full, it replaces
+    the old one. Entries found in the old one are moved to the recent one, so
+    the least recently used entries are dropped.
+    """
+    def __init__(self, size=1000, min_size=128, max_size=65536):
+        self.generation = max(size // 2, 1)
+        self.min_size = min_size
+        self.max_size = max_size
+        self.clear()
+    
+    def clear(self):
+        self.recent = {}
+        self.old = {}
+        self.hits = 0
+        self.misses = 0
+    
+    def cacheable(self, node):
+        return (node.digest is not None and not node.variables
+                and node.end - node.start >= self.min_size)
+    
+    def get(self, node):
+        """
+        Returns the html of a subtree equal to node or None.
+        """
+        if not self.cacheable(node):
+            return None
+        html = self.recent.get(node.digest)
+        if html is None:
+            html = self.old.get(node.digest)
+            if html is None:
+                self.misses += 1
+                return None
+            self.store(node.digest, html)
+        self.hits += 1
+        return html
+    
+    def set(self, node, html):
+        if len(html) <= self.max_size and self.cacheable(node):
+            self.store(node.digest, html)
+    
+    def store(self, digest, html):
+        if len(self.recent) >= self.generation:
+            self.old = self.recent
+            self.recent = {}
+        self.recent[digest] = html
+    
+    def get_hit_rate(self):
+        lookups = self.hits + self.misses
+        return lookups and float(self.hits) / lookups or 0.0
+
+
+def clear_digests(node):
+    """
+    Remove the digests of the tags within a node, so they are not cached.
+    """
+    stack = [node.nodes]
+    while stack:
+        for child in stack.pop():
+            # the tags within tags which are not pure are already cleared
+            if not child.is_text_node and child.pure:
+                child.digest = None
+                stack.append(child.nodes)
+
+
+def get_digest(node, closing):
+    """
+    Returns the digest of a closed tag node from its class, its opening and
+    closing tag and its child nodes: their texts and the digests of tags, so
+    equal subtrees have equal digests without hashing all their content again.
+    Returns None if the node or a nested tag is not pure (see Node.pure).
+    """
+    if not node.pure:
+        return None
+    klass = node.__class__
+    parts = ['%s.%s' % (klass.__module__, klass.__name__), node.match.group(),
+             closing]
+    for child in node.nodes:
+        if child.is_text_node:
+            # texts are prefixed by their length, digests have no spaces
+            parts.append('%d %s' % (len(child.text), child.text))
+        elif child.digest is None:
+            return None
+        else:
+            parts.append(child.digest)
+    joined = '\0'.join(parts)
+    if isinstance(joined, unicode):
+        joined = joined.encode('utf-8')
+    return hashlib.md5(joined).hexdigest()
+
+
+def parse_nodes(nodes, parse_context):
+    """
+    Parse a list of sibling nodes and return their combined contents.
+    
+    Tags with render_inner_first set are parsed after their child nodes, which
+    are kept on an explicit stack instead of nesting parse calls, so deeply
+    nested tags (eg. long quote chains) need no recursion. Other tags are
+    parsed by calling their parse method.
+    
+    If the parse context has tag listeners (see Library.add_listener), each
+    tag is timed from the moment it is pushed on the stack (or its parse
+    method is called) until it is parsed, and a 'parse' Event is sent.
+    
+    If the parse context has a SubtreeCache, tags with a digest are taken from
+    it and stored in it.
+    
+    Errors are reported on the line of the tag raising them, the line number
+    of the parse context is restored once the nodes are parsed so errors of
+    the enclosing tag are reported on its line too.
+    """
+    output = []
+    exceptions = parse_context.exceptions
+    lineno = parse_context.line_number
+    cache = parse_context.subtree_cache
+    timed = bool(parse_context.tag_listeners)
+    nested = parse_context.nested_elapsed
+    depth = len(nested)
+    started = None
+    # [tag, iterator over its child nodes, their contents, number of errors
+    #  before them, the time it was pushed if timed]
+    stack = [[None, iter(nodes), output, 0, None]]
+    try:
+        while True:
+            entry = stack[-1]
+            for node in entry[1]:
+                # text escaped in advance, see escape_text_nodes
+                if node.escaped is not None:
+                    entry[2].append(node.escaped)
+                    continue
+                parse_context.check_budget()
+                if cache is not None and node.digest is not None:
+                    content = cache.get(node)
+                    if content is not None:
+                        entry[2].append(content)
+                        continue
+                if node.is_text_node:
+                    entry[2].append(node.parse())
+                    continue
+                parse_context.line_number = node.lineno
+                errors = len(exceptions)
+                if timed:
+                    nested.append(0)
+                    started = time.time()
+                if node.render_inner_first and node.nodes:
+                    node.prepare_inner()
+                    stack.append([node, iter(node.nodes), [], errors, started])
+                    break
+                content = node.parse()
+                if timed:
+                    notify_parse(parse_context, node, content, started)
+                if (cache is not None and node.digest is not None
+                    and len(exceptions) == errors):
+                    cache.set(node, content)
+                entry[2].append(content)
+            else:
+                node, children, inner, errors, started = stack.pop()
+                if node is None:
+                    parse_context.line_number = lineno
+                    return ''.join(output)
+                parse_context.line_number = node.lineno
+                node.rendered_inner = ''.join(inner)
+                inner_errors = len(exceptions)
+                try:
+                    content = node.parse()
+                finally:
+                    del node.rendered_inner
+                if timed:
+                    notify_parse(parse_context, node, content, started)
+                # errors of the tag itself go before those of its child nodes
+                if len(exceptions) > inner_errors:
+                    exceptions[errors:] = (exceptions[inner_errors:]
+                                           + exceptions[errors:inner_errors])
+                elif (cache is not None and node.digest is not None
+                      and len(exceptions) == errors):
+                    cache.set(node, content)
+                stack[-1][2].append(content)
+    finally:
+        # the tags left on the stack if parsing failed
+        del nested[depth:]
+
+
+def notify_parse(parse_context, node, output, started):
+    """
+    Send the 'parse' Event of a tag parsed by parse_nodes to the tag listeners
+    of the parse context. The time spent in the tags within it is taken from
+    parse_context.nested_elapsed.
+    """
+    elapsed = time.time() - started
+    nested = parse_context.nested_elapsed
+    own_elapsed = elapsed - nested.pop()
+    if nested:
+        nested[-1] += elapsed
+    event = Event('parse', node.__class__, len(node.raw_content),
+                  len(output or ''), elapsed, own_elapsed, node.lineno,
+                  node=node)
+    for listener in list(parse_context.tag_listeners):
+        listener(event)
+
+
+def text_nodes(nodes, sizes=None):
+    """
+    Returns the combined plain text of a list of sibling nodes, see Node.text.
+    
+    Like parse_nodes, the child nodes of tags with render_inner_first set are
+    converted first, keeping them on an explicit stack, and text_inner returns
+    their text, so deeply nested tags need no recursion.
+    
+    If sizes is a dictionary, the length of the text of each tag converted
+    (by id) is stored in it, see truncate_tree.
+    """
+    output = []
+    # [tag, iterator over its child nodes, their texts]
+    stack = [[None, iter(nodes), output]]
+    while True:
+        entry = stack[-1]
+        for node in entry[1]:
+            if node.is_text_node:
+                entry[2].append(node.variables.resolve(node.text))
+            elif node.render_inner_first and node.nodes:
+                stack.append([node, iter(node.nodes), []])
+                break
+            else:
+                text = node.text()
+                if sizes is not None:
+                    sizes[id(node)] = len(text)
+                entry[2].append(text)
+        else:
+            node, children, inner = stack.pop()
+            if node is None:
+                return ''.join(output)
+            node.inner_text = ''.join(inner)
+            try:
+                text = node.text()
+            finally:
+                del node.inner_text
+            if sizes is not None:
+                sizes[id(node)] = len(text)
+            stack[-1][2].append(text)
+
+
+def escape_text_nodes(head):
+    """
+    Escape the text of all text nodes of a parse tree at once, so parsing a
+    text node only returns its escaped attribute. The texts of the text nodes
+    created by Library.build_tree are joined, escaped in one go and split
+    again. Returns False (and escapes nothing) if the text has to be resolved
+    when it is parsed: if variables are defined before parsing (eg. by
+    Parser.render_chunks) or a tag of the tree defines them while parsing (see
+    Node.defines_variables).
+    """
+    textnodes = head.textnodes
+    if textnodes is None or head.variables:
+        return False
+    if not textnodes:
+        return True
+    joined = '\0'.join([node.text for node in textnodes])
+    if joined.count('\0') != len(textnodes) - 1:
+        return False
+    # like VariableScope.resolve without variables
+    joined = SEPARATED_QUOTES_PATTERN.sub('\0', joined).strip('"')
+    for node, text in izip(textnodes, cgi.escape(joined).split('\0')):
+        node.escaped = text
+    return True
+
+
 class Node(object):
     """
     This is the baseclass for all objects in a BBCode Parse Tree.
@@ -170,6 +632,26 @@ class Node(object):
     name = 'node'
     
     is_text_node = False
+    validate_inner = True # see validate
+    raw_content = ''
+    # parse only uses the child nodes through parse_inner, so they can be
+    # parsed before the node itself, see parse_nodes
+    render_inner_first = False
+    # tags adding to the variable scope while parsing (eg. [def]) must set
+    # this, text nodes are not escaped in advance then, see escape_text_nodes
+    defines_variables = False
+    # the html of a text node, set by escape_text_nodes
+    escaped = None
+    # text of the child nodes if they were converted first, see text_nodes
+    inner_text = None
+    # the html of the tag only depends on its class, its source and its child
+    # nodes. Tags depending on anything else (eg. their parent or global
+    # state) or changing the tags within them (like [args]) must set this to
+    # False, they are not cached, nor are the tags containing them or within
+    # them, see SubtreeCache
+    pure = True
+    # set by Library.build_tree if the library has a subtree cache
+    digest = None
     
     def __init__(self, parent, match, fullcontent, context=None):
         """
@@ -178,24 +660,28 @@ class Node(object):
         argument.
         """
         self.start = match.start()
+        self.end = None
         self.fullcontent = fullcontent
-        self.raw_content = ''
         self.parent = parent
         self.match = match
         self.nodes = []
         self.context = context # for django only
-        # copy the variable scope
+        # copy the variable scope and the parse context
         self.variables = parent.variables
+        self.parse_context = parent.parse_context
+        self.lineno = self.parse_context.line_number
         
     def soft_raise(self, errmsg):
-        soft_raise(errmsg)
+        self.parse_context.soft_raise(errmsg)
         return self.raw_content
     
     def append(self, text):
         """
-        Adds a text node to the node
+        Adds a text node to the node and returns it
         """
-        self.nodes.append(TextNode(self, text))
+        node = TextNode(self, text)
+        self.nodes.append(node)
+        return node
     
     def push(self, nodeklass, match, fullcontent):
         """
@@ -214,17 +700,22 @@ class Node(object):
     
     def pull(self, end):
         """
-        Pulls all text nodes and returns the parent
+        Replaces the (last) node in its parent by the text of its opening tag
+        and its child nodes. Returns the parent.
         """
-        self.parent.nodes.append(TextNode(self.fullcontent[self.start:end]))
-        return self.parent
+        parent = self.parent
+        parent.nodes.pop()
+        parent.append(self.match.group())
+        for node in self.nodes:
+            node.parent = parent
+        parent.nodes.extend(self.nodes)
+        return parent
     
     def close(self, end):
         """
         When closing the node just return the parent.
         """
         self.end = end
-        self.raw_content = self.fullcontent[self.start:end]
         return self.parent
     
     def parse(self):
@@ -233,6 +724,37 @@ class Node(object):
         return a string and fail silently.
         """
         raise NeedsSubclassingError
+    
+    def prepare_inner(self):
+        """
+        Called before the child nodes of a tag with render_inner_first set are
+        parsed (see parse_nodes), eg. to change their arguments.
+        """
+        pass
+    
+    def validate(self):
+        """
+        Checks the arguments and nesting of this node (not its child nodes)
+        without parsing it, reporting problems with soft_raise. Used by quick
+        validation, so this should be cheap. Child nodes are validated after
+        this node unless validate_inner is False (eg. if they are not parsed).
+        """
+        pass
+    
+    def text(self):
+        """
+        Returns the content of this node as plain text without any markup, eg.
+        for search indexes or e-mails. Defaults to the text of the child nodes.
+        """
+        return self.text_inner()
+    
+    def text_inner(self):
+        """
+        Shortcut for the combined plain text of all inner nodes.
+        """
+        if self.inner_text is not None:
+            return self.inner_text
+        return text_nodes(self.nodes)
         
 
 class HeadNode(Node):
@@ -240,11 +762,16 @@ class HeadNode(Node):
     The head node of the BBCode parse tree.
     """
     name = 'head'
-    def __init__(self, raw_content, context=None):
+    # the text nodes to escape at once or None, see escape_text_nodes
+    textnodes = None
+    def __init__(self, raw_content, context=None, parse_context=None):
         self.raw_content = raw_content
         self.nodes = []
         self.context = context
         self.variables = VariableScope()
+        if parse_context is None:
+            parse_context = get_parse_context()
+        self.parse_context = parse_context
     
     def pull(self, end):
         raise ParserError, "Cannot pull from headnode, invalid BBCode Tree"
@@ -253,11 +780,8 @@ class HeadNode(Node):
         raise ParserError, "Cannot close headnode, invalid BBCode Tree"
     
     def parse(self):
-        content = ''
-        failed  = []
-        for node in self.nodes:
-            content += node.parse()
-        return content
+        escape_text_nodes(self)
+        return parse_nodes(self.nodes, self.parse_context)
     
     
 class TextNode(Node):
@@ -266,6 +790,7 @@ class TextNode(Node):
     def __init__(self, parent, text):
         self.text = text
         self.variables = parent.variables
+        self.parse_context = parent.parse_context
         self.parent = parent
         self.raw_content = text
         self.nodes = []
@@ -289,6 +814,8 @@ class TextNode(Node):
         """
         Return cgi-escaped content
         """
+        if self.escaped is not None:
+            return self.escaped
         return cgi.escape(self.variables.resolve(self.text))
     
     def __str__(self):
@@ -303,14 +830,27 @@ class TagNode(Node):
     def close_pattern():
         raise NeedsSubclassingError
     
+    # contents of the child nodes if they were parsed first, see parse_nodes
+    rendered_inner = None
+    
+    @property
+    def raw_content(self):
+        """
+        The source of the tag ('' until it is closed). It is sliced on access,
+        as keeping a copy for every node takes quadratic memory in the depth
+        of nested tags.
+        """
+        if self.end is None:
+            return ''
+        return self.fullcontent[self.start:self.end]
+    
     def parse_inner(self):
         """
         Shortcut for parsing all inner nodes and return their combined contents.
         """
-        inner = ''
-        for node in self.nodes:
-            inner += node.parse()
-        return inner
+        if self.rendered_inner is not None:
+            return self.rendered_inner
+        return parse_nodes(self.nodes, self.parse_context)
     
     def __str__(self):
         return self.__class__.__name__
@@ -332,7 +872,7 @@ class ReplaceTagNode(TagNode):
         if not hasattr(self, 'tagname'):
             self.tagname = self.__class__.__name__.lower()
         TagNode.__init__(self, parent, match, content, context)
-        
+    
     def parse(self):
         return '<%s>%s</%s>' % (self.tagname, self.parse_inner(), self.tagname)
     
@@ -366,19 +906,17 @@ class MultiArgumentTagNode(TagNode):
     """
     TagNode which takes multiple (or no) arguments. Must have an attribute
     _arguments which holds key, value pairs of the arguments and their defaults.
-    Open pattern should use bbcode.patterns.argument as argument matching
-    expression.
+    Open pattern should use bbcode.patterns.arguments as argument matching
+    expression. (Repeating bbcode.patterns.argument once per argument works
+    too, but backtracks a lot on tags which are not closed.)
     """
     _arguments   = []
     def __init__(self, parent, match, content, context):
         TagNode.__init__(self, parent, match, content, context)
-        args = match.groups()
         kwargs = dict(self._arguments)
-        for index, value in enumerate(filter(bool, args)):
-            if not index or not index % 3:
-                continue
-            if not (index + 1) % 3:
-                kwargs[args[index - 1]] = self.variables.lazy_resolve(value)
+        opening = match.group().split(']', 1)[0]
+        for name, value in ARGUMENT_PATTERN.findall(opening):
+            kwargs[name] = self.variables.lazy_resolve(value)
         self.arguments = _MultiArgs(kwargs)
         
     def __str__(self):
@@ -396,13 +934,15 @@ class SelfClosingTagNode(TagNode):
     
     def __init__(self, parent, match, content, context):
         self.start = match.start()
+        self.end = match.end()
         self.context = context
         self.fullcontent = content
-        self.raw_content = content[match.start():match.end()]
         self.parent = parent
         self.match = match
         self.nodes = []
         self.variables = parent.variables
+        self.parse_context = parent.parse_context
+        self.lineno = self.parse_context.line_number
     
     def pushed(self):
         """
@@ -411,6 +951,9 @@ class SelfClosingTagNode(TagNode):
         """
         return self.parent
     
+    def text(self):
+        return ''
+    
     def __str__(self):
         return 'SelfClosingTag: %s' % self.__class__.__name__
     
@@ -426,6 +969,60 @@ class AutoDict(dict):
         return dict.__getitem__(self, item)
     
     
+MANIFEST_LINE = re.compile(r'^(?:(?P<triggers>triggers)\s*=|register\((?P<register>\w+)\)'
+                           r'|class\s+(?P<klass>\w+)|\s+(?P<attr>tagname|namespaces)\s*=)')
+
+def _read_literal(lines, index):
+    """
+    Evaluate the (possibly multi line) value of the assignment in lines[index]
+    """
+    source = lines[index].split('=', 1)[1].strip()
+    for line in lines[index + 1:]:
+        try:
+            return ast.literal_eval(source)
+        except SyntaxError:
+            source += '\n' + line
+    return ast.literal_eval(source)
+
+def read_tag_module(filename):
+    """
+    Read the manifest of a bbtags module without importing (or compiling) it.
+    Returns a tuple of the module's 'triggers' and a list of (tag name,
+    namespaces) for each registered class, or None if the module does not define
+    'triggers'.
+    """
+    lines = open(filename).read().splitlines()
+    triggers = None
+    classes = {}
+    registered = []
+    klass = None
+    for index, line in enumerate(lines):
+        match = MANIFEST_LINE.match(line)
+        if not match:
+            continue
+        gd = match.groupdict()
+        if gd['triggers']:
+            triggers = tuple(_read_literal(lines, index))
+        elif gd['register']:
+            registered.append(gd['register'])
+        elif gd['klass']:
+            klass = gd['klass']
+            classes[klass] = {}
+        elif klass:
+            try:
+                classes[klass][gd['attr']] = _read_literal(lines, index)
+            except (ValueError, SyntaxError):
+                pass
+    if triggers is None:
+        return None
+    tags = []
+    for name in registered:
+        attrs = classes.get(name, {})
+        tags.append((attrs.get('tagname', name.lower()),
+                     [name.lower()] + list(attrs.get('namespaces', []))))
+    return triggers, tags
+
+
 class Library(object):
     """
     The core of the BBCode parser. Keeps track of all bbcode tags and text
@@ -439,7 +1036,78 @@ class Library(object):
         self.names = AutoDict(None)
         self.raw_names = {}
         self.tags = AutoDict(set)
+        # the default namespace is known before any tag is registered or a
+        # lazy tag module is imported
+        self.tags['__all__']
         self.klasses = AutoDict(None)
+        self.compiled = {}
+        self.lazy_modules = []
+        # triggers of all modules added lazily, imported or not
+        self.lazy_triggers = {}
+        self.help_cache = {}
+        self.fingerprint = None
+        self.modified = time.time()
+        self.listeners = []
+        self.tag_listeners = []
+        # see SubtreeCache
+        self.subtree_cache = None
+    
+    def changed(self):
+        """
+        Called when tags or namespaces change. Resets the registry fingerprint.
+        """
+        self.fingerprint = None
+        self.modified = time.time()
+        # replaced rather than cleared, other threads may be reading it
+        self.help_cache = {}
+        
+    def add_listener(self, listener, tags=True):
+        """
+        Call listener with an Event after tokenizing a content, building a
+        parse tree and rendering or validating it and, if tags is True, after
+        parsing each tag (see parse_nodes). Tags are only timed while there are
+        listeners for them.
+        """
+        self.listeners.append(listener)
+        if tags:
+            self.tag_listeners.append(listener)
+        
+    def remove_listener(self, listener):
+        self.listeners.remove(listener)
+        if listener in self.tag_listeners:
+            self.tag_listeners.remove(listener)
+            
+    def notify(self, event):
+        for listener in list(self.listeners):
+            listener(event)
+            
+    def get_fingerprint(self):
+        """
+        Get a hash of all registered tags and their namespaces. It changes
+        whenever a tag is registered or added to or removed from a namespace.
+        
+        Lazy tag modules (see add_lazy_module) are represented by their name
+        and triggers, imported or not, so the fingerprint is the same in all
+        processes using the same tags, whatever they have parsed so far.
+        """
+        fingerprint = self.fingerprint
+        if fingerprint is not None:
+            return fingerprint
+        LIBRARY_LOCK.acquire()
+        try:
+            entries = []
+            for ns, klasses in self.tags.items():
+                for klass in klasses:
+                    if klass.__module__ in self.lazy_triggers:
+                        continue
+                    entries.append('%s:%s.%s' % (ns, klass.__module__, klass.__name__))
+            for name, triggers in self.lazy_triggers.items():
+                entries.append('%s[%s]' % (name, ','.join(triggers)))
+            fingerprint = hashlib.md5('\n'.join(sorted(entries))).hexdigest()
+            self.fingerprint = fingerprint
+        finally:
+            LIBRARY_LOCK.release()
+        return fingerprint
     
     def convert(self, name):
         """
@@ -462,45 +1130,55 @@ class Library(object):
         """
         Register a BBCode Tag Node
         """
-        # Add the class to their namespaces.
-        if hasattr(klass, 'namespaces'):
-            for ns in klass.namespaces:
-                self.tags[ns].add(klass)
-                if not hasattr(klass, 'not_in_all') or not klass.not_in_all:
-                    self.tags['__all__'].add(klass)
-        elif not hasattr(klass, 'not_in_all') or not klass.not_in_all:
-            self.tags['__all__'].add(klass)
-        if not hasattr(klass, 'namespaces'):
-            setattr(klass, 'namespaces', [])
-        d_namespaces = self.get_default_namespaces(klass)
-        for default in d_namespaces:
-            self.tags[default].add(klass)
-        for ns in reversed(d_namespaces):
-            klass.namespaces.insert(0, ns)
-        # Register documentation
-        docstrings = klass.__doc__
-        if hasattr(klass, 'tagname'):
-            tagname = klass.tagname
-        else:
-            tagname = klass.__name__.lower()
-        if docstrings:
-            if hasattr(klass, 'verbose_name'):
-                verbose_name = klass.verbose_name
+        LIBRARY_LOCK.acquire()
+        try:
+            # Add the class to their namespaces.
+            if hasattr(klass, 'namespaces'):
+                for ns in klass.namespaces:
+                    self.tags[ns].add(klass)
+                    if not hasattr(klass, 'not_in_all') or not klass.not_in_all:
+                        self.tags['__all__'].add(klass)
+            elif not hasattr(klass, 'not_in_all') or not klass.not_in_all:
+                self.tags['__all__'].add(klass)
+            if not hasattr(klass, 'namespaces'):
+                setattr(klass, 'namespaces', [])
+            d_namespaces = self.get_default_namespaces(klass)
+            for default in d_namespaces:
+                self.tags[default].add(klass)
+            for ns in reversed(d_namespaces):
+                klass.namespaces.insert(0, ns)
+            # Register documentation
+            docstrings = klass.__doc__
+            if hasattr(klass, 'tagname'):
+                tagname = klass.tagname
             else:
-                verbose_name = self.convert(klass.__name__)
-            self.names[tagname] = {'docs': docstrings.strip(),
-                                   'name': verbose_name,
-                                   'class': klass}
-            self.klasses[klass] = self.names[tagname]
-        self.raw_names[klass.__name__] = klass
+                tagname = klass.__name__.lower()
+            if docstrings:
+                if hasattr(klass, 'verbose_name'):
+                    verbose_name = klass.verbose_name
+                else:
+                    verbose_name = self.convert(klass.__name__)
+                self.names[tagname] = {'docs': docstrings.strip(),
+                                       'name': verbose_name,
+                                       'class': klass}
+                self.klasses[klass] = self.names[tagname]
+            self.raw_names[klass.__name__] = klass
+            self.changed()
+        finally:
+            LIBRARY_LOCK.release()
         
     def add_namespace(self, klass, *namespaces):
         """
         Add a tag to a namespace or several namespaces
         """
         if isinstance(klass, TagNode):
-            for namespace in namespaces:
-                self.tags[namespace].add(klass)
+            LIBRARY_LOCK.acquire()
+            try:
+                for namespace in namespaces:
+                    self.tags[namespace].add(klass)
+                self.changed()
+            finally:
+                LIBRARY_LOCK.release()
         elif isinstance(klass, basestring):
             if klass in self.raw_names:
                 self.add_namespace(self.raw_names[klass], *namespaces)
@@ -512,9 +1190,14 @@ class Library(object):
         Remove a tag from a namespace or several namespaces
         """
         if isinstance(klass, TagNode):
-            for namespace in namespaces:
-                if klass in self.tags[namespace]:
-                    self.tags[namespace].remove(klass)
+            LIBRARY_LOCK.acquire()
+            try:
+                for namespace in namespaces:
+                    if klass in self.tags[namespace]:
+                        self.tags[namespace].remove(klass)
+                self.changed()
+            finally:
+                LIBRARY_LOCK.release()
         elif isinstance(klass, basestring):
             if klass in self.raw_names:
                 self.add_namespace(self.raw_names[klass], *namespaces)
@@ -530,27 +1213,102 @@ class Library(object):
         else:
             self.add_namespace(klass, '__all__')
             
+    def add_lazy_module(self, name, filename):
+        """
+        Add a bbtags module which is only imported once a content contains one
+        of its triggers. Returns False if the module has no manifest and must be
+        imported right away.
+        """
+        manifest = read_tag_module(filename)
+        if manifest is None:
+            return False
+        triggers, tags = manifest
+        bits = name.split('.')
+        LIBRARY_LOCK.acquire()
+        try:
+            for tagname, namespaces in tags:
+                # make the namespaces known before the module is imported
+                for ns in [bits[-1], bits[-3]] + namespaces:
+                    self.tags[ns]
+            self.lazy_modules.append((name, triggers))
+            self.lazy_triggers[name] = triggers
+            self.changed()
+        finally:
+            LIBRARY_LOCK.release()
+        return True
+    
+    def load_module(self, name):
+        """
+        Import a lazy bbtags module.
+        
+        Threads rendering their first contents import the same modules at
+        once, so the module is looked up again with the lock held. The import
+        lock is acquired before LIBRARY_LOCK: a thread importing a tag module
+        holds the import lock and waits for LIBRARY_LOCK to register its tags.
+        """
+        imp.acquire_lock()
+        try:
+            LIBRARY_LOCK.acquire()
+            try:
+                for entry in self.lazy_modules:
+                    if entry[0] == name:
+                        __import__(name)
+                        self.lazy_modules.remove(entry)
+                        return
+            finally:
+                LIBRARY_LOCK.release()
+        finally:
+            imp.release_lock()
+    
+    def load_for(self, content):
+        """
+        Import all lazy bbtags modules triggered by content.
+        """
+        # load_module checks again if the module is still lazy
+        for name, triggers in list(self.lazy_modules):
+            for trigger in triggers:
+                if trigger in content:
+                    self.load_module(name)
+                    break
+    
+    def load_all(self):
+        """
+        Import all lazy bbtags modules.
+        """
+        for name, triggers in list(self.lazy_modules):
+            self.load_module(name)
+    
     def get_help(self, *tags):
         """
         Get help for a tag or for all tags.
         
-        Returns a dictionary with keys 'name', 'tag', 'docstring'.
+        Returns a dictionary with keys 'name', 'tag', 'docstring'. The rendered
+        help is cached until the registry fingerprint changes.
         """
+        # docstrings may use any tag
+        autodiscover()
+        self.load_all()
         if not tags:
             tags = self.get_tags()
         help_objects = []
         for tag in tags:
-            if issubclass(tag, Node):
-                obj = self.klasses[tag]
+            if isinstance(tag, basestring):
+                obj = self.names[tag]
                 if obj is None:
                     continue
             else:
-                obj = self.names[tag]
+                obj = self.klasses[tag]
                 if obj is None:
                     continue
-            help_objects.append({'name': obj['name'],
-                                 'docstring': parse(obj['docs'], strict=False, auto_discover=True)[0],
-                                 'obj': obj['class']})
+            key = (self.get_fingerprint(), obj['class'])
+            # changed() may replace the cache at any time, read it once
+            help_object = self.help_cache.get(key)
+            if help_object is None:
+                help_object = {'name': obj['name'],
+                               'docstring': self.dsparse(obj['docs']),
+                               'obj': obj['class']}
+                self.help_cache[key] = help_object
+            help_objects.append(help_object)
         return help_objects
     
     def get_tags(self, namespaces=None):
@@ -583,45 +1341,102 @@ class Library(object):
             tags = tags.difference(self.tags[ns])
         return tags
     
-    def get_taglist(self, content, namespaces=None):
+    def get_tokenizers(self, namespaces=None):
         """
-        Get the tag-match list of a content for given namespaces
+        Get a list of (tagklass, open_pattern, close_pattern) tuples with
+        compiled patterns for the tags of the namespaces
         """
         if namespaces is None:
             namespaces = get_default_namespaces()
-        tags = self.get_tags(namespaces)
-        # Build tag list
-        taglist = []
-        for tagklass in tags:
+        return [self.get_tokenizer(tagklass)
+                for tagklass in self.get_tags(namespaces)]
+    
+    def get_tokenizer(self, tagklass):
+        """
+        Get the (tagklass, open_pattern, close_pattern) tuple of a tag
+        """
+        if tagklass not in self.compiled:
             op = tagklass.open_pattern
             if callable(op):
                 op = op()
-            i = 1
-            for match in op.finditer(content):
-                i += 1
-                taglist.append((match.start(), match, tagklass, True))
             cp = tagklass.close_pattern
             if callable(cp):
                 cp = cp()
+            self.compiled[tagklass] = (tagklass, op, cp)
+        return self.compiled[tagklass]
+    
+    def get_taglist(self, content, namespaces=None, tokenizers=None):
+        """
+        Get the tag-match list of a content for given namespaces
+        """
+        if tokenizers is None:
+            tokenizers = self.get_tokenizers(namespaces)
+        if self.listeners:
+            start = time.time()
+        # Build tag list
+        taglist = []
+        for tagklass, op, cp in tokenizers:
+            for match in op.finditer(content):
+                taglist.append((match.start(), match, tagklass, True))
             for match in cp.finditer(content):
                 taglist.append((match.start(), match, tagklass, False))
-        # Sort by position
-        return sorted(taglist)
+        # Sort by position, the longest of the matches at the same position
+        # first (comparing the matches themselves would order them by their
+        # address)
+        taglist.sort(key=lambda item: (item[0], -item[1].end()))
+        if self.listeners:
+            elapsed = time.time() - start
+            self.notify(Event('tokenize', None, len(content), None, elapsed,
+                              elapsed))
+        return taglist
     
-    def get_parse_tree(self, content, namespaces=None, context=None):
+    def get_parse_tree(self, content, namespaces=None, context=None,
+                       parse_context=None, strict=True):
         """
         Prepare content for parsing.
         Returns a HeadNode instance
         """
-        if namespaces is None:
-            namespaces = get_default_namespaces()
+        self.load_for(content)
         taglist = self.get_taglist(content, namespaces)
+        return self.build_tree(content, taglist, context, parse_context,
+                               strict=strict)
+    
+    def build_tree(self, content, taglist, context=None, parse_context=None,
+                   partial=False, strict=True):
+        """
+        Build the parse tree of content from its tag-match list.
+        Returns a HeadNode instance
+        
+        If partial is True, content is the beginning of a longer content: tags
+        still open at its end are closed there, with the text after the last
+        tag in the innermost of them.
         
+        A closing tag without an open tag of its class raises ParserError if
+        strict is True and is kept as text otherwise.
+        
+        If the library has a subtree cache, the digest of each tag is computed
+        when it is closed (see get_digest), unless partial is True.
+        """
+        if self.listeners:
+            started = time.time()
         # Get headnode
-        headnode = HeadNode(content, context)
+        headnode = HeadNode(content, context, parse_context)
+        parse_context = headnode.parse_context
+        # the content was tokenized in the meantime
+        parse_context.check_budget()
         
         lastpos = 0
+        lineno = 1
         currentnode = headnode
+        # text nodes are escaped at once when the tree is parsed, unless tags
+        # define variables
+        textnodes = headnode.textnodes = []
+        cache = not partial and self.subtree_cache or None
+        parse_context.subtree_cache = cache
+        parse_context.tag_listeners = self.tag_listeners
+        # number of open nodes of each tag class, so closing tags without an
+        # open node are found without walking up the tree
+        opened = {}
         # Loop over tag matches
         for pos, match, tagklass, opener in taglist:
             start, end = match.span()
@@ -631,66 +1446,97 @@ class Library(object):
             # Append text between last tag and this one
             text = content[lastpos:start]
             if text:
-                currentnode.append(text)
+                textnodes.append(currentnode.append(text))
+            # Get line number for soft exceptions
+            lineno += content.count('\n', lastpos, start)
+            parse_context.set_line_number(lineno)
+            lineno += content.count('\n', start, end)
             # Set new position
             lastpos = end
-            # Get line number for soft exceptions
-            lineno = content[:start].count('\n') + 1
-            sem.set_line_number(lineno)
             # if opener, push new node
             if opener:
-                currentnode = currentnode.push(tagklass, match, content)
+                if tagklass.defines_variables:
+                    headnode.textnodes = None
+                node = currentnode.push(tagklass, match, content)
+                if node is not currentnode:
+                    opened[tagklass] = opened.get(tagklass, 0) + 1
+                elif cache is not None:
+                    # a self closing tag
+                    child = node.nodes[-1]
+                    child.digest = get_digest(child, '')
+                currentnode = node
+            # closing tag without an open node
+            elif not opened.get(tagklass):
+                if strict:
+                    parse_context.soft_raise("BBCode could not be parsed. There are probably unclosed or uneven tags!")
+                    raise ParserError, "Failed to find matching opening tag for closing tag '%s' in line %s."  % (get_tag_name(tagklass), parse_context.line_number)
+                parse_context.soft_raise("Failed to find matching opening tag for closing tag '%s'." % get_tag_name(tagklass))
+                textnodes.append(currentnode.append(match.group()))
             # else close the tag
             else:
-                # pull all unclosed child tags of the current node
-                while tagklass != currentnode.__class__:
-                    try:
-                        currentnode = currentnode.pull(end)
-                    except ParserError:
-                        sem.soft_raise("BBCode could not be parsed. There are probably unclosed or uneven tags!")
-                        raise ParserError, "Failed to find matching opening tag for closing tag '%s' in line %s."  % (get_tag_name(tagklass), lineno)
+                # find the node to close
+                unclosed = []
+                node = currentnode
+                while tagklass != node.__class__:
+                    unclosed.append(node)
+                    node = node.parent
+                # pull all unclosed child tags of it, outermost first so the
+                # nodes nested in them are only moved once
+                for child in reversed(unclosed):
+                    parse_context.soft_raise("Tag '%s' is not closed" % get_tag_name(child.__class__))
+                    opened[child.__class__] -= 1
+                    child.pull(end)
+                opened[tagklass] -= 1
+                if cache is not None:
+                    node.digest = get_digest(node, match.group())
+                    if not node.pure:
+                        clear_digests(node)
                 # close the node
-                currentnode = currentnode.close(end)
+                currentnode = node.close(end)
         text = content[lastpos:]
-        if text:
-            headnode.append(text)
+        if partial:
+            if text:
+                textnodes.append(currentnode.append(text))
+            while currentnode is not headnode:
+                currentnode = currentnode.close(len(content))
+        elif text:
+            textnodes.append(headnode.append(text))
+        if self.listeners:
+            elapsed = time.time() - started
+            self.notify(Event('tree', None, len(content), None, elapsed,
+                              elapsed))
         # Return the head node
         return headnode
     
     def get_visual_parse_tree(self, content, namespaces=None, indent=4):
         if namespaces is None:
             namespaces = get_default_namespaces()
-        def recurse(nodes, level, indent):
-            cindent = level * indent
-            sindent = ' ' * cindent
-            next = level + 1
-            l = []
-            for node in nodes:
-                l.append('%s-%s' % (sindent, str(node)))
-                l += recurse(node.nodes, next, indent)
-            return l
         try:
             head = self.get_parse_tree(content, namespaces)
         except ParserError:
             return '-Parse Error'
         visuals = ['-HeadNode']
-        visuals += recurse(head.nodes, 1, indent)
+        stack = [iter(head.nodes)]
+        while stack:
+            for node in stack[-1]:
+                visuals.append('%s-%s' % (' ' * (len(stack) * indent), str(node)))
+                if node.nodes:
+                    stack.append(iter(node.nodes))
+                break
+            else:
+                stack.pop()
         return '\n'.join(visuals)
     
-    def validate(self, content, namespaces=None, auto_discover=False):
+    def validate(self, content, namespaces=None, auto_discover=False,
+                 quick=False, fail_fast=False):
         """
         Validates a given content and returns the errors or an empty sequence.
+        See Parser.validate for quick and fail_fast.
         """
-        if namespaces is None:
-            namespaces = get_default_namespaces()
         if auto_discover:
             autodiscover()
-        try:
-            headnode = self.get_parse_tree(content, namespaces)
-        except ParserError:
-            return sem.pull()
-        parsed = headnode.parse()
-        return sem.pull()
+        self.load_for(content)
+        return Parser(namespaces, self).validate(content, quick, fail_fast)
 
 
 lib = Library()
@@ -704,6 +1550,602 @@ def get_default_namespaces():
     if hasattr(settings, 'BBCODE_DEFAULT_NAMESPACES'):
         return settings.BBCODE_DEFAULT_NAMESPACES
     return ['__all__']
+
+
+class Parser(object):
+    """
+    Parses content using the tags of a fixed set of namespaces. The tag classes
+    and their compiled patterns are resolved once when the parser is created.
+    
+    Only tags of imported modules are used, see Library.load_for. Parser.freeze
+    imports all tag modules and creates an immutable parser which also holds the
+    rendered help. Create it in the master process of a preforking server and the
+    workers share it without running autodiscover or compiling patterns again.
+    """
+    frozen = False
+    
+    def __init__(self, namespaces=None, library=None):
+        if library is None:
+            library = lib
+        if namespaces is None:
+            namespaces = get_default_namespaces()
+        self.library = library
+        self.namespaces = tuple(namespaces)
+        self.tokenizers = tuple(library.get_tokenizers(namespaces))
+        self.tags = tuple(sorted([t[0] for t in self.tokenizers],
+                                 key=lambda x: x.namespaces))
+        self.help = None
+        
+    def __setattr__(self, name, value):
+        if self.frozen:
+            raise AttributeError, "Cannot set '%s' on a frozen parser" % name
+        object.__setattr__(self, name, value)
+    
+    @classmethod
+    def freeze(cls, namespaces=None, library=None):
+        """
+        Discover all tags and return an immutable parser for the namespaces.
+        """
+        autodiscover()
+        if library is None:
+            library = lib
+        library.load_all()
+        parser = cls(namespaces, library)
+        parser.help = tuple(parser.library.get_help(*parser.tags))
+        parser.frozen = True
+        return parser
+    
+    def get_help(self):
+        """
+        Get help for all tags of this parser. See Library.get_help.
+        """
+        if self.help is not None:
+            return list(self.help)
+        return self.library.get_help(*self.tags)
+    
+    def get_parse_tree(self, content, context=None, parse_context=None,
+                       strict=True):
+        """
+        Returns a HeadNode instance for content, see Library.build_tree
+        """
+        taglist = self.library.get_taglist(content, tokenizers=self.tokenizers)
+        return self.library.build_tree(content, taglist, context,
+                                       parse_context, strict=strict)
+    
+    def render(self, content, strict=True, context=None, budget=None):
+        """
+        Parse a content, returns a tuple of the parsed content, the errors and
+        the parse tree. If strict is False, closing tags without an opening
+        tag are rendered as text instead of raising ParserError.
+        
+        If budget (in seconds) is given, BudgetExceeded is raised when
+        rendering takes longer.
+        """
+        started = time.time()
+        # Fix windows linefeeds
+        content = content.replace('\r','')
+        size = len(content)
+        deadline = None
+        if budget is not None:
+            deadline = started + budget
+        parse_context = ParseContext(deadline=deadline)
+        parse_context.activate()
+        try:
+            # Get head node
+            try:
+                head = self.get_parse_tree(content, context, parse_context,
+                                           strict)
+            except ParserError:
+                self.notify('render', started, size, None, parse_context)
+                raise
+            # parse BB Codes
+            content = head.parse()
+        finally:
+            parse_context.deactivate()
+        # Replace linefeeds
+        content = convert_linefeeds(content)
+        self.notify('render', started, size, len(content), parse_context)
+        return content, parse_context.pull(), head
+    
+    def parse(self, content, strict=True, context=None):
+        """
+        Parse a content, see bbcode.parse
+        """
+        content, errors, head = self.render(content, strict, context)
+        return content, errors
+    
+    def parse_and_validate(self, content, context=None):
+        """
+        Parse and validate a content at once, see bbcode.parse_and_validate
+        """
+        return self.render(content, False, context)
+    
+    def validate(self, content, quick=False, fail_fast=False):
+        """
+        Validates a given content and returns the errors or an empty sequence.
+        
+        If quick is True, the content is not parsed but only the validate
+        method of each node is called, which checks arguments and nesting. If
+        fail_fast is True, validation stops at the first error.
+        """
+        started = time.time()
+        parse_context = ParseContext(fail_fast)
+        parse_context.activate()
+        try:
+            try:
+                headnode = self.get_parse_tree(content,
+                                               parse_context=parse_context,
+                                               strict=False)
+                if quick:
+                    self.validate_tree(headnode)
+                else:
+                    headnode.parse()
+            except (ParserError, StopValidation):
+                pass
+            self.notify('validate', started, len(content), None, parse_context)
+            return parse_context.pull()
+        finally:
+            parse_context.deactivate()
+            
+    def notify(self, phase, started, size, output_size, parse_context):
+        """
+        Send a 'render' or 'validate' Event to the listeners of the library.
+        """
+        if self.library.listeners:
+            elapsed = time.time() - started
+            self.library.notify(Event(phase, None, size, output_size, elapsed,
+                                      elapsed, namespaces=self.namespaces,
+                                      errors=len(parse_context.exceptions)))
+            
+    def render_chunks(self, buffer, chunk_size=65536, max_size=None,
+                      encoding='utf-8', context=None):
+        """
+        Render a large content piece by piece, yielding tuples of the html and
+        the errors of each chunk. buffer can be a (byte) string or an mmap,
+        only the current chunk is decoded and parsed.
+        
+        Chunks are about chunk_size characters long and end after a blank
+        line. A chunk with unclosed tags is extended until they are closed
+        or it reaches max_size (default: 16 * chunk_size), so the html is the
+        same as render (with strict=False) would return unless a tag spans
+        more than max_size. Variables are kept from one chunk to the next.
+        """
+        if max_size is None:
+            max_size = chunk_size * 16
+        length = len(buffer)
+        variables = VariableScope()
+        position = 0
+        lineno = 0
+        while position < length:
+            size = chunk_size
+            while True:
+                match = BLANK_LINE_PATTERN.search(buffer, position + size)
+                end = match and match.end() or length
+                text = buffer[position:end]
+                if isinstance(text, str):
+                    text = text.decode(encoding)
+                text = text.replace('\r', '')
+                parse_context = ParseContext()
+                parse_context.activate()
+                try:
+                    head = self.get_parse_tree(text, context, parse_context,
+                                               strict=False)
+                    covered = sum([len(node.raw_content) for node in head.nodes])
+                    if (covered != len(text) and end < length
+                        and end - position < max_size):
+                        size *= 2
+                        continue
+                    head.variables.update(variables)
+                    variables = head.variables
+                    html = head.parse()
+                    # nodes refer to their parent, break the cycles so the
+                    # tree is freed before the next chunk
+                    nodes = [head]
+                    while nodes:
+                        node = nodes.pop()
+                        nodes.extend(node.nodes)
+                        node.nodes = []
+                        node.parent = None
+                finally:
+                    parse_context.deactivate()
+                break
+            errors = parse_context.pull()
+            for error in errors:
+                error.lineno += lineno
+            lineno += text.count('\n')
+            position = end
+            yield convert_linefeeds(html), errors
+            
+    def to_text(self, content, context=None):
+        """
+        Render a content as plain text, see bbcode.to_text
+        """
+        parse_context = ParseContext()
+        parse_context.activate()
+        try:
+            head = self.get_parse_tree(content.replace('\r', ''), context,
+                                       parse_context, strict=False)
+            return head.text()
+        finally:
+            parse_context.deactivate()
+            
+    def excerpt(self, content, max_chars, ellipsis=u'\u2026', context=None):
+        """
+        Render the beginning of a content, see bbcode.excerpt. Lazy tag
+        modules are imported for each part of the content which is parsed.
+        """
+        length = len(content)
+        window = max_chars * 4 + 256
+        tokenizers = self.tokenizers
+        while True:
+            prefix = content[:window].replace('\r', '')
+            partial = window < length
+            lazy = len(self.library.lazy_modules)
+            self.library.load_for(prefix)
+            if len(self.library.lazy_modules) != lazy:
+                tokenizers = tuple(self.library.get_tokenizers(self.namespaces))
+            parse_context = ParseContext()
+            parse_context.activate()
+            try:
+                taglist = self.library.get_taglist(prefix,
+                                                   tokenizers=tokenizers)
+                head = self.library.build_tree(prefix, taglist, context,
+                                               parse_context, True, False)
+                if truncate_tree(head, max_chars, ellipsis, partial):
+                    return convert_linefeeds(head.parse())
+            finally:
+                parse_context.deactivate()
+            window *= 2
+        
+    def validate_tree(self, headnode):
+        """
+        Calls the validate method of all nodes in the tree in document order.
+        """
+        parse_context = headnode.parse_context
+        stack = [iter(headnode.nodes)]
+        while stack:
+            for node in stack[-1]:
+                if node.is_text_node:
+                    continue
+                parse_context.set_line_number(node.lineno)
+                node.validate()
+                if node.validate_inner and node.nodes:
+                    stack.append(iter(node.nodes))
+                break
+            else:
+                stack.pop()
+
+
+
+def truncate_text(text, max_chars, ellipsis=u'\u2026'):
+    """
+    Cut a text to at most max_chars characters (plus the ellipsis), at the
+    last whitespace if that does not split a word. Shorter texts are
+    returned as they are.
+    """
+    if len(text) <= max_chars:
+        return text
+    cut = text[:max_chars]
+    if not (cut[-1:].isspace() or text[max_chars].isspace()):
+        words = cut.rsplit(None, 1)
+        if len(words) == 2:
+            cut = cut[:len(cut) - len(words[1])]
+    return cut.rstrip() + ellipsis
+
+def truncate_tree(head, max_chars, ellipsis=u'\u2026', partial=False,
+                  margin=256):
+    """
+    Cut a parse tree after max_chars characters of visible text (as returned
+    by the text methods of the nodes). Tags with more text are cut within
+    their child nodes if those are parsed once, as they are (see
+    Node.validate_inner), and dropped otherwise, all following nodes are
+    removed. Tags defining variables (eg. [range] repeating its content) or
+    which are not pure (eg. [args] changing the tags within it) are dropped
+    as a whole.
+    
+    The text of the tree is converted once (see text_nodes), keeping the size
+    of each tag, so the sizes are not computed again for each level of nested
+    tags.
+    
+    If partial is True, the tree was built from the beginning of a longer
+    content, so its last nodes might be incomplete. Returns False if the cut
+    needs them (or is less than margin characters before the end of the last
+    text), ie. if a longer part of the content must be parsed.
+    """
+    # the last nodes in document order, which might be incomplete
+    edge = set()
+    node = head
+    while node.nodes:
+        node = node.nodes[-1]
+        edge.add(id(node))
+    # the length of the text of each tag by id
+    sizes = {}
+    text_nodes(head.nodes, sizes)
+    remaining = max_chars
+    # [parent, index of the next child]
+    stack = [[head, 0]]
+    while stack:
+        entry = stack[-1]
+        parent, index = entry
+        if index == len(parent.nodes):
+            stack.pop()
+            continue
+        node = parent.nodes[index]
+        entry[1] += 1
+        incomplete = partial and id(node) in edge
+        if node.is_text_node:
+            text = node.variables.resolve(node.text)
+            # the end of the last text might be the beginning of a tag
+            if incomplete and len(text) - remaining < margin:
+                return False
+            if len(text) <= remaining:
+                remaining -= len(text)
+                continue
+            node.text = truncate_text(text, remaining, ellipsis)
+        else:
+            size = sizes.get(id(node))
+            if size is None:
+                # within a tag converting its child nodes itself
+                text_nodes([node], sizes)
+                size = sizes[id(node)]
+            if size <= remaining and not incomplete:
+                remaining -= size
+                continue
+            node.validate()
+            if (node.validate_inner and node.nodes and node.pure
+                and not node.defines_variables):
+                stack.append([node, 0])
+                continue
+            if incomplete:
+                return False
+            del parent.nodes[index:]
+            parent.append(ellipsis)
+        # remove everything after the cut, the digests of the nodes around it
+        # no longer match
+        for parent, index in stack:
+            del parent.nodes[index:]
+            parent.digest = None
+        return True
+    return not partial
+
+
+class Document(object):
+    """
+    A content which is edited and rendered repeatedly, eg. for a live preview.
+    
+    The document keeps the rendered top-level nodes of its parse tree. An edit
+    only re-tokenizes and re-renders the top-level nodes around the changed
+    text, the html and the errors are the same as bbcode.parse would return:
+    
+        doc = Document(content)
+        doc.edit(10, 12, u'[b]new text[/b]')
+        doc.html, doc.errors
+    
+    The re-rendered part of the content starts and ends with a top-level tag
+    in brackets. If a tag pattern matches across its bounds (looking margin
+    characters around them), the document is rendered completely. Documents
+    defining variables (eg. using [def]) or failing to parse are fully
+    re-rendered on each edit.
+    """
+    margin = 1024
+    
+    def __init__(self, content, namespaces=None, strict=True,
+                 auto_discover=False, context=None, parser=None):
+        if auto_discover:
+            autodiscover()
+        if parser is None:
+            lib.load_for(content)
+            parser = Parser(namespaces)
+        self.parser = parser
+        self.strict = strict
+        self.context = context
+        self.content = content.replace('\r', '')
+        self.refresh()
+        
+    def refresh(self):
+        """
+        Re-render the whole content.
+        """
+        # segments are [raw_content, is_text_node, html, tree errors, parse
+        # errors] lists, errors are (line offset, message) tuples
+        self.segments = None
+        parse_context = ParseContext()
+        parse_context.activate()
+        try:
+            head = self.parser.get_parse_tree(self.content, self.context,
+                                              parse_context, self.strict)
+            segments = None
+            if self.is_complete(head.nodes, self.content):
+                segments = self.render_nodes(head, {})
+        finally:
+            parse_context.deactivate()
+        if segments is None:
+            self.html, self.errors = self.parser.parse(self.content, False,
+                                                       self.context)
+        else:
+            self.segments = segments
+            self.update()
+        
+    def is_complete(self, nodes, content):
+        """
+        Check that the nodes cover content, which is not the case if it has
+        unclosed tags.
+        """
+        return sum([len(node.raw_content) for node in nodes]) == len(content)
+    
+    def is_bound(self, segment):
+        """
+        Check if the window of an edit can start or end with a segment: a tag
+        in brackets, unlike smilies or urls.
+        """
+        raw_content = segment[0]
+        return (not segment[1] and raw_content[:1] == '['
+                and raw_content[-1:] == ']')
+    
+    def crosses(self, content, start, end):
+        """
+        Check if a tag pattern matches across start or end in content.
+        """
+        low = max(0, start - self.margin)
+        high = end + self.margin
+        for tagklass, op, cp in self.parser.tokenizers:
+            for pattern in (op, cp):
+                for match in pattern.finditer(content, low, high):
+                    first, last = match.span()
+                    if first >= end:
+                        break
+                    if first < start < last or first < end < last:
+                        return True
+        return False
+    
+    def get_tree_errors(self, raw_content):
+        """
+        Build the parse tree of a top-level node alone and return the errors
+        of building it.
+        """
+        parse_context = ParseContext()
+        parse_context.activate()
+        try:
+            self.parser.get_parse_tree(raw_content, self.context,
+                                       parse_context, False)
+        finally:
+            parse_context.deactivate()
+        return parse_context.pull()
+        
+    def render_nodes(self, head, renders):
+        """
+        Render the top-level nodes of head, reusing renders of equal nodes in
+        renders. Returns the segments or None if variables were defined.
+        
+        The errors of building the tree of head are pulled from its parse
+        context and assigned to the nodes on their lines, which are built
+        again alone if there are any.
+        """
+        parse_context = head.parse_context
+        tree_lines = set([error.lineno for error in parse_context.pull()])
+        segments = []
+        lineno = 1
+        for node in head.nodes:
+            key = (node.raw_content, node.is_text_node)
+            lines = node.raw_content.count('\n')
+            if key not in renders:
+                html = parse_nodes([node], parse_context)
+                errors = [(error.lineno - lineno, error.message)
+                          for error in parse_context.pull()]
+                tree_errors = []
+                for line in range(lineno, lineno + lines + 1):
+                    if line in tree_lines:
+                        tree_errors = [(error.lineno - 1, error.message)
+                                       for error in
+                                       self.get_tree_errors(node.raw_content)]
+                        break
+                renders[key] = [node.raw_content, node.is_text_node, html,
+                                tree_errors, errors]
+            segments.append(renders[key])
+            lineno += lines
+        if head.variables:
+            return None
+        return segments
+        
+    def update(self):
+        """
+        Join the rendered segments and collect their errors, the errors of
+        building the tree first as parsing reports them.
+        """
+        tree_errors = []
+        errors = []
+        lineno = 1
+        for segment in self.segments:
+            for offset, message in segment[3]:
+                tree_errors.append(SoftException(lineno + offset, message))
+            for offset, message in segment[4]:
+                errors.append(SoftException(lineno + offset, message))
+            lineno += segment[0].count('\n')
+        self.html = convert_linefeeds(''.join([s[2] for s in self.segments]))
+        self.errors = tree_errors + errors
+        
+    def edit(self, start, end, text):
+        """
+        Replace content[start:end] with text and update the rendered content.
+        
+        If the document is strict and the new content can't be parsed, the
+        ParserError is raised and the document keeps its previous content.
+        """
+        state = (self.content, self.parser, self.segments, self.html,
+                 self.errors)
+        try:
+            self.replace(start, end, text.replace('\r', ''))
+        except ParserError:
+            (self.content, self.parser, self.segments, self.html,
+             self.errors) = state
+            raise
+        
+    def replace(self, start, end, text):
+        """
+        Replace content[start:end] with text and re-render the top-level nodes
+        around it, see edit.
+        """
+        content = self.content[:start] + text + self.content[end:]
+        self.content = content
+        library = self.parser.library
+        modules = len(library.lazy_modules)
+        library.load_for(text)
+        if len(library.lazy_modules) != modules and not self.parser.frozen:
+            self.parser = Parser(self.parser.namespaces, library)
+            return self.refresh()
+        if not self.segments:
+            return self.refresh()
+        # Find the segments touched by the edit
+        segments = self.segments
+        first = last = None
+        position = 0
+        for index, segment in enumerate(segments):
+            length = len(segment[0])
+            if first is None and position + length >= start:
+                first, first_position = index, position
+            if position + length >= end:
+                last, last_end = index, position + length
+                break
+            position += length
+        # Extend them to tags in brackets on both sides, so that no token (eg.
+        # an url in text or a smilie) can cross the window
+        while first > 0:
+            first -= 1
+            first_position -= len(segments[first][0])
+            if self.is_bound(segments[first]):
+                break
+        while last < len(segments) - 1:
+            last += 1
+            last_end += len(segments[last][0])
+            if self.is_bound(segments[last]):
+                break
+        window_end = last_end + len(text) - (end - start)
+        if self.crosses(content, first_position, window_end):
+            return self.refresh()
+        window = content[first_position:window_end]
+        renders = dict([((s[0], s[1]), s) for s in segments[first:last + 1]])
+        parse_context = ParseContext()
+        parse_context.activate()
+        try:
+            try:
+                taglist = library.get_taglist(window,
+                                              tokenizers=self.parser.tokenizers)
+                head = library.build_tree(window, taglist, self.context,
+                                          parse_context, strict=self.strict)
+            except ParserError:
+                return self.refresh()
+            nodes = head.nodes
+            if (not self.is_complete(nodes, window)
+                or (first > 0 and nodes[0].is_text_node)
+                or (last < len(segments) - 1 and nodes[-1].is_text_node)):
+                return self.refresh()
+            rendered = self.render_nodes(head, renders)
+        finally:
+            parse_context.deactivate()
+        if rendered is None:
+            return self.refresh()
+        self.segments[first:last + 1] = rendered
+        self.update()
     
 def parse(content, namespaces=None, strict=True, auto_discover=False,
           context=None):
@@ -712,36 +2154,67 @@ def parse(content, namespaces=None, strict=True, auto_discover=False,
     """
     if auto_discover:
         autodiscover()
-    if namespaces is None:
-        namespaces = get_default_namespaces()
-    # Fix windows linefeeds
-    content = content.replace('\r','')
-    # Get head node
-    if strict:
-        head = lib.get_parse_tree(content, namespaces, context)
-    else:
-        try:
-            head = lib.get_parse_tree(content, namespaces, context)
-        except ParserError:
-            return convert_linefeeds(content), sem.pull()
-    # parse BB Codes
-    content = head.parse()
-    # Replace linefeeds
-    content = convert_linefeeds(content)
-    return content, sem.pull()
+    lib.load_for(content)
+    return Parser(namespaces).parse(content, strict, context)
+
+def to_text(content, namespaces=None, auto_discover=False, context=None):
+    """
+    Render a content as plain text without markup, images or highlighting, eg.
+    for search indexes or e-mails. Errors are ignored, closing tags without an
+    opening tag are kept as text.
+    """
+    if auto_discover:
+        autodiscover()
+    lib.load_for(content)
+    return Parser(namespaces).to_text(content, context)
+
+def excerpt(content, max_chars, namespaces=None, auto_discover=False,
+            context=None, ellipsis=u'\u2026'):
+    """
+    Render the beginning of a content with at most max_chars characters of
+    visible text, followed by the ellipsis. Tags spanning the cut are closed
+    after it. Only the beginning of the content is tokenized and rendered, so
+    the time does not depend on its length. Errors are ignored, tags which
+    are not closed within the excerpt are closed at its end. Lazy tag modules
+    are only imported for the part of the content which is parsed.
+    """
+    if auto_discover:
+        autodiscover()
+    return Parser(namespaces).excerpt(content, max_chars, ellipsis, context)
+
+def parse_and_validate(content, namespaces=None, auto_discover=False,
+                       context=None):
+    """
+    Parse a content and collect its errors in a single pass. Returns a tuple of
+    the parsed content, the errors (as bbcode.validate would) and the parse
+    tree.
+    """
+    if auto_discover:
+        autodiscover()
+    lib.load_for(content)
+    return Parser(namespaces).parse_and_validate(content, context)
     
-def autodiscover():
+def autodiscover(lazy=None):
     """
     Automatically register all bbcode tags. This searches the 'bbtags' modules
     of all INSTALLED_APPS if available.
+    
+    Modules defining 'triggers' (a list of strings) are only added to a manifest
+    and imported once a content containing one of the triggers is parsed, unless
+    lazy (default: settings.BBCODE_LAZY_TAGS or True) is False.
+    
+    If settings.BBCODE_METRICS is True, the metrics registry is installed, see
+    bbcode.metrics. If settings.BBCODE_SUBTREE_CACHE is set, the library gets
+    a SubtreeCache of this number of entries.
     """
     global AUTODISCOVERED
     if AUTODISCOVERED:
         return
-    import imp
     from django.conf import settings
     import os
-
+    
+    if lazy is None:
+        lazy = get_setting('BBCODE_LAZY_TAGS', True)
     for app in settings.INSTALLED_APPS:
         try:
             module = __import__(app, {}, {}, [app.split('.')[-1]])
@@ -752,8 +2225,16 @@ def autodiscover():
             imp.find_module('bbtags', app_path)
         except ImportError:
             continue
-        for f in os.listdir(os.path.join(os.path.dirname(os.path.abspath(module.__file__)), 'bbtags')):
+        bbtags = os.path.join(os.path.dirname(os.path.abspath(module.__file__)), 'bbtags')
+        for f in os.listdir(bbtags):
             mod_name, ext = os.path.splitext(f)
             if ext == '.py':
-                __import__("%s.bbtags.%s" % (app, mod_name))
+                name = "%s.bbtags.%s" % (app, mod_name)
+                if not lazy or not lib.add_lazy_module(name, os.path.join(bbtags, f)):
+                    __import__(name)
+    if get_setting('BBCODE_METRICS', False):
+        from bbcode import metrics
+        metrics.install()
+    if get_setting('BBCODE_SUBTREE_CACHE', 0) and lib.subtree_cache is None:
+        lib.subtree_cache = SubtreeCache(get_setting('BBCODE_SUBTREE_CACHE', 0))
     AUTODISCOVERED = True
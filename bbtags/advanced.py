@@ -1,6 +1,8 @@
 from bbcode import *
 import re
 
+triggers = ('[hidden]', '[/hidden]')
+
 class Hidden(TagNode):
     """
     Defines a text to be hidden. The visibility of the text can be toggled using a button.
@@ -12,6 +14,8 @@ class Hidden(TagNode):
     num = 0
     open_pattern = re.compile(patterns.no_argument % 'hidden')
     close_pattern = re.compile(patterns.closing % 'hidden')
+    # the id of each hidden text is unique
+    pure = False
         
     def parse(self):
         Hidden.num += 1
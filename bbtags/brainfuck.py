@@ -2,66 +2,131 @@ from bbcode import *
 import re
 import cgi
 
-def parseout(bfcode):
-    try:
-        output = parsebf(bfcode)
-    except (UnknownLanguageCommand, DataPointerError, UnevenSquareBracketsError, ValueError, NotImplementedError), e:
-        return e.message
-    return output
+triggers = ('[brainfuck]',)
 
-def parsebf(bfcode):
-    code_end = len(bfcode)
-    instruction_pointer = 0
-    data_pointer = 0
-    cells = [0]
-    output = ''
-    def jump(pointer, opener, closer, direction):
-        start = pointer + 1
-        opened = 1
-        while opened:
-            if direction == '+':
-                pointer += 1
+# Default limits, can be overwritten using BBCODE_BRAINFUCK_MAX_STEPS,
+# BBCODE_BRAINFUCK_MAX_OUTPUT and BBCODE_BRAINFUCK_CACHE_SIZE
+MAX_STEPS = 1000000
+MAX_OUTPUT = 10000
+CACHE_SIZE = 128
+# steps between calls to the check of parsebf
+CHECK_INTERVAL = 10000
+
+class BrainfuckError(Exception): pass
+class UnknownLanguageCommand(BrainfuckError): pass
+class DataPointerError(BrainfuckError): pass
+class UnevenSquareBracketsError(BrainfuckError): pass
+class StepLimitError(BrainfuckError): pass
+class OutputLimitError(BrainfuckError): pass
+
+# Operation codes of compiled programs
+ADD, MOVE, OUT, OPEN, CLOSE = range(5)
+
+_folded = {'+': (ADD, 1), '-': (ADD, -1), '>': (MOVE, 1), '<': (MOVE, -1)}
+
+_cache = {}
+
+def compilebf(bfcode):
+    """
+    Compile brainfuck code to a list of (opcode, argument, position) tuples.
+    Runs of +/- and </> are folded into a single operation, the argument of
+    brackets is the index of the matching bracket.
+    """
+    ops = []
+    opened = []
+    for position, current in enumerate(bfcode):
+        verbose_pointer = position + 1
+        if current in _folded:
+            opcode, argument = _folded[current]
+            if ops and ops[-1][0] == opcode and ops[-1][3] == current:
+                last = ops[-1]
+                ops[-1] = (opcode, last[1] + argument, last[2], current)
             else:
-                pointer -= 1
-            if pointer == code_end or pointer < 0:
-                raise UnevenSquareBracketsError, "Uneven square brackets (@%s)" % start
-            if bfcode[pointer] == opener:
-                opened += 1
-            elif bfcode[pointer] == closer:
-                opened -= 1
-        return pointer
-    while instruction_pointer < code_end:
-        current = bfcode[instruction_pointer]
-        verbose_pointer = instruction_pointer + 1
-        if current == '>':
-            data_pointer += 1
-            if len(cells) == data_pointer:
-                cells.append(0)
-        elif current == '<':
-            if data_pointer == 0:
-                raise DataPointerError, "Data pointer cannot be zero (@%s)" % verbose_pointer
-            data_pointer -= 1
-        elif current == '+':
-            if cells[data_pointer] == 255:
-                raise ValueError, "Byte cannot exceed 255 (@%s)" % verbose_pointer
-            cells[data_pointer] += 1
-        elif current == '-':
-            if cells[data_pointer] == 0:
-                raise ValueError, "Byte cannot be negative (@%s)" % verbose_pointer
-            cells[data_pointer] -= 1
+                ops.append((opcode, argument, verbose_pointer, current))
         elif current == '.':
-            output += chr(cells[data_pointer])
+            ops.append((OUT, 0, verbose_pointer, current))
         elif current == ',':
             raise NotImplementedError, "Input (',') is not implemented yet (@%s)" % verbose_pointer
         elif current == '[':
-            if cells[data_pointer] == 0:
-                instruction_pointer = jump(instruction_pointer, '[',']','+')
+            opened.append(len(ops))
+            ops.append((OPEN, None, verbose_pointer, current))
         elif current == ']':
-            if cells[data_pointer] != 0:
-                instruction_pointer = jump(instruction_pointer, ']','[','-')
+            if not opened:
+                raise UnevenSquareBracketsError, "Uneven square brackets (@%s)" % verbose_pointer
+            opener = opened.pop()
+            ops[opener] = (OPEN, len(ops), ops[opener][2], '[')
+            ops.append((CLOSE, opener, verbose_pointer, current))
         else:
             raise UnknownLanguageCommand, "Unknown language command: '%s' (@%s)" % (current, verbose_pointer)
+    if opened:
+        raise UnevenSquareBracketsError, "Uneven square brackets (@%s)" % ops[opened[-1]][2]
+    return [op[:3] for op in ops]
+
+def parsebf(bfcode, max_steps=None, max_output=None, check=None):
+    """
+    Execute brainfuck code and return the output. check is called every
+    CHECK_INTERVAL steps if given, eg. to stop at a deadline by raising.
+    """
+    if max_steps is None:
+        max_steps = get_setting('BBCODE_BRAINFUCK_MAX_STEPS', MAX_STEPS)
+    if max_output is None:
+        max_output = get_setting('BBCODE_BRAINFUCK_MAX_OUTPUT', MAX_OUTPUT)
+    ops = compilebf(bfcode)
+    code_end = len(ops)
+    instruction_pointer = 0
+    data_pointer = 0
+    cells = bytearray(1)
+    output = bytearray()
+    steps = 0
+    next_check = check is None and max_steps + 1 or CHECK_INTERVAL
+    while instruction_pointer < code_end:
+        steps += 1
+        if steps > max_steps:
+            raise StepLimitError, "Step limit of %s exceeded" % max_steps
+        if steps == next_check:
+            next_check += CHECK_INTERVAL
+            check()
+        opcode, argument, verbose_pointer = ops[instruction_pointer]
+        if opcode == ADD:
+            value = cells[data_pointer] + argument
+            if value > 255:
+                raise ValueError, "Byte cannot exceed 255 (@%s)" % (verbose_pointer + 255 - cells[data_pointer])
+            if value < 0:
+                raise ValueError, "Byte cannot be negative (@%s)" % (verbose_pointer + cells[data_pointer])
+            cells[data_pointer] = value
+        elif opcode == MOVE:
+            if data_pointer + argument < 0:
+                raise DataPointerError, "Data pointer cannot be zero (@%s)" % (verbose_pointer + data_pointer)
+            data_pointer += argument
+            if data_pointer >= len(cells):
+                cells.extend(bytearray(data_pointer - len(cells) + 1))
+        elif opcode == OUT:
+            if len(output) >= max_output:
+                raise OutputLimitError, "Output limit of %s bytes exceeded" % max_output
+            output.append(cells[data_pointer])
+        elif opcode == OPEN:
+            if cells[data_pointer] == 0:
+                instruction_pointer = argument
+        elif cells[data_pointer] != 0:
+            instruction_pointer = argument
         instruction_pointer += 1
+    return str(output)
+
+def parseout(bfcode, check=None):
+    """
+    Execute brainfuck code and return the output or the error message. Results
+    are memoized by program text. Exceptions raised by check (see parsebf) are
+    not caught.
+    """
+    if bfcode in _cache:
+        return _cache[bfcode]
+    try:
+        output = parsebf(bfcode, check=check)
+    except (BrainfuckError, ValueError, NotImplementedError), e:
+        output = e.message
+    if len(_cache) >= get_setting('BBCODE_BRAINFUCK_CACHE_SIZE', CACHE_SIZE):
+        _cache.clear()
+    _cache[bfcode] = output
     return output
 
 class Brainfuck(SelfClosingTagNode):
@@ -78,7 +143,7 @@ class Brainfuck(SelfClosingTagNode):
     
     def parse(self):
         bfcode = self.match.group('bfcode')
-        parsed = cgi.escape(parseout(bfcode))
+        parsed = cgi.escape(parseout(bfcode, self.parse_context.check_budget))
         return """<p style="font-weight: bold;">Brainfuck</p>
                   <code class="code">%s</code>
                   <p style="font-weight: bold;">Output</p>
@@ -6,6 +6,8 @@ the main module!
 from bbcode import *
 import re
 
+triggers = ('[def]', '[/def]', '[args', '[/args]', '[range', '[/range]')
+
 inner_re = re.compile('(?P<name>\w+)\s*=\s*(?P<value>.+)')
 
 
@@ -26,18 +28,35 @@ class BBStyleVariableDefinition(TagNode):
     """
     open_pattern = re.compile(patterns.no_argument % 'def')
     close_pattern = re.compile(patterns.closing % 'def')
+    validate_inner = False
+    defines_variables = True
+    
+    def validate(self):
+        inner = ''
+        for node in self.nodes:
+            if not node.is_text_node:
+                self.soft_raise("def tag cannot have nested tags")
+                return
+            inner += node.raw_content
+        match = inner_re.match(inner)
+        if not match:
+            self.soft_raise("invalid syntax in define tag: inner must be 'name = value'")
+            return
+        # define the variable, tags using it might be validated later
+        value = self.variables.resolve(match.groupdict()['value'])
+        self.variables.add(match.groupdict()['name'], value)
     
     def parse(self):
         inner = ''
         for node in self.nodes:
             if not node.is_text_node:
-                soft_raise("def tag cannot have nested tags")
+                self.soft_raise("def tag cannot have nested tags")
                 return self.raw_content
             else:
                 inner += node.raw_content
         match = inner_re.match(inner)
         if not match:
-            soft_raise("invalid syntax in define tag: inner must be 'name = value'")
+            self.soft_raise("invalid syntax in define tag: inner must be 'name = value'")
             return self.raw_content
         name = match.groupdict()['name']
         value = match.groupdict()['value']
@@ -45,6 +64,11 @@ class BBStyleVariableDefinition(TagNode):
         self.variables.add(name, real_value)
         return ''
     
+    def text(self):
+        # only defines the variable
+        self.validate()
+        return ''
+    
     
 class BBStyleArguments(TagNode):
     """
@@ -68,46 +92,104 @@ class BBStyleArguments(TagNode):
     open_pattern = re.compile('\[args(?P<args>(=[^\]]+)| ([^\]]+))\]')
     close_pattern = re.compile(patterns.closing % 'args')
     verbose_name = 'Arguments'
+    # changes the arguments of the tags within it
+    pure = False
     
     def __init__(self, parent, match, content, context):
         TagNode.__init__(self, parent, match, content, context)
         arg = match.group('args')
         self.args = self.variables.lazy_resolve(arg.strip('"') if arg else '')
     
-    def parse(self):
-        # get the arguments
+    render_inner_first = True
+    # set on the [args] tags within another one, which prepares them
+    prepared = False
+    
+    def get_arguments(self):
+        """
+        Returns (argument, None) for [args=argument] and (None, dictionary of
+        the arguments) for [args name=value ...].
+        """
         if self.args.startswith('='):
-            return self.parse_single(self.args[1:])
-        else:
-            return self.parse_multi(dict(map(lambda x: x.split('='), filter(bool, self.args.split(' ')))))
-            
-    def parse_multi(self, argdict):
-        def recurse(nodes, argdict):
+            return self.args[1:], None
+        return None, dict(map(lambda x: x.split('='), filter(bool, self.args.split(' '))))
+    
+    def prepare_inner(self):
+        """
+        Change the arguments of all tags within this one, the innermost
+        [args] tag of a tag wins. Nested [args] tags are prepared in the same
+        walk over the descendants, so nesting them is not quadratic.
+        """
+        if self.prepared:
+            return
+        single, multi = self.get_arguments()
+        # (iterator over the child nodes, argument, arguments) of each level
+        stack = [(iter(self.nodes), single, multi or {})]
+        while stack:
+            nodes, single, multi = stack[-1]
             for node in nodes:
-                if hasattr(node, 'arguments'):
-                    for key, value in node.arguments.iteritems():
-                        if key in argdict:
-                            node.arguments[key] = argdict[key]
+                inner_single, inner_multi = single, multi
+                if isinstance(node, BBStyleArguments):
+                    node.prepared = True
+                    argument, arguments = node.get_arguments()
+                    if argument is not None:
+                        inner_single = argument
+                    if arguments:
+                        inner_multi = dict(multi)
+                        inner_multi.update(arguments)
+                else:
+                    if single is not None and hasattr(node, 'argument'):
+                        node.argument = single
+                    if multi and hasattr(node, 'arguments'):
+                        for key in node.arguments:
+                            if key in multi:
+                                node.arguments[key] = multi[key]
                 if node.nodes:
-                    recurse(node.nodes, argdict)
-        recurse(self.nodes, argdict)
-        inner = ''
-        for node in self.nodes:
-            inner += node.parse()
-        return inner
+                    stack.append((iter(node.nodes), inner_single, inner_multi))
+                    break
+            else:
+                stack.pop()
     
-    def parse_single(self, arg):
-        def recurse(nodes, argument):
-            for node in nodes:
-                if hasattr(node, 'argument'):
-                    node.argument = argument
+    def parse(self):
+        if self.rendered_inner is None:
+            # not parsed by parse_nodes
+            self.prepare_inner()
+        return self.parse_inner()
+            
+    def get_descendants(self):
+        """
+        All nodes within this tag in document order.
+        """
+        descendants = []
+        stack = [iter(self.nodes)]
+        while stack:
+            for node in stack[-1]:
+                descendants.append(node)
                 if node.nodes:
-                    recurse(node.nodes, argument)
-        recurse(self.nodes, arg)
-        inner = ''
-        for node in self.nodes:
-            inner += node.parse()
-        return inner
+                    stack.append(iter(node.nodes))
+                break
+            else:
+                stack.pop()
+        return descendants
+    
+    def set_multi(self, argdict):
+        for node in self.get_descendants():
+            if hasattr(node, 'arguments'):
+                for key, value in node.arguments.iteritems():
+                    if key in argdict:
+                        node.arguments[key] = argdict[key]
+    
+    def set_single(self, arg):
+        for node in self.get_descendants():
+            if hasattr(node, 'argument'):
+                node.argument = arg
+    
+    def parse_multi(self, argdict):
+        self.set_multi(argdict)
+        return self.parse_inner()
+    
+    def parse_single(self, arg):
+        self.set_single(arg)
+        return self.parse_inner()
     
 
 class BBStyleRange(MultiArgumentTagNode):
@@ -155,32 +237,61 @@ class BBStyleRange(MultiArgumentTagNode):
     
     @staticmethod
     def open_pattern():
-        pat = r'\[range'
-        for arg in BBStyleRange._arguments:
-            pat += patterns.argument
-        pat += r'\]'
-        return re.compile(pat)
+        return re.compile(r'\[range%s\]' % patterns.arguments)
     
     close_pattern = re.compile(patterns.closing % 'range')
     verbose_name = 'Range'
+    defines_variables = True
     
-    def parse(self):
+    def check_arguments(self):
+        """
+        Returns start, end and zeropad as integers or None if they are invalid.
+        """
         if not self.arguments.end:
-            return self.soft_raise('Range tag requires an end argument')
+            self.soft_raise('Range tag requires an end argument')
+            return None
         if not self.arguments.start.isdigit() or not self.arguments.end.isdigit():
-            return self.soft_raise('Range arguments must be digits')
+            self.soft_raise('Range arguments must be digits')
+            return None
         if not self.arguments.zeropad.isdigit():
-            return self.soft_raise('Range argument zeropad must be digit')
+            self.soft_raise('Range argument zeropad must be digit')
+            return None
         start = int(str(self.arguments.start))
         end   = int(str(self.arguments.end))
         zeropad = int(str(self.arguments.zeropad))
         if start < 0 or end < start:
-            return self.soft_raise('Range arguments start must be positive and end must be bigger than start')
+            self.soft_raise('Range arguments start must be positive and end must be bigger than start')
+            return None
+        return start, end, zeropad
+    
+    def validate(self):
+        arguments = self.check_arguments()
+        if arguments is not None:
+            # child nodes are validated with the first value
+            start, end, zeropad = arguments
+            self.variables.add(self.arguments.name, '%%0%si' % zeropad % start)
+    
+    def parse(self):
+        arguments = self.check_arguments()
+        if arguments is None:
+            return self.raw_content
+        start, end, zeropad = arguments
         output = ''
         for i in range(start, end + 1):
             self.variables.add(self.arguments.name, '%%0%si' % zeropad % i)
             output += self.parse_inner()
         return output
+    
+    def text(self):
+        arguments = self.check_arguments()
+        if arguments is None:
+            return self.raw_content
+        start, end, zeropad = arguments
+        output = []
+        for i in range(start, end + 1):
+            self.variables.add(self.arguments.name, '%%0%si' % zeropad % i)
+            output.append(self.text_inner())
+        return ''.join(output)
 register(BBStyleArguments)
 register(BBStyleVariableDefinition)
 register(BBStyleRange)
\ No newline at end of file
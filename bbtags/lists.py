@@ -1,6 +1,8 @@
 from bbcode import *
 import re
 
+triggers = ('[ol', '[/ol]', '[ul', '[/ul]')
+
 
 class OL(MultiArgumentTagNode):
     """
@@ -18,13 +20,10 @@ class OL(MultiArgumentTagNode):
     
     @staticmethod
     def open_pattern():
-        pat = r'\[ol'
-        for arg in OL._arguments:
-            pat += patterns.argument
-        pat += r'\]'
-        return re.compile(pat)
+        return re.compile(r'\[ol%s\]' % patterns.arguments)
     
     close_pattern = re.compile(patterns.closing % 'ol')
+    render_inner_first = True
     verbose_name = 'Ordered List'
     
     def list_parse(self):
@@ -45,6 +44,13 @@ class OL(MultiArgumentTagNode):
         else:
             css = ''
         return '<ol%s>%s</ol>'  % (css, self.list_parse())
+    
+    def list_text(self):
+        return [item.strip() for item in self.text_inner().split('[*]')[1:]]
+    
+    def text(self):
+        return ''.join(['%s. %s\n' % (index + 1, item)
+                        for index, item in enumerate(self.list_text())])
 
 
 class UL(OL):
@@ -60,11 +66,7 @@ class UL(OL):
     """
     @staticmethod
     def open_pattern():
-        pat = r'\[ul'
-        for arg in UL._arguments:
-            pat += patterns.argument
-        pat += r'\]'
-        return re.compile(pat)
+        return re.compile(r'\[ul%s\]' % patterns.arguments)
     close_pattern = re.compile(patterns.closing % 'ul') 
     verbose_name = 'Unordered List'
     
@@ -74,5 +76,8 @@ class UL(OL):
         else:
             css = ''
         return '<ul%s>%s</ul>'  % (css, self.list_parse())
+    
+    def text(self):
+        return ''.join(['- %s\n' % item for item in self.list_text()])
 register(OL)
 register(UL)
\ No newline at end of file
@@ -1,11 +1,16 @@
 from bbcode import *
 import re
 
+triggers = (':', ';', '_', 'xD', 'XD', '*g*', '^')
+
 class Smilies(SelfClosingTagNode):
     open_pattern = re.compile(':(?P<name>[a-zA-Z-]+):')
     def parse(self):
         name = self.match.groupdict()['name']
         return '<img src="/media/smilies/%s.gif" alt="%s" />' % (name, name)
+    
+    def text(self):
+        return self.match.group()
         
 
 class AlternativeSmilie(SelfClosingTagNode):
@@ -18,6 +23,9 @@ class AlternativeSmilie(SelfClosingTagNode):
         alias = self.match.group()
         return '<img src="/media/smilies/%s.gif" alt="%s" />' % (self.alias, alias)
     
+    def text(self):
+        return self.match.group()
+    
     
 class LOL(AlternativeSmilie):
     # :D, :-D, :-d, :d
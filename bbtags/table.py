@@ -1,6 +1,9 @@
 from bbcode import *
 import re
 
+triggers = ('[table', '[/table]', '[row]', '[/row]', '[col', '[/col]',
+            '[head', '[/head]')
+
 
 class Table(MultiArgumentTagNode):
     """
@@ -80,60 +83,98 @@ First row, first column | Second row, second column
     
     @staticmethod
     def open_pattern():
-        pat = r'\[table'
-        for arg in Table._arguments:
-            pat += patterns.argument
-        pat += r'\]'
-        return re.compile(pat)
+        return re.compile(r'\[table%s\]' % patterns.arguments)
     
     def parse(self):
-        # Check Type
+        if self.is_simple():
+            return self.parse_simple()
+        return self.parse_classic()
+    
+    def is_simple(self):
         for simple_argument in ('colsep', 'rowsep', 'simple', 'autohead', 'colspanchar'):
             if self.arguments[simple_argument] != Table._arguments[simple_argument]:
-                return self.parse_simple()
+                return True
         for node in self.nodes:
             if isinstance(node, Row):
-                return self.parse_classic()
-        return self.parse_simple()
-        
-    def parse_classic(self):
-        # Check arguments
+                return False
+        return True
+    
+    def check_arguments(self):
+        """
+        Checks the arguments shared by simple and classic tables and returns
+        border, cellpadding, cellspacing, frame, rules and css.
+        """
         frame = self.arguments.frame.lower()
         rules = self.arguments.rules.lower()
         if not self.arguments.border.isdigit():
-            soft_raise("Table border must be a digit")
+            self.soft_raise("Table border must be a digit")
             border = self._arguments['border']
         else:
             border = self.arguments.border
         if not self.arguments.cellpadding.isdigit():
-            soft_raise("Table cellpadding must be a digit")
+            self.soft_raise("Table cellpadding must be a digit")
             cellpadding = self._arguments['cellpadding']
         else:
             cellpadding = self.arguments.cellpadding
         if not self.arguments.cellspacing.isdigit():
-            soft_raise("Table cellspacing must be a digit")
+            self.soft_raise("Table cellspacing must be a digit")
             cellspacing = self._arguments['cellspacing']
         else:
             cellspacing = self.arguments.cellspacing
         if not frame in self._allowed_frame:
-            soft_raise("Table frame '%s' is not allowed." % frame)
+            self.soft_raise("Table frame '%s' is not allowed." % frame)
         else:
             frame = self._arguments['frame']
         if not rules in self._allowed_rules:
-            soft_raise("Table rules '%s' is not allowed." % rules)
+            self.soft_raise("Table rules '%s' is not allowed." % rules)
         else:
             rules = self._arguments['rules']
         if self.arguments.css:
             css = ' class="%s"' % self.arguments.css.replace(',',' ')
         else:
             css = ''
+        return border, cellpadding, cellspacing, frame, rules, css
+    
+    def check_separators(self):
+        """
+        Checks the separators of a simple table, returns False if they clash.
+        """
+        rowsep = self.arguments.rowsep
+        colsep = self.arguments.colsep
+        colspanchar = self.arguments.colspanchar
+        if rowsep == colsep:
+            self.soft_raise("Colsep and rowsep cannot be the same!")
+            return False
+        if colspanchar == rowsep:
+            self.soft_raise("Colspanchar and rowsep cannot be the same!")
+            return False
+        if colspanchar == colsep:
+            self.soft_raise("Colspanchar and colsep cannot be the same!")
+            return False
+        return True
+    
+    def check_rows(self):
+        for node in self.nodes:
+            if node.__class__ != Row and node.raw_content.strip():
+                self.soft_raise("Only rows are allowed directly nested inside a table")
+    
+    def validate(self):
+        if self.is_simple():
+            if self.check_separators():
+                self.check_arguments()
+        else:
+            self.check_arguments()
+            self.check_rows()
+        
+    def parse_classic(self):
+        border, cellpadding, cellspacing, frame, rules, css = self.check_arguments()
         # Remove invalid Text nodes
         inner = ''
         for node in self.nodes:
             if node.__class__ == Row:
                 inner += node.parse()
             elif node.raw_content.strip():
-                soft_raise("Only rows are allowed directly nested inside a table")
+                self.soft_raise("Only rows are allowed directly nested inside a table")
         return '<table border="%s" cellpadding="%s" cellspacing="%s" frame="%s" rules="%s"%s>%s</table>' % (border, cellpadding, cellspacing, frame, rules, css, inner)
     
     def parse_simple(self):
@@ -145,58 +186,48 @@ First row, first column | Second row, second column
         [/table]
         """
         # Check arguments
-        rowsep = self.arguments.rowsep
-        colsep = self.arguments.colsep
+        if not self.check_separators():
+            return self.raw_content
         colspanchar = self.arguments.colspanchar
         autohead = self.arguments.autohead == '1'
-        if rowsep == colsep:
-            soft_raise("Colsep and rowsep cannot be the same!")
-            return self.raw_content
-        if colspanchar == rowsep:
-            soft_raise("Colspanchar and rowsep cannot be the same!")
-            return self.raw_content
-        if colspanchar == colsep:
-            soft_raise("Colspanchar and colsep cannot be the same!")
-            return self.raw_content
+        border, cellpadding, cellspacing, frame, rules, css = self.check_arguments()
+        # Start parsing except text nodes
+        rowcols = self.split_simple(self.parse_inner())
+        output = '<table border="%s" cellpadding="%s" cellspacing="%s" frame="%s" rules="%s"%s>' % (border, cellpadding, cellspacing, frame, rules, css)
+        if autohead and rowcols:
+            head = rowcols.pop(0)
+            output += '<thead><tr>'
+            for col in head:
+                output += '<th>%s</th>' % col
+            output += '</tr></thead>'
+        output += '<tbody>'
+        colspanpattern = re.compile('^%s(\d+)(.+)' % colspanchar, re.DOTALL)
+        for row in rowcols:
+            output += '<tr>'
+            for col in row:
+                match = colspanpattern.search(col)
+                if match:
+                    output += '<td colspan="%s">%s</td>' % match.groups()
+                else:
+                    output += '<td>%s</td>' % col
+            output += '</tr>'
+        output += '</tbody></table>'
+        return output
+    
+    def split_simple(self, inner):
+        """
+        Split the inner content of a simple table into a list of rows, which
+        are lists of cells.
+        """
+        rowsep = self.arguments.rowsep
+        colsep = self.arguments.colsep
         if rowsep in colsep:
             order = 'colsfirst'
         else:
             order = 'rowsfirst'
-        frame = self.arguments.frame.lower()
-        rules = self.arguments.rules.lower()
-        if not self.arguments.border.isdigit():
-            soft_raise("Table border must be a digit")
-            border = self._arguments['border']
-        else:
-            border = self.arguments.border
-        if not self.arguments.cellpadding.isdigit():
-            soft_raise("Table cellpadding must be a digit")
-            cellpadding = self._arguments['cellpadding']
-        else:
-            cellpadding = self.arguments.cellpadding
-        if not self.arguments.cellspacing.isdigit():
-            soft_raise("Table cellspacing must be a digit")
-            cellspacing = self._arguments['cellspacing']
-        else:
-            cellspacing = self.arguments.cellspacing
-        if not frame in self._allowed_frame:
-            soft_raise("Table frame '%s' is not allowed." % frame)
-        else:
-            frame = self._arguments['frame']
-        if not rules in self._allowed_rules:
-            soft_raise("Table rules '%s' is not allowed." % rules)
-        else:
-            rules = self._arguments['rules']
-        if self.arguments.css:
-            css = ' class="%s"' % self.arguments.css.replace(',',' ')
-        else:
-            css = ''
         # Unescaping special chars
         rowsep = rowsep.replace('\\n','\n')
         colsep = colsep.replace('\\n','\n')
-        # Start parsing except text nodes
-        inner = self.parse_inner()
-        output = '<table border="%s" cellpadding="%s" cellspacing="%s" frame="%s" rules="%s"%s>' % (border, cellpadding, cellspacing, frame, rules, css)
         if order == 'rowsfirst':
             rowcols = map(lambda x: map(lambda x: x.strip(), x.split(colsep)), map(lambda x: x.strip(), inner.split(rowsep)))
         else:
@@ -211,26 +242,17 @@ First row, first column | Second row, second column
                 else:
                     tmp.append(col.strip())
             rowcols.append(tmp)
-        rowcols = filter(lambda x: x and x[0], rowcols)
-        if autohead:
-            head = rowcols.pop(0)
-            output += '<thead><tr>'
-            for col in head:
-                output += '<th>%s</th>' % col
-            output += '</tr></thead>'
-        output += '<tbody>'
-        colspanpattern = re.compile('^%s(\d+)(.+)' % colspanchar, re.DOTALL)
-        for row in rowcols:
-            output += '<tr>'
-            for col in row:
-                match = colspanpattern.search(col)
-                if match:
-                    output += '<td colspan="%s">%s</td>' % match.groups()
-                else:
-                    output += '<td>%s</td>' % col
-            output += '</tr>'
-        output += '</tbody></table>'
-        return output
+        return filter(lambda x: x and x[0], rowcols)
+    
+    def text(self):
+        if not self.is_simple():
+            return ''.join([node.text() for node in self.nodes
+                            if node.__class__ == Row])
+        if not self.check_separators():
+            return self.raw_content
+        colspanpattern = re.compile('^%s\d+' % re.escape(self.arguments.colspanchar))
+        return ''.join(['%s\n' % ' '.join([colspanpattern.sub('', col).strip() for col in row])
+                        for row in self.split_simple(self.text_inner())])
 
 
 class Row(TagNode):
@@ -246,18 +268,32 @@ class Row(TagNode):
     """
     open_pattern = re.compile(patterns.no_argument % 'row')
     close_pattern = re.compile(patterns.closing % 'row')
+    # rendered differently outside of its parent
+    pure = False
+    
+    def validate(self):
+        if not isinstance(self.parent, Table):
+            self.soft_raise("Rows are only allowed within a table!")
+            return
+        for node in self.nodes:
+            if not isinstance(node, (Col, Head)) and node.raw_content.strip():
+                self.soft_raise("Only columns or heads are allowed directly nested inside a row")
     
     def parse(self):
         if not isinstance(self.parent, Table):
-            soft_raise("Rows are only allowed within a table!")
+            self.soft_raise("Rows are only allowed within a table!")
             return self.raw_content
         inner = ''
         for node in self.nodes:
             if isinstance(node, Col) or isinstance(node, Head):
                 inner += node.parse()
             elif node.raw_content.strip():
-                soft_raise("Only columns or heads are allowed directly nested inside a row")
+                self.soft_raise("Only columns or heads are allowed directly nested inside a row")
         return '<tr>%s</tr>' % inner
+    
+    def text(self):
+        return '%s\n' % ' '.join([node.text_inner().strip() for node in self.nodes
+                                  if isinstance(node, (Col, Head))])
 
 
 class Col(TagNode):
@@ -275,6 +311,8 @@ class Col(TagNode):
     """
     open_pattern = re.compile(r'(\[col\]|\[col="?(?P<argument>[^]]+)?"?\])')
     close_pattern = re.compile(patterns.closing % 'col')
+    # rendered differently outside of its parent
+    pure = False
     
     def __init__(self, parent, match, content, context):
         try:
@@ -283,15 +321,21 @@ class Col(TagNode):
             self.argument = None
         TagNode.__init__(self, parent, match, content, context)
         
+    def validate(self):
+        if not isinstance(self.parent, Row):
+            self.soft_raise("Columns are only allowed within a row!")
+        elif self.argument and not self.argument.isdigit():
+            self.soft_raise("Col argument must be digit")
+        
     def parse(self):
         if not isinstance(self.parent, Row):
-            soft_raise("Columns are only allowed within a row!")
+            self.soft_raise("Columns are only allowed within a row!")
             return self.raw_content
         if self.argument:
             if self.argument.isdigit():
                 return '<td colspan="%s">%s</td>' % (self.argument, self.parse_inner())
             else:
-                soft_fail("Col argument must be digit")
+                self.soft_raise("Col argument must be digit")
         return '<td>%s</td>' % self.parse_inner()
     
 
@@ -310,16 +354,24 @@ class Head(ArgumentTagNode):
     """
     open_pattern = re.compile(patterns.single_argument % 'head')
     close_pattern = re.compile(patterns.closing % 'head')
+    # rendered differently outside of its parent
+    pure = False
     
+    def validate(self):
+        if not isinstance(self.parent, Row):
+            self.soft_raise("Heads are only allowed within a row!")
+        elif self.argument and not self.argument.isdigit():
+            self.soft_raise("Head argument must be digit")
+        
     def parse(self):
         if not isinstance(self.parent, Row):
-            soft_raise("Heads are only allowed within a row!")
+            self.soft_raise("Heads are only allowed within a row!")
             return self.raw_content
         if self.argument:
             if self.argument.isdigit():
                 return '<th colspan="%s">%s</th>' % (self.argument, self.parse_inner())
             else:
-                soft_raise("Head argument must be digit")
+                self.soft_raise("Head argument must be digit")
         return '<th>%s</th>' % self.parse_inner()
 
 
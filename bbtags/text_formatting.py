@@ -1,14 +1,31 @@
 from bbcode import *
 import re
-# Pygments if available
-try:
-    from pygments import highlight
-    from pygments.lexers import guess_lexer, get_lexer_by_name, TextLexer
-    from pygments.formatters import HtmlFormatter
-    from pygments.util import ClassNotFound
-    from bbcode import mypygments
-except ImportError:
-    highlight = None
+
+triggers = ('[hr', '[p]', '[/p]', '[title]', '[/title]', '[subtitle]',
+            '[/subtitle]', '[h', '[/h', '[i]', '[/i]', '[b]', '[/b]', '[u]',
+            '[/u]', '[size', '[/size]', '[color', '[/color]', '[indent]',
+            '[/indent]', '[outdent]', '[/outdent]', '[quote]', '[/quote]',
+            '[text', '[/text]', '[code', '[/code]', '[strike]', '[/strike]')
+
+_pygments = []
+
+def get_pygments():
+    """
+    Import Pygments (and register the bbdocs lexer) on first use. Returns None
+    if Pygments is not available.
+    """
+    if not _pygments:
+        try:
+            from pygments import highlight
+            from pygments.lexers import guess_lexer, get_lexer_by_name, TextLexer
+            from pygments.formatters import HtmlFormatter
+            from pygments.util import ClassNotFound
+            from bbcode import mypygments
+            _pygments.append((highlight, guess_lexer, get_lexer_by_name,
+                              TextLexer, HtmlFormatter, ClassNotFound))
+        except ImportError:
+            _pygments.append(None)
+    return _pygments[0]
 
 
 class HR(SelfClosingTagNode):
@@ -26,6 +43,9 @@ class HR(SelfClosingTagNode):
     
     def parse(self):
         return '<hr />'
+    
+    def text(self):
+        return '\n'
 
 
 class P(ReplaceTagNode):
@@ -39,6 +59,10 @@ class P(ReplaceTagNode):
     verbose_name = 'Paragraph'
     open_pattern = re.compile(patterns.no_argument % 'p')
     close_pattern = re.compile(patterns.closing % 'p')
+    render_inner_first = True
+    
+    def text(self):
+        return '%s\n' % self.text_inner()
     
     
 class Title(ReplaceTagNode):
@@ -53,6 +77,10 @@ class Title(ReplaceTagNode):
     verbose_name = 'Title'
     open_pattern = re.compile(patterns.no_argument % 'title')
     close_pattern = re.compile(patterns.closing % 'title')
+    render_inner_first = True
+    
+    def text(self):
+        return '%s\n' % self.text_inner()
     
 class Subtitle(ReplaceTagNode):
     """
@@ -66,6 +94,10 @@ class Subtitle(ReplaceTagNode):
     verbose_name = 'Subtitle'
     open_pattern = re.compile(patterns.no_argument % 'subtitle')
     close_pattern = re.compile(patterns.closing % 'subtitle')
+    render_inner_first = True
+    
+    def text(self):
+        return '%s\n' % self.text_inner()
     
     
 class H(ArgumentTagNode):
@@ -81,10 +113,14 @@ class H(ArgumentTagNode):
     verbose_name = 'Heading'
     open_pattern = re.compile(r'\[h(?P<argument>[1-6])\]')
     close_pattern = re.compile(r'\[/h[1-6]\]')
+    render_inner_first = True
     
     def parse(self):
         return '<h%s>%s</h%s>' % (self.argument, self.parse_inner(), self.argument)
     
+    def text(self):
+        return '%s\n' % self.text_inner()
+    
     
 class Heading(ArgumentTagNode):
     """
@@ -101,17 +137,25 @@ class Heading(ArgumentTagNode):
     vebose_name = 'Simple Heading'
     open_pattern = re.compile(patterns.single_argument % 'heading')
     close_pattern = re.compile(patterns.closing % 'heading')
+    render_inner_first = True
     _aliases = {'small':'5', 'medium':'4', 'big':'3'}
     
+    def validate(self):
+        if self.argument and not self.argument.lower() in self._aliases:
+            self.soft_raise("Size '%s' not allowed." % self.argument.lower())
+    
     def parse(self):
         if not self.argument:
             self.argument = 'medium'
         arg = self.argument.lower()
         if not arg in self._aliases:
-            soft_raise("Size '%s' not allowed." % arg)
+            self.soft_raise("Size '%s' not allowed." % arg)
             return self.parse_inner()
         size = self._aliases[arg]
         return '<h%s>%s</h%s>' % (size, self.parse_inner(), size)
+    
+    def text(self):
+        return '%s\n' % self.text_inner()
         
 
 
@@ -126,6 +170,7 @@ class Em(ReplaceTagNode):
     verbose_name = 'Italic'
     open_pattern = re.compile(patterns.no_argument % 'i')
     close_pattern = re.compile(patterns.closing % 'i')
+    render_inner_first = True
 
 
 class Strong(ReplaceTagNode):
@@ -139,6 +184,7 @@ class Strong(ReplaceTagNode):
     verbose_name = 'Bold'
     open_pattern = re.compile(patterns.no_argument % 'b')
     close_pattern = re.compile(patterns.closing % 'b')
+    render_inner_first = True
 
 
 class U(ReplaceTagNode):
@@ -152,6 +198,7 @@ class U(ReplaceTagNode):
     verbose_name = 'Underline'
     open_pattern = re.compile(patterns.no_argument % 'u')
     close_pattern = re.compile(patterns.closing % 'u')
+    render_inner_first = True
         
         
 class Size(ArgumentTagNode):
@@ -169,13 +216,18 @@ class Size(ArgumentTagNode):
     _allowed = ('tiny','small','normal','big','huge')
     open_pattern = re.compile(patterns.single_argument % 'size')
     close_pattern = re.compile(patterns.closing % 'size')
+    render_inner_first = True
+    
+    def validate(self):
+        if self.argument and not self.argument.lower() in self._allowed:
+            self.soft_raise("Size '%s' not allowed." % self.argument.lower())
     
     def parse(self):
         if not self.argument:
             return self.parse_inner()
         arg = self.argument.lower()
         if not arg in self._allowed:
-            soft_raise("Size '%s' not allowed." % arg)
+            self.soft_raise("Size '%s' not allowed." % arg)
             return self.parse_inner()
         return '<span class="%s">%s</span>' % (arg, self.parse_inner())
     
@@ -332,6 +384,14 @@ class Color(ArgumentTagNode):
     _hex = re.compile('#?(?P<hexcode>[0-9a-f]{6}|[0-9a-f]{3})')
     open_pattern = re.compile(patterns.single_argument % 'color')
     close_pattern = re.compile(patterns.closing % 'color')
+    render_inner_first = True
+    
+    def validate(self):
+        if not self.argument:
+            return
+        argument = self.argument.lower()
+        if not argument in self._color_names and not self._hex.match(argument):
+            self.soft_raise("Color '%s' not allowed." % argument)
     
     def parse(self):
         if not self.argument:
@@ -342,7 +402,7 @@ class Color(ArgumentTagNode):
         else:
             match = self._hex.match(argument)
             if not match:
-                soft_raise("Color '%s' not allowed." % argument)
+                self.soft_raise("Color '%s' not allowed." % argument)
                 return self.parse_inner()
             else:
                 hex = '#' + match.groupdict()['hexcode']
@@ -359,6 +419,7 @@ class Indent(TagNode):
     """
     open_pattern = re.compile(patterns.no_argument % 'indent')
     close_pattern = re.compile(patterns.closing % 'indent')
+    render_inner_first = True
     
     def parse(self):
         return '<div class="indent">%s</div>' % self.parse_inner()
@@ -374,6 +435,7 @@ class Outdent(TagNode):
     """
     open_pattern = re.compile(patterns.no_argument % 'outdent')
     close_pattern = re.compile(patterns.closing % 'outdent')
+    render_inner_first = True
     
     def parse(self):
         return '<div class="outdent">%s</div>' % self.parse_inner()
@@ -389,9 +451,13 @@ class Quote(TagNode):
     """
     open_pattern = re.compile(patterns.no_argument % 'quote')
     close_pattern = re.compile(patterns.closing % 'quote')
+    render_inner_first = True
     
     def parse(self):
         return '<div class="quote">%s</div>' % self.parse_inner()
+    
+    def text(self):
+        return '%s\n' % self.text_inner()
 
 
 class Text(ArgumentTagNode):
@@ -408,8 +474,13 @@ class Text(ArgumentTagNode):
     """
     open_pattern = re.compile(patterns.single_argument % 'text')
     close_pattern = re.compile(patterns.closing % 'text')
+    render_inner_first = True
     _allowed = ('left','right','justify', 'center')
     
+    def validate(self):
+        if self.argument and not self.argument.lower() in self._allowed:
+            self.soft_raise("Text alignment '%s' not allowed." % self.argument.lower())
+    
     def parse(self):
         if not self.argument:
             return self.parse_inner()
@@ -417,7 +488,7 @@ class Text(ArgumentTagNode):
         if not argument:
             return self.parse_inner()
         if not argument in self._allowed:
-            soft_raise("Text alignment '%s' not allowed." % argument)
+            self.soft_raise("Text alignment '%s' not allowed." % argument)
             return self.parse_inner()
         return '<p style="text-align:%s;">%s</p>' % (argument, self.parse_inner())
 
@@ -440,6 +511,7 @@ class Code(TagNode):
     """ 
     open_pattern = re.compile(r'\[code\]|\[code=(?P<argument>[^\]]+)\]|\[code( (\w+)=("[^\]"]+"|[^\] ]+))?( (\w+)=("[^\]"]+"|[^\] ]+))?( (\w+)=("[^\]"]+"|[^\] ]+))?\]')
     close_pattern = re.compile(patterns.closing % 'code')
+    validate_inner = False
     
     _arguments = {'lang': '',
                   'linenos': '1',
@@ -460,6 +532,10 @@ class Code(TagNode):
             kwargs['lang'] = gd['argument']
         self.arguments = kwargs
     
+    def validate(self):
+        if not self.arguments['hl_line'].isdigit():
+            self.soft_raise("Code argument hl_line must be digit")
+    
     def parse(self):
         """
         pygment highlighting
@@ -467,8 +543,10 @@ class Code(TagNode):
         inner = ''
         for node in self.nodes:
             inner += node.raw_content
-        if highlight is None:
+        pygments = get_pygments()
+        if pygments is None:
             return '<pre>%s</pre>' % inner
+        highlight, guess_lexer, get_lexer_by_name, TextLexer, HtmlFormatter, ClassNotFound = pygments
         if self.arguments['lang']:
             try:
                 lexer = get_lexer_by_name(self.arguments['lang'])
@@ -494,6 +572,9 @@ class Code(TagNode):
         hilighted = highlight(inner, lexer, formatter)
         return hilighted
     
+    def text(self):
+        return ''.join([node.raw_content for node in self.nodes])
+    
     
 class Strike(TagNode):
     """
@@ -505,6 +586,7 @@ class Strike(TagNode):
     """
     open_pattern = re.compile(patterns.no_argument % 'strike')
     close_pattern = re.compile(patterns.closing % 'strike')
+    render_inner_first = True
     verbose_name = 'Strike Through'
     
     def parse(self):
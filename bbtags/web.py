@@ -2,6 +2,10 @@ from bbcode import *
 import re
 import urllib
 
+# AutoDetectURL matches any text containing a domain
+triggers = ('[url', '[/url]', '[img', '[/img]', '[email', '[/email]',
+            '[youtube]', '[/youtube]', '.')
+
 class Url(TagNode):
     """
     Creates a hyperlink.
@@ -17,6 +21,16 @@ class Url(TagNode):
                                '?(?P<val2>[^ ]+)"?)?\])')
     close_pattern = re.compile(patterns.closing % 'url')
     
+    def validate(self):
+        if self.match.group('href'):
+            return
+        # without an argument the inner content is the link
+        self.validate_inner = False
+        for node in self.nodes:
+            if not (node.is_text_node or isinstance(node, AutoDetectURL)):
+                self.soft_raise("Url tag cannot have nested tags without "
+                                "an argument.")
+    
     def parse(self):
         gd = self.match.groupdict()
         gd.update({'css':''})
@@ -49,6 +63,12 @@ class Url(TagNode):
         css = self.variables.resolve(css)
         return '<a href="%s"%s>%s</a>' % (href, css, inner)
     
+    def text(self):
+        if self.match.group('href'):
+            return self.text_inner()
+        return self.variables.resolve(''.join([node.raw_content
+                                               for node in self.nodes]))
+    
 
 class Email(TagNode):
     """
@@ -80,6 +100,9 @@ class Email(TagNode):
                 inner += node.raw_content
             return '<a href="mailto:%s">%s</a>' % (inner, inner)
     
+    def text(self):
+        return ''.join([node.raw_content for node in self.nodes])
+    
     
 
     
@@ -100,6 +123,13 @@ class Img(ArgumentTagNode):
     verbose_name = 'Image'
     open_pattern = re.compile(patterns.single_argument % 'img')
     close_pattern = re.compile(patterns.closing % 'img')
+    validate_inner = False
+    
+    def validate(self):
+        for node in self.nodes:
+            if not (node.is_text_node or isinstance(node, AutoDetectURL)):
+                self.soft_raise("Img tag cannot have nested tags without an argument.")
+                return
     
     def parse(self):
         inner = ''
@@ -107,7 +137,7 @@ class Img(ArgumentTagNode):
             if node.is_text_node or isinstance(node, AutoDetectURL):
                 inner += node.raw_content
             else:
-                soft_raise("Img tag cannot have nested tags without an argument.")
+                self.soft_raise("Img tag cannot have nested tags without an argument.")
                 return self.raw_content
         inner = self.variables.resolve(inner)
         if self.argument:
@@ -115,6 +145,9 @@ class Img(ArgumentTagNode):
         else:
             return '<img src="%s" alt="image" />' % inner
     
+    def text(self):
+        return ''
+    
     
 class Youtube(TagNode):
     """
@@ -134,15 +167,15 @@ class Youtube(TagNode):
             if node.is_text_node or isinstance(node, AutoDetectURL):
                 inner += node.raw_content
             else:
-                soft_raise("Youtube tag cannot have nested tags")
+                self.soft_raise("Youtube tag cannot have nested tags")
                 return self.raw_content
         match = self._video_id_pattern.search(url)
         if not match:
-            soft_raise("'%s' does not seem like a youtube link" % url)
+            self.soft_raise("'%s' does not seem like a youtube link" % url)
             return self.raw_content
         videoid = match.groups()
         if not videoid:
-            soft_raise("'%s' does not seem like a youtube link" % url)
+            self.soft_raise("'%s' does not seem like a youtube link" % url)
             return self.raw_content
         videoid = videoid[0]
         return (
@@ -154,9 +187,14 @@ class Youtube(TagNode):
             'llowscriptaccess="always" allowfullscreen="true" width="560" heigh'
         )
     
+    def text(self):
+        return ''
+    
     
 class AutoDetectURL(SelfClosingTagNode):
-    open_pattern = re.compile('[^[\]](?#Protocol)(?:(?:ht|f)tp(?:s?)\:\/\/|~/|/'
+    # The url must not start within a word or domain, otherwise a long dotted
+    # word is scanned again from each of its characters.
+    open_pattern = re.compile('(?:^|[^[\]])(?<![-\w.])(?#Protocol)(?:(?:ht|f)tp(?:s?)\:\/\/|~/|/'
                               ')?(?#Username:Password)(?:\w+:\w+@)?(?#Subdomain'
                               's)(?:(?:[-\w]+\.)+(?#TopLevel Domains)(?:com|org'
                               '|net|gov|mil|biz|info|mobi|name|aero|jobs|museum'
@@ -172,6 +210,9 @@ class AutoDetectURL(SelfClosingTagNode):
         url = self.match.group()
         return '<a href="%s">%s</a>' % (url, url)
     
+    def text(self):
+        return self.match.group()
+    
 
 register(Url)
 register(Img)
@@ -0,0 +1,29 @@
+"""
+Benchmarks for django-bbcode.
+
+The benchmarks need django settings with 'bbcode' in INSTALLED_APPS. Run them
+as modules, for example:
+
+    DJANGO_SETTINGS_MODULE=mysite.settings python -m bbcode.benchmarks.coldstart
+"""
+import time
+
+def setup():
+    """
+    Set up django (if needed by the installed version).
+    """
+    import django
+    if hasattr(django, 'setup'):
+        django.setup()
+
+def timed(func, *args, **kwargs):
+    """
+    Call func and return the time it took in seconds.
+    """
+    start = time.time()
+    func(*args, **kwargs)
+    return time.time() - start
+
+def median(values):
+    values = sorted(values)
+    return values[len(values) // 2]
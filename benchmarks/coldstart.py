@@ -0,0 +1,82 @@
+"""
+Measures the time of the first render in a new worker process.
+
+Three kinds of workers are compared:
+
+    scratch: a new python process importing bbcode and running autodiscover.
+    fork:    forked from a master which only imported bbcode (the workers
+             run autodiscover and compile the patterns on their first render).
+    frozen:  forked from a master holding a bbcode.Parser.freeze() snapshot.
+
+Usage: python -m bbcode.benchmarks.coldstart [-r <runs>]
+"""
+from optparse import OptionParser
+import subprocess
+import time
+import sys
+import os
+from bbcode import benchmarks
+
+SAMPLE = """[quote][b]Hello[/b] world :)[/quote]
+[url]http://www.example.com[/url] [size=big]big[/size]
+[table]
+name | age
+me | 21
+[/table]"""
+
+SCRATCH = """
+import time
+start = time.time()
+from bbcode import benchmarks
+benchmarks.setup()
+import bbcode
+bbcode.parse(%r, auto_discover=True)
+print time.time() - start
+"""
+
+def scratch_worker():
+    process = subprocess.Popen([sys.executable, '-c', SCRATCH % SAMPLE],
+                               stdout=subprocess.PIPE)
+    return float(process.communicate()[0])
+
+def forked_worker(render):
+    read, write = os.pipe()
+    pid = os.fork()
+    if not pid:
+        os.close(read)
+        os.write(write, repr(benchmarks.timed(render)))
+        os._exit(0)
+    os.close(write)
+    os.waitpid(pid, 0)
+    elapsed = float(os.read(read, 64))
+    os.close(read)
+    return elapsed
+
+def run(runs):
+    """
+    Returns a dictionary of worker kind: list of first render timings
+    """
+    import bbcode
+    results = {}
+    results['scratch'] = [scratch_worker() for i in range(runs)]
+    render = lambda: bbcode.parse(SAMPLE, auto_discover=True)
+    results['fork'] = [forked_worker(render) for i in range(runs)]
+    parser = bbcode.Parser.freeze()
+    render = lambda: parser.parse(SAMPLE)
+    results['frozen'] = [forked_worker(render) for i in range(runs)]
+    return results
+
+def main():
+    parser = OptionParser()
+    parser.add_option('-r', '--runs', action='store', type='int', dest='runs',
+                      default=10)
+    options, args = parser.parse_args()
+    benchmarks.setup()
+    results = run(options.runs)
+    for kind in ('scratch', 'fork', 'frozen'):
+        timings = results[kind]
+        print '%-8s min %8.2fms  median %8.2fms' % (kind, min(timings) * 1000,
+                                                   benchmarks.median(timings) * 1000)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,153 @@
+"""
+Checks that parsing stays close to linear on adversarial input.
+
+Each case generates input of growing size, aimed at a pattern or a parsing
+phase which could backtrack or loop (eg. long dotted words for AutoDetectURL,
+unclosed argument lists, chains of unclosed tags). The tokenize, tree and
+render phases are timed separately and the growth exponent is fitted on a
+log-log scale. A phase growing faster than n log n (an exponent above the
+threshold) is reported as failed and the exit status is 1.
+
+Each phase is timed in processor time with the garbage collector disabled
+(after collecting the garbage of the previous run), the fastest of several runs
+is used for each of five sizes, so collections and other processes do not bend
+the fit.
+
+Usage: python -m bbcode.benchmarks.complexity [-s <smallest size> -t <threshold>
+                                               -r <repeats> -c <case>]
+"""
+from optparse import OptionParser
+import gc
+import math
+import sys
+import time
+from bbcode import benchmarks
+
+# processor time of this process, not affected by other processes
+clock = getattr(time, 'process_time', time.clock)
+
+def repeat(unit, n):
+    return unit * (n // len(unit) + 1)
+
+# name: function returning an input of about n characters
+CASES = {
+    'dotted words': lambda n: repeat('1.', n),
+    'dotted domains': lambda n: repeat('a1.', n) + ' ',
+    'long url': lambda n: 'see www.example.com/' + repeat('a/', n) + ' ',
+    'urls': lambda n: repeat('www.example.com ', n),
+    'unclosed table arguments': lambda n: repeat('[table a=b c=d e=f g=h i=j k=l m=n o=p q=r s=t u=v ', n),
+    'unclosed range arguments': lambda n: repeat('[range a=b c=d e=f g=h ', n),
+    'tables': lambda n: repeat('[table border=1 css=x][/table]', n),
+    'unclosed tags': lambda n: '[i]' + repeat('[b]x', n) + '[/i]',
+    # the tags are closed, tags left open at the end nest as deep as there
+    # are tags and each level copies the html of all levels within it
+    'stray closing tags': lambda n: repeat('[b]x[/b][/i]', n),
+    'nested stray closing tags': lambda n: '[quote]' * 100 + repeat('x[/b]', n) + '[/quote]' * 100,
+    'lines': lambda n: repeat('[b]x[/b]\n', n),
+    'smilies': lambda n: repeat(':) ;) :D ', n),
+    'brackets': lambda n: repeat('[[]]', n),
+    'simple table': lambda n: '[table]\n' + repeat('a | b | c\n', n) + '[/table]',
+    'list items': lambda n: '[ul]' + repeat('[*] item ', n) + '[/ul]',
+}
+
+PHASES = ('tokenize', 'tree', 'render')
+
+def timed(func):
+    """
+    Return the processor time func took, with the garbage collector disabled.
+    """
+    gc.collect()
+    gc.disable()
+    try:
+        start = clock()
+        func()
+        return clock() - start
+    finally:
+        gc.enable()
+
+def time_phases(content, parser):
+    """
+    Returns the time of each phase. The tree is built like parse with
+    strict=False does, closing tags without an opening tag are kept as text.
+    """
+    import bbcode
+    library = parser.library
+    timings = {}
+    taglist = []
+    timings['tokenize'] = timed(
+        lambda: taglist.extend(library.get_taglist(content, tokenizers=parser.tokenizers)))
+    heads = []
+    timings['tree'] = timed(
+        lambda: heads.append(library.build_tree(content, taglist,
+                                                parse_context=bbcode.ParseContext(),
+                                                strict=False)))
+    timings['render'] = timed(
+        lambda: bbcode.convert_linefeeds(heads[0].parse()))
+    return timings
+
+def fit(sizes, timings):
+    """
+    Returns the exponent k of timings ~ sizes ** k (least squares on log-log).
+    """
+    points = [(math.log(size), math.log(max(timing, 1e-6)))
+              for size, timing in zip(sizes, timings)]
+    mean_x = sum([x for x, y in points]) / len(points)
+    mean_y = sum([y for x, y in points]) / len(points)
+    numerator = sum([(x - mean_x) * (y - mean_y) for x, y in points])
+    denominator = sum([(x - mean_x) ** 2 for x, y in points])
+    return numerator / denominator
+
+def check(name, sizes, parser, repeats=5):
+    """
+    Returns a dictionary of phase: exponent for a case.
+    """
+    generate = CASES[name]
+    results = dict([(phase, []) for phase in PHASES])
+    for size in sizes:
+        content = generate(size)
+        runs = [time_phases(content, parser) for i in range(repeats)]
+        for phase in PHASES:
+            results[phase].append(min([run[phase] for run in runs]))
+    exponents = {}
+    for phase in PHASES:
+        exponents[phase] = fit(sizes, results[phase])
+    return exponents
+
+def main():
+    parser = OptionParser()
+    parser.add_option('-s', '--size', action='store', type='int', dest='size',
+                      default=4000, help='smallest input size')
+    parser.add_option('-t', '--threshold', action='store', type='float',
+                      dest='threshold', default=1.3,
+                      help='maximal exponent (n log n is about 1.1)')
+    parser.add_option('-r', '--repeats', action='store', type='int',
+                      dest='repeats', default=5,
+                      help='runs of each size, the fastest is used')
+    parser.add_option('-c', '--case', action='append', dest='cases',
+                      help='only run this case (repeatable)')
+    options, args = parser.parse_args()
+    benchmarks.setup()
+    import bbcode
+    bbcode.autodiscover()
+    bbcode.lib.load_all()
+    bbparser = bbcode.Parser()
+    sizes = [options.size * 2 ** i for i in range(5)]
+    failed = []
+    for name in sorted(options.cases or CASES):
+        exponents = check(name, sizes, bbparser, options.repeats)
+        line = '%-26s' % name
+        for phase in PHASES:
+            if phase in exponents:
+                line += ' %s %5.2f' % (phase, exponents[phase])
+                if exponents[phase] > options.threshold:
+                    failed.append('%s (%s)' % (name, phase))
+                    line += '!'
+                else:
+                    line += ' '
+        print line
+    if failed:
+        print 'Faster than n log n: %s' % ', '.join(failed)
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
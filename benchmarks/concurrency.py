@@ -0,0 +1,132 @@
+"""
+Parses and validates contents with errors from many threads at once and checks
+that every thread gets exactly the errors (and line numbers) of its own
+content, see bbcode.ParseContext. A tag reporting its errors with the module
+level bbcode.soft_raise, like tags written before ParseContext, is registered
+too, so the fallback to the active context of each thread is checked as well.
+
+Before that, the threads render their first content at once, importing the
+same lazy tag modules (see bbcode.Library.load_module) at the same time.
+
+Exits with status 1 if a thread got other errors than the content has when
+parsed alone or if rendering the first content raised.
+
+Usage: python -m bbcode.benchmarks.concurrency [-t <threads> -i <iterations>]
+"""
+from optparse import OptionParser
+import re
+import sys
+import threading
+from bbcode import benchmarks
+
+def register_legacy_tag():
+    import bbcode
+
+    class Legacy(bbcode.TagNode):
+        """
+        Reports its content as an error with the module level soft_raise.
+        """
+        open_pattern = re.compile(bbcode.patterns.no_argument % 'legacy')
+        close_pattern = re.compile(bbcode.patterns.closing % 'legacy')
+
+        def parse(self):
+            bbcode.soft_raise('legacy %s' % self.parse_inner())
+            return ''
+
+    # the default namespaces are taken from the module name
+    Legacy.__module__ = 'bbcode.bbtags.legacy'
+    bbcode.register(Legacy)
+
+# triggers all lazy tag modules
+FIRST_CONTENT = (u'[url]http://example.com[/url] :) [ul][*]a[/ul] '
+                 u'[table][row][col]x[/col][/row][/table] [hidden]h[/hidden] '
+                 u'[brainfuck]+.[/brainfuck]')
+
+def first_render(start, failures):
+    import bbcode
+    start.wait()
+    try:
+        bbcode.parse(FIRST_CONTENT, strict=False)
+    except Exception, e:
+        failures.append('%s: %s' % (e.__class__.__name__, e))
+
+def get_content(index):
+    """
+    Returns a content with errors unique to index on lines depending on it.
+    """
+    lines = [u'line'] * (index % 7)
+    lines += [u'[color=nope%s]a[/color]' % index,
+              u'[legacy]thread %s[/legacy]' % index,
+              u'[size=wrong%s]b[/size] [b]unclosed %s' % (index, index)]
+    return u'\n'.join(lines)
+
+def get_errors(content):
+    import bbcode
+    html, errors = bbcode.parse(content, strict=False)
+    return ([(error.lineno, unicode(error.message)) for error in errors],
+            [(error.lineno, unicode(error.message))
+             for error in bbcode.validate(content) or []])
+
+def worker(index, expected, iterations, start, failures):
+    content = get_content(index)
+    start.wait()
+    for i in range(iterations):
+        errors = get_errors(content)
+        if errors != expected:
+            failures.append((index, expected, errors))
+            return
+
+def main():
+    parser = OptionParser()
+    parser.add_option('-t', '--threads', action='store', type='int',
+                      dest='threads', default=32)
+    parser.add_option('-i', '--iterations', action='store', type='int',
+                      dest='iterations', default=50)
+    options, args = parser.parse_args()
+    benchmarks.setup()
+    import bbcode
+    bbcode.autodiscover()
+    # switch threads as often as possible
+    sys.setcheckinterval(1)
+    start = threading.Event()
+    failures = []
+    threads = [threading.Thread(target=first_render, args=(start, failures))
+               for index in range(options.threads)]
+    for thread in threads:
+        thread.start()
+    start.set()
+    for thread in threads:
+        thread.join()
+    if failures:
+        print 'Rendering the first content failed: %s' % failures[0]
+        sys.exit(1)
+    bbcode.lib.load_all()
+    register_legacy_tag()
+    expected = [get_errors(get_content(index))
+                for index in range(options.threads)]
+    for index, (parse_errors, validate_errors) in enumerate(expected):
+        messages = [message for lineno, message in parse_errors]
+        if not ('legacy thread %s' % index in messages and
+                "Color 'nope%s' not allowed." % index in messages):
+            print 'Content %s does not raise the expected errors: %r' % (
+                index, messages)
+            sys.exit(1)
+    start = threading.Event()
+    failures = []
+    threads = [threading.Thread(target=worker,
+                                args=(index, expected[index],
+                                      options.iterations, start, failures))
+               for index in range(options.threads)]
+    for thread in threads:
+        thread.start()
+    elapsed = benchmarks.timed(lambda: (start.set(),
+                                        [thread.join() for thread in threads]))
+    print '%s threads, %s parses and validations each: %.2fs' % (
+        options.threads, options.iterations, elapsed)
+    for index, wanted, errors in failures:
+        print 'Thread %s got %r instead of %r' % (index, errors, wanted)
+    if failures:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,144 @@
+"""
+Generator of realistic forum posts for benchmarks. The posts are made of
+paragraphs of text with formatting, smilies, urls, quotes, code blocks, tables,
+lists and variables. The same seed always generates the same posts.
+"""
+import random
+
+WORDS = ('the', 'a', 'forum', 'post', 'reply', 'thread', 'code', 'python',
+         'django', 'template', 'really', 'think', 'works', 'broken', 'fixed',
+         'version', 'release', 'thanks', 'question', 'answer', 'because',
+         'maybe', 'never', 'always', 'install', 'server', 'database', 'query')
+
+SMILIES = (':)', ':-)', ':D', ';)', ':P', ':(', 'xD', ':-|', ':smile:')
+
+DOMAINS = ('www.example.com', 'docs.djangoproject.com', 'python.org',
+           'forum.example.org')
+
+CODE = '''def %(name)s(request, *args):
+    """%(words)s"""
+    for item in args:
+        if item is None:
+            return None
+    return render(request, '%(name)s.html')
+'''
+
+class Generator(object):
+    """
+    Generates posts using its own random number generator.
+    """
+    def __init__(self, seed=0):
+        self.random = random.Random(seed)
+
+    def words(self, minimum=3, maximum=12):
+        count = self.random.randint(minimum, maximum)
+        return ' '.join([self.random.choice(WORDS) for i in range(count)])
+
+    def url(self):
+        return 'http://%s/%s' % (self.random.choice(DOMAINS),
+                                 self.random.choice(WORDS))
+
+    def sentence(self):
+        bits = [self.words()]
+        roll = self.random.random()
+        if roll < 0.15:
+            bits.append('[b]%s[/b]' % self.words(1, 3))
+        elif roll < 0.25:
+            bits.append('[i]%s[/i]' % self.words(1, 3))
+        elif roll < 0.3:
+            bits.append('[color=%s]%s[/color]' % (self.random.choice(('red', 'blue', '#a0a0a0')), self.words(1, 3)))
+        elif roll < 0.35:
+            bits.append('[size=%s]%s[/size]' % (self.random.choice(('small', 'big')), self.words(1, 3)))
+        roll = self.random.random()
+        if roll < 0.2:
+            bits.append(self.random.choice(SMILIES))
+        elif roll < 0.3:
+            bits.append(self.random.choice(DOMAINS))
+        elif roll < 0.4:
+            bits.append('[url=%s]%s[/url]' % (self.url(), self.words(1, 4)))
+        return ' '.join(bits) + '.'
+
+    def paragraph(self):
+        return ' '.join([self.sentence() for i in range(self.random.randint(1, 5))])
+
+    def quote(self, depth=0):
+        inner = self.paragraph()
+        if depth < 2 and self.random.random() < 0.3:
+            inner = self.quote(depth + 1) + '\n' + inner
+        return '[quote][b]%s[/b] wrote:\n%s[/quote]' % (self.random.choice(WORDS), inner)
+
+    def code(self):
+        lang = self.random.choice(('python', 'text', ''))
+        code = CODE % {'name': self.random.choice(WORDS), 'words': self.words()}
+        if lang:
+            return '[code=%s]\n%s[/code]' % (lang, code)
+        return '[code]\n%s[/code]' % code
+
+    def table(self):
+        rows = self.random.randint(2, 6)
+        if self.random.random() < 0.5:
+            lines = [' | '.join([self.words(1, 2) for i in range(3)]) for j in range(rows)]
+            return '[table]\n%s\n[/table]' % '\n'.join(lines)
+        cells = lambda tag: ''.join(['[%s]%s[/%s]' % (tag, self.words(1, 2), tag) for i in range(3)])
+        lines = ['[row]%s[/row]' % cells('head')]
+        lines += ['[row]%s[/row]' % cells('col') for j in range(rows)]
+        return '[table border=1]\n%s\n[/table]' % '\n'.join(lines)
+
+    def list(self):
+        tag = self.random.choice(('ul', 'ol'))
+        items = ['[*] %s' % self.sentence() for i in range(self.random.randint(2, 6))]
+        return '[%s]\n%s\n[/%s]' % (tag, '\n'.join(items), tag)
+
+    def variables(self):
+        name = self.random.choice(WORDS)
+        return '[def]%s=%s[/def]\nSee [url=$%s$]here[/url] and [url]$%s$[/url].' % (name, self.url(), name, name)
+
+    def post(self):
+        """
+        Return a post of 1 to 8 blocks.
+        """
+        blocks = []
+        for i in range(self.random.randint(1, 8)):
+            roll = self.random.random()
+            if roll < 0.5:
+                blocks.append(self.paragraph())
+            elif roll < 0.65:
+                blocks.append(self.quote())
+            elif roll < 0.75:
+                blocks.append(self.code())
+            elif roll < 0.83:
+                blocks.append(self.table())
+            elif roll < 0.93:
+                blocks.append(self.list())
+            else:
+                blocks.append(self.variables())
+        return unicode('\n\n'.join(blocks))
+
+def generate(posts=100, seed=0):
+    """
+    Return a list of posts.
+    """
+    generator = Generator(seed)
+    return [generator.post() for i in range(posts)]
+
+def thread(posts=50, seed=0, depth=3):
+    """
+    Return the posts of a reply-heavy thread. Most replies quote one of the
+    last posts verbatim, with the quotes it contains up to depth levels (the
+    quotes of a post at this depth are left out).
+    """
+    generator = Generator(seed)
+    # (post, post without the quote, quote depth)
+    replies = []
+    for i in range(posts):
+        post = text = generator.post()
+        level = 0
+        if replies and generator.random.random() < 0.8:
+            quoted, quoted_text, quoted_level = generator.random.choice(replies[-5:])
+            if quoted_level >= depth:
+                quoted, quoted_level = quoted_text, 0
+            post = u'[quote][b]%s[/b] wrote:\n%s[/quote]\n\n%s' % (
+                generator.random.choice(WORDS), quoted, text)
+            level = quoted_level + 1
+        replies.append((post, text, level))
+    return [post for post, text, level in replies]
@@ -0,0 +1,102 @@
+"""
+Applies random edits to bbcode.Document instances of the forum post corpus and
+checks that after each edit the html and the errors (with their line numbers)
+are the same as bbcode.parse returns for the edited content. The edits insert
+and delete tags, parts of tags, urls, smilies, blank lines and variables.
+
+Strict documents must raise ParserError for an edit exactly if bbcode.parse
+does and keep their previous content, html and errors then.
+
+Exits with status 1 and prints the first differing edit of each post
+otherwise.
+
+Usage: python -m bbcode.benchmarks.documents [-n <posts> -s <seed>
+                                              -e <edits per post>]
+"""
+from optparse import OptionParser
+import random
+import sys
+from bbcode import benchmarks
+from bbcode.benchmarks import corpus
+
+SNIPPETS = (u'x', u' ', u'\n', u'\n\n', u'[', u']', u'[b]', u'[/b]',
+            u'[i]y[/i]', u'[quote]', u'[/quote]', u'[url=', u'[/url]',
+            u'http://', u'www.example.com', u':)', u' :) ', u'[*]',
+            u'[color=nope]', u'[/color]', u'[def]a=b[/def]', u'$a$')
+
+def parse(content, strict):
+    """
+    Returns the html and the errors of bbcode.parse or None if it raises
+    ParserError.
+    """
+    import bbcode
+    try:
+        html, errors = bbcode.parse(content, strict=strict)
+    except bbcode.ParserError:
+        return None
+    return html, get_errors(errors)
+
+def get_errors(errors):
+    return [(error.lineno, unicode(error.message)) for error in errors]
+
+def check(post, strict, edits, rnd):
+    """
+    Edit a document of post and return a description of the first edit
+    rendering differently from bbcode.parse, or None.
+    """
+    import bbcode
+    if parse(post, strict) is None:
+        return None
+    document = bbcode.Document(post, strict=strict)
+    for i in range(edits):
+        content = document.content
+        start = rnd.randint(0, len(content))
+        end = min(len(content), start + rnd.choice((0, 0, 1, 5, 20)))
+        text = rnd.choice(SNIPPETS)
+        edited = content[:start] + text + content[end:]
+        expected = parse(edited, strict)
+        previous = document.html, get_errors(document.errors)
+        try:
+            document.edit(start, end, text)
+        except bbcode.ParserError:
+            if (expected is None and document.content == content
+                and (document.html, get_errors(document.errors)) == previous):
+                continue
+            return 'edit(%s, %s, %r) raised ParserError' % (start, end, text)
+        result = document.html, get_errors(document.errors)
+        if result != expected:
+            return 'edit(%s, %s, %r) of %r: %r instead of %r' % (
+                start, end, text, content, result, expected)
+    return None
+
+def main():
+    parser = OptionParser()
+    parser.add_option('-n', '--posts', action='store', type='int', dest='posts',
+                      default=100)
+    parser.add_option('-s', '--seed', action='store', type='int', dest='seed',
+                      default=0)
+    parser.add_option('-e', '--edits', action='store', type='int',
+                      dest='edits', default=20)
+    options, args = parser.parse_args()
+    benchmarks.setup()
+    import bbcode
+    bbcode.autodiscover()
+    bbcode.lib.load_all()
+    rnd = random.Random(options.seed)
+    failed = []
+    count = 0
+    for post in corpus.generate(options.posts, options.seed):
+        for strict in (True, False):
+            failure = check(post, strict, options.edits, rnd)
+            count += 1
+            if failure:
+                failed.append('%s: %s' % (strict and 'strict' or 'lenient',
+                                          failure))
+    print '%s documents, %s edits each: %s differ from bbcode.parse' % (
+        count, options.edits, len(failed))
+    if failed:
+        print '\n'.join(failed)
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+"""
+Compares rendering parse trees with the text nodes escaped all at once
+(bbcode.escape_text_nodes, done by HeadNode.parse) with escaping and resolving
+each text node when it is parsed, on the forum post corpus and on tag-dense
+content with thousands of short text nodes between tags.
+
+The html of both must be the same for every post, otherwise the exit status
+is 1. Content defining variables ([def], [range]) is always rendered text node
+by text node, so both columns of the 'variables' case use the same path.
+
+Usage: python -m bbcode.benchmarks.escaping [-n <posts> -s <seed>
+                                             -r <repeats>]
+"""
+from optparse import OptionParser
+import gc
+import sys
+from bbcode import benchmarks
+from bbcode.benchmarks import corpus
+
+FRAGMENTS = (u'[b]a & b[/b] ', u'[i]<x>[/i]', u' "y" ', u'[u]z[/u]',
+             u'[color=red]1 > 0[/color] ', u'[s]q[/s]\n')
+
+def tag_dense(count):
+    """
+    Returns a post of count short fragments, most of them tags.
+    """
+    return u''.join([FRAGMENTS[i % len(FRAGMENTS)] for i in range(count)])
+
+def per_node(heads):
+    import bbcode
+    return [bbcode.parse_nodes(head.nodes, head.parse_context)
+            for head in heads]
+
+def bulk(heads):
+    return [head.parse() for head in heads]
+
+def get_trees(posts, parser):
+    import bbcode
+    return [parser.get_parse_tree(post, parse_context=bbcode.ParseContext())
+            for post in posts]
+
+def main():
+    parser = OptionParser()
+    parser.add_option('-n', '--posts', action='store', type='int', dest='posts',
+                      default=100)
+    parser.add_option('-s', '--seed', action='store', type='int', dest='seed',
+                      default=0)
+    parser.add_option('-r', '--repeats', action='store', type='int',
+                      dest='repeats', default=5)
+    options, args = parser.parse_args()
+    benchmarks.setup()
+    import bbcode
+    bbcode.autodiscover()
+    bbcode.lib.load_all()
+    bbparser = bbcode.Parser()
+    posts = corpus.generate(options.posts, options.seed)
+    cases = (
+        ('corpus', posts),
+        ('tag dense', [tag_dense(10000)]),
+        ('variables', [u'[def]x=1[/def]' + tag_dense(10000)]),
+    )
+    failed = []
+    for name, contents in cases:
+        if bulk(get_trees(contents, bbparser)) != per_node(get_trees(contents, bbparser)):
+            failed.append(name)
+        timings = []
+        for benchmark in (per_node, bulk):
+            elapsed = []
+            for i in range(options.repeats):
+                heads = get_trees(contents, bbparser)
+                # the trees of the last run would be collected while timing
+                gc.collect()
+                elapsed.append(benchmarks.timed(benchmark, heads))
+            timings.append(benchmarks.median(elapsed))
+        print '%-10s per node %9.2fms  bulk %9.2fms %6.2fx' % (
+            name, timings[0] * 1000, timings[1] * 1000, timings[0] / timings[1])
+    if failed:
+        print 'The html differs for: %s' % ', '.join(failed)
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+"""
+Compares bbcode.excerpt with rendering the whole post for posts of growing
+length. The excerpt should take about the same time for all lengths.
+
+Each post is first checked: its excerpt must be the html of truncating the
+parse tree of the whole post (bbcode.truncate_tree), otherwise the exit
+status is 1.
+
+Usage: python -m bbcode.benchmarks.excerpt [-c <max chars> -s <seed>
+                                            -r <repeats>]
+"""
+from optparse import OptionParser
+import sys
+from bbcode import benchmarks
+from bbcode.benchmarks import corpus
+
+def excerpt(post, max_chars):
+    import bbcode
+    bbcode.excerpt(post, max_chars)
+
+def parse(post, max_chars):
+    import bbcode
+    bbcode.parse(post, strict=False)
+
+def truncated(post, max_chars):
+    """
+    Returns the excerpt made from the parse tree of the whole post.
+    """
+    import bbcode
+    parse_context = bbcode.ParseContext()
+    parse_context.activate()
+    try:
+        head = bbcode.Parser().get_parse_tree(post, parse_context=parse_context)
+        bbcode.truncate_tree(head, max_chars)
+        return bbcode.convert_linefeeds(head.parse())
+    finally:
+        parse_context.deactivate()
+
+def main():
+    parser = OptionParser()
+    parser.add_option('-c', '--chars', action='store', type='int',
+                      dest='chars', default=300)
+    parser.add_option('-s', '--seed', action='store', type='int', dest='seed',
+                      default=0)
+    parser.add_option('-r', '--repeats', action='store', type='int',
+                      dest='repeats', default=5)
+    options, args = parser.parse_args()
+    benchmarks.setup()
+    import bbcode
+    bbcode.autodiscover()
+    bbcode.lib.load_all()
+    posts = corpus.generate(200, options.seed)
+    failed = 0
+    for post in posts[:100]:
+        for max_chars in (10, options.chars, len(post)):
+            if bbcode.excerpt(post, max_chars) != truncated(post, max_chars):
+                failed += 1
+    print 'checked %s posts' % len(posts[:100])
+    for count in (1, 10, 100, 1000):
+        post = u'\n\n'.join((posts * (count // len(posts) + 1))[:count])
+        size = len(post.encode('utf-8')) / 1024.0
+        results = []
+        for name, benchmark in (('parse', parse), ('excerpt', excerpt)):
+            if name == 'parse' and count > 100:
+                continue
+            elapsed = benchmarks.median([benchmarks.timed(benchmark, post,
+                                                          options.chars)
+                                         for i in range(options.repeats)])
+            results.append('%s %9.2fms' % (name, elapsed * 1000))
+        print '%9.1fKB  %s' % (size, '  '.join(results))
+    if failed:
+        print 'Excerpt differs from the truncated parse tree %s times' % failed
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+"""
+Compares validating and then parsing a submitted post (two parses) with
+bbcode.parse_and_validate, both directly and through BBCodeFormField.
+
+Usage: python -m bbcode.benchmarks.forms [-n <posts>]
+"""
+from optparse import OptionParser
+from bbcode import benchmarks
+
+POST = u"""[quote][b]Someone[/b] wrote:
+I think [i]this[/i] is [size=big]important[/size][/quote]
+I disagree, see [url=http://www.example.com/page]this page[/url] :)
+
+[code=python]
+def hello(name):
+    print 'Hello %s' % name
+[/code]
+
+[table]
+name | age
+me | 21
+you | 22
+[/table]
+"""
+
+def before(posts):
+    import bbcode
+    for post in posts:
+        if not bbcode.validate(post, auto_discover=True):
+            bbcode.parse(post, auto_discover=True)
+
+def after(posts):
+    import bbcode
+    for post in posts:
+        bbcode.parse_and_validate(post, auto_discover=True)
+
+def form(posts):
+    from bbcode.fields import BBCodeFormField
+    field = BBCodeFormField()
+    for post in posts:
+        field.clean(post).html
+
+def main():
+    parser = OptionParser()
+    parser.add_option('-n', '--posts', action='store', type='int', dest='posts',
+                      default=200)
+    options, args = parser.parse_args()
+    benchmarks.setup()
+    posts = [POST + unicode(i) for i in range(options.posts)]
+    after(posts[:1])
+    for name, func in (('validate+parse', before),
+                       ('parse_and_validate', after),
+                       ('form field', form)):
+        elapsed = benchmarks.timed(func, posts)
+        print '%-20s %8.2fms per post' % (name, elapsed * 1000 / len(posts))
+
+if __name__ == '__main__':
+    main()
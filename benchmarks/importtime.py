@@ -0,0 +1,64 @@
+"""
+Measures import time and the time of the first renders in a new process, with
+lazy and eager tag module loading.
+
+For each mode a new python process sets up django (which imports bbcode), runs
+autodiscover, renders a plain post and then a post using [code]. The time of
+each step and the tag modules (and Pygments) imported after it are reported. On
+interpreters which support it the process runs with 'python -X importtime', the
+per module table is written to stderr.
+
+Usage: python -m bbcode.benchmarks.importtime
+"""
+import subprocess
+import sys
+
+PLAIN = "[b]Hello[/b] world, [i]how are you?[/i]"
+CODE = "[code=python]print 'hello world'[/code]"
+
+SCRIPT = """
+import sys
+import time
+def modules():
+    names = [m for m in sys.modules if sys.modules[m] and
+             (m.startswith('bbcode.bbtags.') or m == 'pygments')]
+    return ','.join(sorted(names))
+def step(name, func):
+    start = time.time()
+    func()
+    print '%%s %%f %%s' %% (name, time.time() - start, modules())
+def do_setup():
+    global bbcode
+    import django
+    if hasattr(django, 'setup'):
+        django.setup()
+    import bbcode
+step('setup', do_setup)
+step('autodiscover', lambda: bbcode.autodiscover(lazy=%r))
+step('plain', lambda: bbcode.parse(%r))
+step('code', lambda: bbcode.parse(%r))
+"""
+
+def run(lazy):
+    """
+    Returns a list of (step, seconds, imported modules) tuples
+    """
+    args = [sys.executable]
+    if sys.version_info >= (3, 7):
+        args += ['-X', 'importtime']
+    args += ['-c', SCRIPT % (lazy, PLAIN, CODE)]
+    output = subprocess.Popen(args, stdout=subprocess.PIPE).communicate()[0]
+    steps = []
+    for line in output.splitlines():
+        bits = line.split(' ')
+        steps.append((bits[0], float(bits[1]), bits[2:] and bits[2] or ''))
+    return steps
+
+def main():
+    for lazy in (False, True):
+        print 'lazy=%s' % lazy
+        for step, elapsed, modules in run(lazy):
+            print '  %-12s %8.2fms  %s' % (step, elapsed * 1000, modules)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,141 @@
+"""
+Parses deeply nested tags (quote chains of long reply threads and mixed
+formatting tags) at growing depths with the default recursion limit.
+
+The tree is built and parsed with an explicit stack (see bbcode.parse_nodes),
+so the depth is only limited by memory, also while the tags are timed for
+listeners (see bbcode.Library.add_listener). The html, the plain text (see
+bbcode.text_nodes) and an excerpt cut within the innermost tag (see
+bbcode.truncate_tree) of each case are compared with the expected nesting and
+the validation and visual parse tree must work too, otherwise the exit status
+is 1.
+
+Usage: python -m bbcode.benchmarks.nesting [-d <depth> -d <depth> ...
+                                            -r <repeats>]
+"""
+from optparse import OptionParser
+import sys
+from bbcode import benchmarks
+
+# name, tags cycled through from the outside in
+CASES = (
+    ('quotes', ('quote',)),
+    ('formatting', ('quote', 'b', 'i', 'color=red', 'size=big', 'indent',
+                    'strike')),
+    # each [args] changes all tags within it, so it is not used on every level
+    ('args', ('args=big', 'quote', 'size=big', 'quote', 'b', 'quote', 'i',
+              'quote', 'size=big', 'quote')),
+)
+
+def get_content(tags, depth):
+    opening = []
+    closing = []
+    for level in range(depth):
+        tag = tags[level % len(tags)]
+        opening.append('[%s]' % tag)
+        closing.append('[/%s]' % tag.split('=')[0])
+    closing.reverse()
+    return u'%s|%s' % (''.join(opening), ''.join(closing))
+
+def get_expected(tags, depth, action):
+    """
+    Build the html (or text) of the nested tags from the html of each tag
+    alone.
+    """
+    parts = {}
+    for tag in tags:
+        parts[tag] = action(get_content((tag,), 1)).split('|')
+    opening = []
+    closing = []
+    for level in range(depth):
+        before, after = parts[tags[level % len(tags)]]
+        if action is excerpt and not (before or after):
+            # dropped as a whole with the tags within it, see
+            # bbcode.truncate_tree
+            break
+        opening.append(before)
+        closing.append(after)
+    closing.reverse()
+    return u'%s|%s' % (''.join(opening), ''.join(closing))
+
+def parse(content):
+    import bbcode
+    return bbcode.parse(content)[0]
+
+def profiled(content):
+    """
+    Parse with a listener of the tags attached, see bbcode.parse_nodes.
+    """
+    import bbcode
+    events = []
+    bbcode.lib.add_listener(events.append)
+    try:
+        return bbcode.parse(content)[0]
+    finally:
+        bbcode.lib.remove_listener(events.append)
+
+def validate(content):
+    import bbcode
+    return bbcode.validate(content, quick=True)
+
+def visual(content):
+    import bbcode
+    return bbcode.lib.get_visual_parse_tree(content)
+
+def text(content):
+    import bbcode
+    return bbcode.to_text(content)
+
+def excerpt(content):
+    """
+    Cut the text at its beginning, within the innermost tag.
+    """
+    import bbcode
+    return bbcode.excerpt(content, 0, ellipsis=u'|')
+
+def main():
+    parser = OptionParser()
+    parser.add_option('-d', '--depth', action='append', type='int',
+                      dest='depths')
+    parser.add_option('-r', '--repeats', action='store', type='int',
+                      dest='repeats', default=3)
+    options, args = parser.parse_args()
+    benchmarks.setup()
+    import bbcode
+    bbcode.autodiscover()
+    bbcode.lib.load_all()
+    depths = options.depths or [1000, 10000]
+    print 'recursion limit: %s' % sys.getrecursionlimit()
+    failed = []
+    for name, tags in CASES:
+        for depth in depths:
+            content = get_content(tags, depth)
+            timings = []
+            for action in (parse, profiled, validate, visual, text, excerpt):
+                try:
+                    result = action(content)
+                except RuntimeError:
+                    failed.append('%s %s %s: maximum recursion depth exceeded'
+                                  % (name, depth, action.__name__))
+                    timings.append('%s %9s' % (action.__name__, 'failed'))
+                    continue
+                # profiled renders the html of parse
+                expected = action is profiled and parse or action
+                if (action in (parse, profiled, text, excerpt)
+                    and result != get_expected(tags, depth, expected)):
+                    failed.append('%s %s: unexpected %s' % (name, depth,
+                                                            action.__name__))
+                elif action is validate and result:
+                    failed.append('%s %s: %s errors' % (name, depth,
+                                                        len(result)))
+                elapsed = benchmarks.median([benchmarks.timed(action, content)
+                                             for i in range(options.repeats)])
+                timings.append('%s %9.2fms' % (action.__name__,
+                                               elapsed * 1000))
+            print '%-12s %6d  %s' % (name, depth, '  '.join(timings))
+    if failed:
+        print '\n'.join(failed)
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,216 @@
+"""
+Compares rendering the posts of a thread page with the cache one post at a
+time (bbcode.cache.parse) with prefetching them (bbcode.cache.parse_many), with
+an empty and with a filled cache, using django's local memory and file based
+cache backends.
+
+For each backend the prefetched posts must have the html and the errors of
+bbcode.parse, from an empty and from a filled cache, and a template using
+{% bbcode_prefetch %} must render the same as without it, otherwise the exit
+status is 1. The round trips to the cache are counted too. The backends are
+added to the CACHES setting, BBCODE_CACHE is changed for each of them.
+
+Cache keys must not change when lazy tag modules are imported: a template
+caching the posts is rendered and the posts are prefetched before they are
+imported and once more after importing them, the second time must not miss the
+cache.
+
+Usage: python -m bbcode.benchmarks.prefetch [-n <posts> -s <seed> -j <threads>
+                                             -r <repeats>]
+"""
+from optparse import OptionParser
+import shutil
+import sys
+import tempfile
+from bbcode import benchmarks
+from bbcode.benchmarks import corpus
+
+TEMPLATE = """{% load bbcode %}{% bbcode_prefetch posts "body" %}
+{% for post in posts %}{% bbcode post.body cache 3600 %}{% endfor %}"""
+
+PLAIN_TEMPLATE = """{% load bbcode %}
+{% for post in posts %}{% bbcode post.body %}{% endfor %}"""
+
+CACHED_TEMPLATE = """{% load bbcode %}
+{% for post in posts %}{% bbcode post.body cache 3600 %}{% endfor %}"""
+
+class RoundTrips(object):
+    """
+    Counts the calls to the cache made by bbcode.cache, calls made by the
+    backend itself (eg. get_many calling get) are not counted.
+    """
+    def __init__(self, cache):
+        self.count = 0
+        self.active = False
+        for name in ('get', 'set', 'get_many', 'set_many'):
+            setattr(cache, name, self.wrap(getattr(cache, name)))
+
+    def wrap(self, method):
+        def counted(*args, **kwargs):
+            if self.active:
+                return method(*args, **kwargs)
+            self.count += 1
+            self.active = True
+            try:
+                return method(*args, **kwargs)
+            finally:
+                self.active = False
+        return counted
+
+class Misses(object):
+    """
+    Counts the 'cache miss' events of the library.
+    """
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, event):
+        if event.phase == 'cache miss':
+            self.count += 1
+
+def check_lazy(posts):
+    """
+    Render a template caching posts and prefetch them before and after
+    importing all lazy tag modules, returns the number of cache misses of the
+    second time.
+    """
+    import bbcode
+    from bbcode import cache
+    from django import template
+    items = [{'body': post} for post in posts]
+    template.Template(CACHED_TEMPLATE).render(template.Context({'posts': items}))
+    cache.parse_many(posts)
+    bbcode.lib.load_all()
+    misses = Misses()
+    bbcode.lib.add_listener(misses, False)
+    try:
+        template.Template(CACHED_TEMPLATE).render(
+            template.Context({'posts': items}))
+        cache.parse_many(posts)
+    finally:
+        bbcode.lib.remove_listener(misses)
+    return misses.count
+
+def one_by_one(posts, pool):
+    from bbcode import cache
+    for post in posts:
+        cache.parse(post)
+
+def prefetched(posts, pool):
+    from bbcode import cache
+    cache.parse_many(posts, pool=pool)
+
+# name, benchmark, filled cache
+BENCHMARKS = (
+    ('one by one', one_by_one, False),
+    ('prefetch', prefetched, False),
+    ('one by one', one_by_one, True),
+    ('prefetch', prefetched, True),
+)
+
+def check(posts, pool):
+    """
+    Returns the number of posts prefetched with other results than
+    bbcode.parse and the number of templates rendered differently.
+    """
+    import bbcode
+    from bbcode import cache
+    from django import template
+    expected = []
+    for post in posts:
+        html, errors = bbcode.parse(post, strict=False)
+        expected.append((html, [(error.lineno, error.message) for error in errors]))
+    failed = 0
+    cache.get_cache().clear()
+    for i in range(2):
+        for result, (html, errors) in zip(cache.parse_many(posts, pool=pool),
+                                          expected):
+            if (result[0] != html or
+                [(error.lineno, error.message) for error in result[1]] != errors):
+                failed += 1
+    items = [{'body': post} for post in posts]
+    plain = template.Template(PLAIN_TEMPLATE).render(
+        template.Context({'posts': items}))
+    templates = 0
+    cache.get_cache().clear()
+    for i in range(2):
+        html = template.Template(TEMPLATE).render(
+            template.Context({'posts': items}))
+        if html != plain:
+            templates += 1
+    return failed, templates
+
+def run(posts, pool, repeats):
+    """
+    Print the time and the round trips of each benchmark with the current
+    cache.
+    """
+    from bbcode import cache
+    backend = cache.get_cache()
+    trips = RoundTrips(backend)
+    for name, benchmark, filled in BENCHMARKS:
+        timings = []
+        for i in range(repeats):
+            backend.clear()
+            if filled:
+                cache.parse_many(posts)
+            trips.count = 0
+            timings.append(benchmarks.timed(benchmark, posts, pool))
+        print '  %-12s %-7s %9.2fms %5d round trips' % (
+            name, filled and 'filled' or 'empty',
+            benchmarks.median(timings) * 1000, trips.count)
+
+def main():
+    parser = OptionParser()
+    parser.add_option('-n', '--posts', action='store', type='int', dest='posts',
+                      default=50)
+    parser.add_option('-s', '--seed', action='store', type='int', dest='seed',
+                      default=0)
+    parser.add_option('-j', '--threads', action='store', type='int',
+                      dest='threads', default=0,
+                      help='render the misses in a thread pool')
+    parser.add_option('-r', '--repeats', action='store', type='int',
+                      dest='repeats', default=5)
+    options, args = parser.parse_args()
+    benchmarks.setup()
+    import bbcode
+    from django.conf import settings
+    bbcode.autodiscover()
+    posts = corpus.generate(options.posts, options.seed)
+    failed = []
+    misses = check_lazy(posts)
+    if misses:
+        failed.append('%s cache misses after importing the lazy tag modules'
+                      % misses)
+    pool = None
+    if options.threads:
+        from multiprocessing.pool import ThreadPool
+        pool = ThreadPool(options.threads)
+    directory = tempfile.mkdtemp()
+    backends = (
+        ('locmem', {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                    'LOCATION': 'bbcode-benchmark'}),
+        ('file', {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+                  'LOCATION': directory}),
+    )
+    try:
+        for name, config in backends:
+            alias = 'bbcode-benchmark-%s' % name
+            settings.CACHES[alias] = config
+            settings.BBCODE_CACHE = alias
+            posts_failed, templates_failed = check(posts, pool)
+            if posts_failed:
+                failed.append('%s: %s posts differ from bbcode.parse'
+                              % (name, posts_failed))
+            if templates_failed:
+                failed.append('%s: the prefetching template differs' % name)
+            print '%s: %s posts' % (name, len(posts))
+            run(posts, pool, options.repeats)
+    finally:
+        shutil.rmtree(directory)
+    if failed:
+        print '\n'.join(failed)
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
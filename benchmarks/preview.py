@@ -0,0 +1,40 @@
+"""
+Measures the latency of a live preview typing into a large post, re-parsing
+the whole post on each keystroke compared to bbcode.Document.edit. The edited
+document is checked to render the same as bbcode.parse.
+
+Usage: python -m bbcode.benchmarks.preview [-s <size in KB>] [-n <edits>]
+"""
+import random
+from optparse import OptionParser
+from bbcode import benchmarks
+from bbcode.benchmarks.forms import POST
+
+def main():
+    parser = OptionParser()
+    parser.add_option('-s', '--size', action='store', type='int', dest='size',
+                      default=50)
+    parser.add_option('-n', '--edits', action='store', type='int',
+                      dest='edits', default=50)
+    options, args = parser.parse_args()
+    benchmarks.setup()
+    import bbcode
+    content = POST * (options.size * 1024 // len(POST) + 1)
+    document = bbcode.Document(content, auto_discover=True)
+    rnd = random.Random(0)
+    parse_times = []
+    edit_times = []
+    for i in range(options.edits):
+        # type at the end of a random line
+        position = document.content.index('\n', rnd.randint(0, len(document.content) - len(POST)))
+        text = rnd.choice(['x', ' [b]y[/b]', ' www.example.com'])
+        content = document.content[:position] + text + document.content[position:]
+        parse_times.append(benchmarks.timed(bbcode.parse, content))
+        edit_times.append(benchmarks.timed(document.edit, position, position, text))
+        assert document.html == bbcode.parse(content)[0]
+    print 'document size: %sKB' % (len(content) // 1024)
+    print '%-10s %8.2fms per keystroke' % ('parse', benchmarks.median(parse_times) * 1000)
+    print '%-10s %8.2fms per keystroke' % ('edit', benchmarks.median(edit_times) * 1000)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+"""
+Compares rendering stored parse trees (bbcode.serialization) with parsing the
+source again, and the size of the stored trees with the size of the source.
+
+All posts of the corpus are round-tripped first: rendering a stored tree must
+return the html of parsing its source and loading and storing it again must
+give the same data, otherwise the exit status is 1.
+
+Usage: python -m bbcode.benchmarks.serialization [-n <posts> -s <seed>
+                                                  -r <repeats>]
+"""
+from optparse import OptionParser
+import sys
+import zlib
+from bbcode import benchmarks
+from bbcode.benchmarks import corpus
+
+def parse(posts, trees, parser):
+    for post in posts:
+        parser.parse(post, False)
+
+def render_json(posts, trees, parser):
+    from bbcode import serialization
+    for data, packed in trees:
+        serialization.render_ast(data)
+
+def render_packed(posts, trees, parser):
+    from bbcode import serialization
+    for data, packed in trees:
+        serialization.render_ast(packed)
+
+# name, benchmark
+BENCHMARKS = (
+    ('parse', parse),
+    ('render json', render_json),
+    ('render packed', render_packed),
+)
+
+def round_trip(posts, parser):
+    """
+    Returns a list of (json, packed) trees of the posts and the number of
+    posts failing the round trip.
+    """
+    import bbcode
+    from bbcode import serialization
+    trees = []
+    failed = 0
+    for post in posts:
+        html, errors = parser.parse(post, False)
+        head = parser.get_parse_tree(post, parse_context=bbcode.ParseContext())
+        data = serialization.dumps(head)
+        packed = serialization.pack(head)
+        trees.append((data, packed))
+        if (serialization.render_ast(data)[0] != html
+            or serialization.render_ast(packed)[0] != html
+            or serialization.pack(serialization.load(data)) != packed
+            or serialization.dumps(serialization.load(packed)) != data):
+            failed += 1
+    return trees, failed
+
+def main():
+    parser = OptionParser()
+    parser.add_option('-n', '--posts', action='store', type='int', dest='posts',
+                      default=100)
+    parser.add_option('-s', '--seed', action='store', type='int', dest='seed',
+                      default=0)
+    parser.add_option('-r', '--repeats', action='store', type='int',
+                      dest='repeats', default=5)
+    options, args = parser.parse_args()
+    benchmarks.setup()
+    import bbcode
+    bbcode.autodiscover()
+    bbcode.lib.load_all()
+    bbparser = bbcode.Parser()
+    # posts which cannot be parsed are not stored
+    posts = [post for post in corpus.generate(options.posts, options.seed)
+             if bbparser.render(post, False)[2] is not None]
+    trees, failed = round_trip(posts, bbparser)
+    source = sum([len(post.encode('utf-8')) for post in posts])
+    sizes = (('source', source),
+             ('json', sum([len(data.encode('utf-8')) for data, packed in trees])),
+             ('packed', sum([len(packed) for data, packed in trees])),
+             ('packed zlib', sum([len(zlib.compress(packed)) for data, packed in trees])))
+    print 'corpus: %s posts' % len(posts)
+    for name, size in sizes:
+        print '%-16s %9.1fKB %6.2fx source' % (name, size / 1024.0,
+                                              float(size) / source)
+    baseline = None
+    for name, benchmark in BENCHMARKS:
+        elapsed = benchmarks.median([benchmarks.timed(benchmark, posts, trees,
+                                                      bbparser)
+                                     for i in range(options.repeats)])
+        if baseline is None:
+            baseline = elapsed
+        print '%-16s %9.2fms %6.2fx parse' % (name, elapsed * 1000,
+                                              elapsed / baseline)
+    if failed:
+        print 'Round trip failed for %s posts' % failed
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
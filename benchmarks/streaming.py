@@ -0,0 +1,144 @@
+"""
+Compares the peak memory of rendering a file chunk by chunk from a memory map
+(Parser.render_chunks, 'cli.py --mmap') with reading and parsing it at once.
+
+Files of growing size are generated from the forum post corpus. Each run is
+done in a forked process which samples its anonymous memory (RssAnon, the mapped
+file pages are not counted as they can be dropped), so this needs linux. The
+streaming peak should stay about the same for all sizes.
+
+Usage: python -m bbcode.benchmarks.streaming [-s <smallest size in KB>
+                                              -c <chunk size> --no-parse]
+"""
+from optparse import OptionParser
+import mmap
+import os
+import sys
+import tempfile
+import threading
+import time
+from bbcode import benchmarks
+from bbcode.benchmarks import corpus
+
+WARM_UP = u'\n\n'.join(corpus.generate(50, 1))
+
+def get_anonymous_memory():
+    """
+    Returns the anonymous resident memory of this process in bytes.
+    """
+    for line in open('/proc/self/status'):
+        if line.startswith('RssAnon:'):
+            return int(line.split()[1]) * 1024
+    raise RuntimeError('RssAnon is not available')
+
+class Sampler(threading.Thread):
+    """
+    Samples the anonymous memory until stopped and keeps the peak.
+    """
+    def __init__(self, interval=0.005):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.interval = interval
+        self.peak = get_anonymous_memory()
+        self.running = True
+
+    def run(self):
+        while self.running:
+            self.peak = max(self.peak, get_anonymous_memory())
+            time.sleep(self.interval)
+
+    def stop(self):
+        self.running = False
+        self.join()
+        self.peak = max(self.peak, get_anonymous_memory())
+
+def stream(filename, output, parser, chunk_size):
+    infile = open(filename, 'rb')
+    buffer = mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ)
+    for html, errors in parser.render_chunks(buffer, chunk_size):
+        output.write(html.encode('utf-8'))
+    buffer.close()
+    infile.close()
+
+def parse(filename, output, parser, chunk_size):
+    content = open(filename, 'rb').read().decode('utf-8')
+    html, errors = parser.parse(content, False)
+    output.write(html.encode('utf-8'))
+
+def measure(func, filename, parser, chunk_size):
+    """
+    Run func in a forked process, returns the time and the peak memory above
+    the memory at the start.
+    """
+    read, write = os.pipe()
+    pid = os.fork()
+    if not pid:
+        os.close(read)
+        output = open(os.devnull, 'wb')
+        # render once so that copying the pages shared with the parent on
+        # write is not counted
+        for chunk in parser.render_chunks(WARM_UP, chunk_size):
+            pass
+        sampler = Sampler()
+        baseline = sampler.peak
+        sampler.start()
+        elapsed = benchmarks.timed(func, filename, output, parser, chunk_size)
+        sampler.stop()
+        os.write(write, '%r %d' % (elapsed, sampler.peak - baseline))
+        os._exit(0)
+    os.close(write)
+    result = os.read(read, 1024)
+    os.close(read)
+    os.waitpid(pid, 0)
+    elapsed, peak = result.split()
+    return float(elapsed), int(peak)
+
+def write_file(size):
+    """
+    Write a file of at least size bytes of posts separated by blank lines.
+    """
+    handle, filename = tempfile.mkstemp(suffix='.bbcode')
+    output = os.fdopen(handle, 'wb')
+    written = seed = 0
+    while written < size:
+        posts = u'\n\n'.join(corpus.generate(100, seed)).encode('utf-8') + '\n\n'
+        output.write(posts)
+        written += len(posts)
+        seed += 1
+    output.close()
+    return filename
+
+def main():
+    parser = OptionParser()
+    parser.add_option('-s', '--size', action='store', type='int', dest='size',
+                      default=512, help='smallest file size in KB')
+    parser.add_option('-c', '--chunk-size', action='store', type='int',
+                      dest='chunk_size', default=65536)
+    parser.add_option('--no-parse', action='store_false', dest='parse',
+                      default=True, help='only measure streaming')
+    options, args = parser.parse_args()
+    benchmarks.setup()
+    import bbcode
+    bbcode.autodiscover()
+    bbcode.lib.load_all()
+    bbparser = bbcode.Parser()
+    # warm up (pygments, compiled patterns) before forking
+    bbparser.parse(u'\n\n'.join(corpus.generate(10)), False)
+    for size in [options.size * 1024 * 4 ** i for i in range(3)]:
+        filename = write_file(size)
+        try:
+            actual = os.path.getsize(filename) / 1024.0
+            runs = [('stream', stream)]
+            if options.parse:
+                runs.append(('parse', parse))
+            for name, func in runs:
+                elapsed, peak = measure(func, filename, bbparser,
+                                        options.chunk_size)
+                print '%8.0fKB %-8s %8.2fs %9.1fKB peak' % (actual, name,
+                                                          elapsed, peak / 1024.0)
+                sys.stdout.flush()
+        finally:
+            os.remove(filename)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+"""
+Renders a reply-heavy thread, where most posts quote an earlier post with its
+quotes (see corpus.thread), without a subtree cache and with a bbcode.
+SubtreeCache, empty and filled by rendering the thread before. Reports the
+time and the hit rate of the cache.
+
+The posts of the thread and of the forum post corpus (with tables, [args] and
+variables) must render to the same html and errors with the cache as without
+it, otherwise the exit status is 1.
+
+Usage: python -m bbcode.benchmarks.subtrees [-n <posts> -s <seed> -d <depth>
+                                             -c <cache size> -r <repeats>]
+"""
+from optparse import OptionParser
+import sys
+from bbcode import benchmarks
+from bbcode.benchmarks import corpus
+
+def render(posts):
+    import bbcode
+    results = []
+    for post in posts:
+        html, errors = bbcode.parse(post, strict=False)
+        results.append((html, [(error.lineno, error.message) for error in errors]))
+    return results
+
+# name, cache, filled cache
+RUNS = (
+    ('no cache', False, False),
+    ('empty cache', True, False),
+    ('filled cache', True, True),
+)
+
+def main():
+    parser = OptionParser()
+    parser.add_option('-n', '--posts', action='store', type='int', dest='posts',
+                      default=100)
+    parser.add_option('-s', '--seed', action='store', type='int', dest='seed',
+                      default=0)
+    parser.add_option('-d', '--depth', action='store', type='int', dest='depth',
+                      default=3, help='quote depth')
+    parser.add_option('-c', '--cache-size', action='store', type='int',
+                      dest='size', default=1000)
+    parser.add_option('-r', '--repeats', action='store', type='int',
+                      dest='repeats', default=5)
+    options, args = parser.parse_args()
+    benchmarks.setup()
+    import bbcode
+    bbcode.autodiscover()
+    bbcode.lib.load_all()
+    thread = corpus.thread(options.posts, options.seed, options.depth)
+    posts = corpus.generate(options.posts, options.seed)
+    cache = bbcode.SubtreeCache(options.size)
+    failed = []
+    for name, contents in (('thread', thread), ('corpus', posts)):
+        bbcode.lib.subtree_cache = None
+        expected = render(contents)
+        bbcode.lib.subtree_cache = cache
+        cache.clear()
+        for run in ('empty', 'filled'):
+            if render(contents) != expected:
+                failed.append('%s with an %s cache' % (name, run))
+    size = sum([len(post.encode('utf-8')) for post in thread]) / 1024.0
+    print 'thread: %s posts, %.1fKB' % (len(thread), size)
+    for name, enabled, filled in RUNS:
+        timings = []
+        for i in range(options.repeats):
+            bbcode.lib.subtree_cache = enabled and cache or None
+            cache.clear()
+            if filled:
+                render(thread)
+                cache.hits = cache.misses = 0
+            timings.append(benchmarks.timed(render, thread))
+        hit_rate = enabled and '%5.1f%% hits' % (cache.get_hit_rate() * 100) or ''
+        print '%-14s %9.2fms  %s' % (name, benchmarks.median(timings) * 1000,
+                                     hit_rate)
+    bbcode.lib.subtree_cache = None
+    if failed:
+        print 'Different html or errors: %s' % ', '.join(failed)
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,207 @@
+"""
+Benchmarks each parsing phase (tokenize, tree build, render, linefeeds) and the
+whole pipeline (parse, validate, the bbcode template tag) on a generated corpus
+of forum posts, see bbcode.benchmarks.corpus.
+
+Reports the median time, the throughput and, if tracemalloc is available
+(python 3.4+), the peak memory of each benchmark. The timings can be saved as a
+baseline and later runs compared against it, failing (exit status 1) if a
+benchmark got slower by more than the threshold.
+
+Runs are compared with the baseline.json next to this module unless another
+baseline is given (or --no-baseline). It holds the timings of the default
+corpus (100 posts, seed 0) on the machine running the gate, refresh it there
+with --save after a change meant to alter the timings.
+
+Usage: python -m bbcode.benchmarks.suite [-n <posts> -s <seed> -r <repeats>
+                                          --save <file> --baseline <file>
+                                          --no-baseline --threshold <fraction>]
+"""
+from optparse import OptionParser
+import gc
+import json
+import os
+import sys
+from bbcode import benchmarks
+from bbcode.benchmarks import corpus
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        'baseline.json')
+
+def tokenize_setup(posts, parser):
+    return posts
+
+def tokenize(posts, parser):
+    for post in posts:
+        parser.library.get_taglist(post, tokenizers=parser.tokenizers)
+
+def tree_setup(posts, parser):
+    return [(post, parser.library.get_taglist(post, tokenizers=parser.tokenizers))
+            for post in posts]
+
+def tree(taglists, parser):
+    import bbcode
+    for post, taglist in taglists:
+        parser.library.build_tree(post, taglist,
+                                  parse_context=bbcode.ParseContext())
+
+def render_setup(posts, parser):
+    import bbcode
+    return [parser.get_parse_tree(post, parse_context=bbcode.ParseContext())
+            for post in posts]
+
+def render(heads, parser):
+    for head in heads:
+        head.parse()
+
+def linefeeds_setup(posts, parser):
+    return [head.parse() for head in render_setup(posts, parser)]
+
+def linefeeds(outputs, parser):
+    import bbcode
+    for output in outputs:
+        bbcode.convert_linefeeds(output)
+
+def parse(posts, parser):
+    import bbcode
+    for post in posts:
+        bbcode.parse(post, strict=False)
+
+def validate(posts, parser):
+    import bbcode
+    for post in posts:
+        bbcode.validate(post)
+
+def validate_quick(posts, parser):
+    import bbcode
+    for post in posts:
+        bbcode.validate(post, quick=True)
+
+def template(posts, parser):
+    from django.template import Template, Context
+    node = Template('{% load bbcode %}{% bbcode post %}')
+    for post in posts:
+        node.render(Context({'post': post}))
+
+def template_cached(posts, parser):
+    from django.template import Template, Context
+    node = Template('{% load bbcode %}{% bbcode post cache 3600 %}')
+    for post in posts:
+        node.render(Context({'post': post}))
+
+# name, setup, benchmark
+BENCHMARKS = (
+    ('tokenize', tokenize_setup, tokenize),
+    ('tree', tree_setup, tree),
+    ('render', render_setup, render),
+    ('linefeeds', linefeeds_setup, linefeeds),
+    ('parse', tokenize_setup, parse),
+    ('validate', tokenize_setup, validate),
+    ('validate quick', tokenize_setup, validate_quick),
+    ('template tag', tokenize_setup, template),
+    ('template cached', tokenize_setup, template_cached),
+)
+
+def measure(setup, benchmark, posts, parser, repeats):
+    """
+    Returns the median time and the peak memory (None without tracemalloc).
+    The garbage of the previous run is collected before each run and the
+    collector is disabled while timing, so collections triggered by the
+    allocations of earlier benchmarks do not add noise.
+    """
+    timings = []
+    for i in range(repeats):
+        data = setup(posts, parser)
+        gc.collect()
+        gc.disable()
+        try:
+            timings.append(benchmarks.timed(benchmark, data, parser))
+        finally:
+            gc.enable()
+    peak = None
+    if tracemalloc is not None:
+        data = setup(posts, parser)
+        tracemalloc.start()
+        benchmark(data, parser)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return benchmarks.median(timings), peak
+
+def run(posts, repeats):
+    """
+    Returns a list of (name, median time, peak memory) of all benchmarks.
+    """
+    import bbcode
+    bbcode.autodiscover()
+    bbcode.lib.load_all()
+    parser = bbcode.Parser()
+    # warm up (pygments, compiled patterns)
+    parse(posts, parser)
+    results = []
+    for name, setup, benchmark in BENCHMARKS:
+        elapsed, peak = measure(setup, benchmark, posts, parser, repeats)
+        results.append((name, elapsed, peak))
+    return results
+
+def compare(results, baseline, threshold):
+    """
+    Returns the names of benchmarks slower than their baseline by more than
+    threshold (a fraction).
+    """
+    regressions = []
+    for name, elapsed, peak in results:
+        if name in baseline and elapsed > baseline[name] * (1 + threshold):
+            regressions.append(name)
+    return regressions
+
+def main():
+    parser = OptionParser()
+    parser.add_option('-n', '--posts', action='store', type='int', dest='posts',
+                      default=100)
+    parser.add_option('-s', '--seed', action='store', type='int', dest='seed',
+                      default=0)
+    parser.add_option('-r', '--repeats', action='store', type='int',
+                      dest='repeats', default=5)
+    parser.add_option('--save', action='store', dest='save',
+                      help='save the timings as baseline to this file')
+    parser.add_option('--baseline', action='store', dest='baseline',
+                      default=BASELINE,
+                      help='compare the timings with this baseline file')
+    parser.add_option('--no-baseline', action='store_const', const=None,
+                      dest='baseline', help='do not compare the timings')
+    parser.add_option('--threshold', action='store', type='float',
+                      dest='threshold', default=0.2)
+    options, args = parser.parse_args()
+    benchmarks.setup()
+    posts = corpus.generate(options.posts, options.seed)
+    size = sum([len(post.encode('utf-8')) for post in posts]) / 1024.0
+    results = run(posts, options.repeats)
+    baseline = {}
+    if options.baseline:
+        baseline = json.load(open(options.baseline))
+    print 'corpus: %s posts, %.1fKB' % (len(posts), size)
+    for name, elapsed, peak in results:
+        line = '%-16s %9.2fms %9.1fKB/s' % (name, elapsed * 1000, size / elapsed)
+        if peak is not None:
+            line += ' %9.1fKB peak' % (peak / 1024.0)
+        if name in baseline:
+            line += ' %+7.1f%%' % ((elapsed / baseline[name] - 1) * 100)
+        print line
+    if options.save:
+        output = open(options.save, 'w')
+        json.dump(dict([(name, elapsed) for name, elapsed, peak in results]),
+                  output, indent=4, sort_keys=True)
+        output.close()
+    regressions = compare(results, baseline, options.threshold)
+    if regressions:
+        print 'Regressions (more than %d%% slower): %s' % (options.threshold * 100,
+                                                         ', '.join(regressions))
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
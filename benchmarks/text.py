@@ -0,0 +1,58 @@
+"""
+Compares bbcode.to_text with rendering the html and stripping the tags, the
+way plain text for search indexes or e-mails used to be made.
+
+Usage: python -m bbcode.benchmarks.text [-n <posts> -s <seed> -r <repeats>]
+"""
+from optparse import OptionParser
+import re
+from HTMLParser import HTMLParser
+from bbcode import benchmarks
+from bbcode.benchmarks import corpus
+
+TAG_PATTERN = re.compile(r'<[^>]*>')
+
+def strip(html):
+    return HTMLParser().unescape(TAG_PATTERN.sub('', html))
+
+def parse_and_strip(posts):
+    import bbcode
+    for post in posts:
+        strip(bbcode.parse(post, strict=False)[0])
+
+def to_text(posts):
+    import bbcode
+    for post in posts:
+        bbcode.to_text(post)
+
+def main():
+    parser = OptionParser()
+    parser.add_option('-n', '--posts', action='store', type='int', dest='posts',
+                      default=100)
+    parser.add_option('-s', '--seed', action='store', type='int', dest='seed',
+                      default=0)
+    parser.add_option('-r', '--repeats', action='store', type='int',
+                      dest='repeats', default=5)
+    options, args = parser.parse_args()
+    benchmarks.setup()
+    import bbcode
+    bbcode.autodiscover()
+    bbcode.lib.load_all()
+    posts = corpus.generate(options.posts, options.seed)
+    # warm up (pygments, compiled patterns)
+    parse_and_strip(posts)
+    size = sum([len(post.encode('utf-8')) for post in posts]) / 1024.0
+    print 'corpus: %s posts, %.1fKB' % (len(posts), size)
+    baseline = None
+    for name, benchmark in (('parse and strip', parse_and_strip),
+                            ('to_text', to_text)):
+        elapsed = benchmarks.median([benchmarks.timed(benchmark, posts)
+                                     for i in range(options.repeats)])
+        if baseline is None:
+            baseline = elapsed
+        print '%-16s %9.2fms %9.1fKB/s %6.2fx' % (name, elapsed * 1000,
+                                                  size / elapsed,
+                                                  baseline / elapsed)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,180 @@
+"""
+Caching of rendered content in the django cache.
+
+The cache key is a hash of the content, the namespaces and the fingerprint of
+the registered tags, so changing the tags invalidates all entries. Settings:
+
+    BBCODE_CACHE: name of the cache to use. Default: 'default'
+    BBCODE_CACHE_TIMEOUT: timeout of entries in seconds. Default: the timeout
+        of the cache
+
+A page showing many posts should not ask the cache for each of them:
+parse_many (or the {% bbcode_prefetch %} template tag) gets all entries in one
+get_many, renders the misses and stores them in one set_many.
+"""
+import hashlib
+import time
+bbmodule = __import__('bbcode',level=0)
+
+def get_cache():
+    """
+    Return the cache configured with BBCODE_CACHE.
+    """
+    name = bbmodule.get_setting('BBCODE_CACHE', 'default')
+    try:
+        from django.core.cache import caches
+    except ImportError: # django < 1.7
+        from django.core.cache import get_cache
+        return get_cache(name)
+    return caches[name]
+
+def get_key(content, namespaces=None):
+    """
+    Return the cache key of a content. The key does not depend on the lazy tag
+    modules imported so far (see Library.get_fingerprint), so the tag modules
+    for content are only needed to render it.
+    """
+    if namespaces is None:
+        namespaces = bbmodule.get_default_namespaces()
+    digest = hashlib.md5(bbmodule.lib.get_fingerprint())
+    # the namespaces are a set, their order does not matter
+    digest.update(','.join(sorted(namespaces)).encode('utf-8'))
+    digest.update('\0')
+    digest.update(content.replace('\r', '').encode('utf-8'))
+    return 'bbcode:%s' % digest.hexdigest()
+
+def parse(content, namespaces=None, auto_discover=False, budget=None,
+          timeout=None):
+    """
+    Parse a content like bbcode.parse(content, namespaces, strict=False) but
+    use the cache. Raises BudgetExceeded if rendering takes longer than budget
+    seconds, see Parser.render. New entries are kept for timeout seconds
+    (default: BBCODE_CACHE_TIMEOUT).
+    """
+    if auto_discover:
+        bbmodule.autodiscover()
+    started = time.time()
+    key = get_key(content, namespaces)
+    cache = get_cache()
+    cached = cache.get(key)
+    if cached is not None:
+        html, errors = cached
+        notify('cache hit', started, content, html, namespaces, len(errors))
+        return html, [bbmodule.SoftException(*error) for error in errors]
+    notify('cache miss', started, content, None, namespaces, 0)
+    bbmodule.lib.load_for(content)
+    parser = bbmodule.Parser(namespaces)
+    html, errors, head = parser.render(content, False, budget=budget)
+    value = (html, [(error.lineno, error.message) for error in errors])
+    if timeout is None:
+        timeout = bbmodule.get_setting('BBCODE_CACHE_TIMEOUT', None)
+    if timeout is None:
+        cache.set(key, value)
+    else:
+        cache.set(key, value, timeout)
+    return html, errors
+
+def get_many(keys):
+    """
+    Get the cached entries of several keys in one round trip. Returns a
+    dictionary of key: (html, errors) of the keys found.
+    """
+    found = {}
+    for key, (html, errors) in get_cache().get_many(keys).items():
+        found[key] = (html, [bbmodule.SoftException(*error) for error in errors])
+    return found
+
+def set_many(values, timeout=None):
+    """
+    Store several entries (a dictionary of key: (html, errors)) in one round
+    trip. New entries are kept for timeout seconds (default:
+    BBCODE_CACHE_TIMEOUT).
+    """
+    data = {}
+    for key, (html, errors) in values.items():
+        data[key] = (html, [(error.lineno, error.message) for error in errors])
+    if timeout is None:
+        timeout = bbmodule.get_setting('BBCODE_CACHE_TIMEOUT', None)
+    if timeout is None:
+        get_cache().set_many(data)
+    else:
+        get_cache().set_many(data, timeout)
+
+def render(item):
+    """
+    Render a (content, namespaces, budget) tuple for prefetch. Returns the
+    html and the errors as (lineno, message) tuples, so it can be mapped by a
+    process pool.
+    """
+    content, namespaces, budget = item
+    bbmodule.lib.load_for(content)
+    parser = bbmodule.Parser(namespaces)
+    html, errors, head = parser.render(content, False, budget=budget)
+    return html, [(error.lineno, error.message) for error in errors]
+
+def prefetch(contents, namespaces=None, auto_discover=False, budget=None,
+             timeout=None, pool=None):
+    """
+    Parse several contents with the same namespaces using the cache. All keys
+    are computed first and looked up with one get_many, only the misses are
+    rendered (and import the lazy tag modules they need) and they are stored
+    with one set_many. The misses are rendered
+    with pool.map if a pool is given (eg. a multiprocessing.Pool or a
+    multiprocessing.pool.ThreadPool). Raises BudgetExceeded if rendering a
+    content takes longer than budget seconds.
+
+    Returns a dictionary of the key of each content (see get_key): (html,
+    errors).
+    """
+    if auto_discover:
+        bbmodule.autodiscover()
+    started = time.time()
+    keys = {}
+    for content in contents:
+        keys.setdefault(get_key(content, namespaces), content)
+    results = get_many(keys.keys())
+    for key, (html, errors) in results.items():
+        notify('cache hit', started, keys[key], html, namespaces, len(errors))
+    missing = [key for key in keys if key not in results]
+    if not missing:
+        return results
+    for key in missing:
+        notify('cache miss', started, keys[key], None, namespaces, 0)
+        # import the tag modules here rather than in the threads of a pool
+        bbmodule.lib.load_for(keys[key])
+    items = [(keys[key], namespaces, budget) for key in missing]
+    if pool is None:
+        rendered = map(render, items)
+    else:
+        rendered = pool.map(render, items)
+    values = {}
+    for key, (html, errors) in zip(missing, rendered):
+        values[key] = (html, [bbmodule.SoftException(*error) for error in errors])
+    set_many(values, timeout)
+    results.update(values)
+    return results
+
+def parse_many(contents, namespaces=None, auto_discover=False, budget=None,
+               timeout=None, pool=None):
+    """
+    Parse several contents like parse, see prefetch. Returns a list of (html,
+    errors) in the order of contents.
+    """
+    results = prefetch(contents, namespaces, auto_discover, budget, timeout,
+                       pool)
+    return [results[get_key(content, namespaces)] for content in contents]
+
+def notify(phase, started, content, html, namespaces, errors):
+    """
+    Send a 'cache hit' or 'cache miss' Event to the listeners of the library.
+    """
+    library = bbmodule.lib
+    if library.listeners:
+        if namespaces is None:
+            namespaces = bbmodule.get_default_namespaces()
+        elapsed = time.time() - started
+        library.notify(bbmodule.Event(phase, None, len(content),
+                                      html is not None and len(html) or None,
+                                      elapsed, elapsed,
+                                      namespaces=tuple(namespaces),
+                                      errors=errors))
@@ -2,6 +2,7 @@
 CLI app (for debugging really) for django-bbcode.
 
 Usage: python cli.py -i <input> [-o <output> -v -n <namespaces]
+       python cli.py -b [<file, directory or glob> ...] [-j <jobs> -s -n <namespaces>]
 
     -i, --input-file    source to parse
     -o, --output-file   output file (defaults to stdout)
@@ -9,13 +10,42 @@ Usage: python cli.py -i <input> [-o <output> -v -n <namespaces]
     -n, --namespaces    list of namespaces to use (defaults to all)
     -s, --strict        on error only display errors.
     -f, --full          full. Include get_visual, errors, source and result.
+    -p, --profile       render once and display the parse tree with the time
+                        spent in each node and the phase totals.
+    --pstats            with --profile, also profile rendering with cProfile
+                        and dump the stats to this file ('-' to display them).
+    -m, --mmap          memory-map the input file and write the output chunk by
+                        chunk, errors go to stderr. For huge files.
+    --chunk-size        size of the chunks in --mmap mode (default 65536).
+    -b, --batch         batch mode, see below.
+    -j, --jobs          number of worker processes in batch mode (default 1).
+    --slowest           number of slowest documents in the summary (default 10).
+
+In batch mode each file given (directories are searched recursively, globs are
+expanded) or, without arguments, each line of JSONL ({"id": ..., "content": ...})
+on stdin is rendered. A line of JSONL with the id, the html (unless -s is
+given, which only validates) and the errors is written to the output for each
+document, in input order. A document which cannot be read or rendered gets an
+'error' instead and the batch goes on. A summary with the throughput, the
+errors and the slowest documents is written to stderr.
 """
 from optparse import OptionParser, Option
 from copy import copy
 import StringIO
+import cProfile
+import glob
+import itertools
+import json
+import mmap
+import multiprocessing
+import pstats
 import sys
 import os
+import time
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import django
+if hasattr(django, 'setup'):
+    django.setup()
 import bbcode
 bbcode.autodiscover()
 
@@ -37,16 +67,20 @@ def get_errors(content, namespaces):
     lines = content.splitlines()
     if errors:
         for error in errors:
-            output += '%s: %s\n' % error
-            output += '  %s\n' % lines[error[0]]
+            output += '%s: %s\n' % (error.lineno, error.message)
+            if 0 < error.lineno <= len(lines):
+                output += '  %s\n' % lines[error.lineno - 1]
     else:
         output += 'None\n'
     return output
         
-def get_output(content, namespaces, visonly, full, strict):
+def get_output(content, namespaces, visonly, full, strict, profile=False,
+               stats_file=None):
     output = ''
     if visonly:
         return bbcode.get_visual(content)
+    elif profile:
+        return get_profile(content, namespaces, stats_file)
     elif strict:
         output += 'Errors:\n-------\n\n'
         output += get_errors(content, namespaces)
@@ -71,12 +105,197 @@ def get_output(content, namespaces, visonly, full, strict):
     output += parsed
     return output
     
-def do_parse(infile, outfile, namespaces, visonly, full, strict):
+def get_profile(content, namespaces, stats_file=None):
+    """
+    Render content once with a listener of the tags (see bbcode.parse_nodes)
+    and return its parse tree with the self time, total time and output size
+    of each node and the totals of the tokenize, tree and render phases. Tags
+    parsed by their parent tag (eg. rows of a table) have no timings.
+    """
+    events = []
+    bbcode.lib.load_for(content)
+    parser = bbcode.Parser(namespaces)
+    bbcode.lib.add_listener(events.append)
+    try:
+        html, errors, head = parser.render(content, False)
+    finally:
+        bbcode.lib.remove_listener(events.append)
+    nodes = dict([(id(event.node), event) for event in events
+                  if event.node is not None])
+    phases = dict([(event.phase, event.elapsed) for event in events
+                   if event.node is None])
+    output = '%9s %9s %9s\n' % ('self ms', 'total ms', 'out')
+    output += '%9s %9.2f %9d -HeadNode\n' % ('', phases['render'] * 1000,
+                                             len(html))
+    stack = [(node, 1) for node in reversed(head.nodes)]
+    while stack:
+        node, level = stack.pop()
+        event = nodes.get(id(node))
+        if event is None:
+            timings = '%9s %9s %9s' % ('', '', '')
+        else:
+            timings = '%9.2f %9.2f %9d' % (event.own_elapsed * 1000,
+                                           event.elapsed * 1000,
+                                           event.output_size)
+        output += '%s %s-%s\n' % (timings, ' ' * (level * 4), str(node))
+        stack += [(child, level + 1) for child in reversed(node.nodes)]
+    render = phases['render'] - phases['tokenize'] - phases['tree']
+    output += '\nPhases:\n-------\n\n'
+    for phase, elapsed in (('tokenize', phases['tokenize']),
+                           ('tree', phases['tree']), ('render', render),
+                           ('total', phases['render'])):
+        output += '  %-10s %9.2fms\n' % (phase, elapsed * 1000)
+    if stats_file:
+        profile = cProfile.Profile()
+        profile.runcall(parser.render, content, False)
+        if stats_file == '-':
+            stream = StringIO.StringIO()
+            stats = pstats.Stats(profile, stream=stream)
+            stats.sort_stats('cumulative').print_stats(30)
+            output += '\n' + stream.getvalue()
+        else:
+            profile.dump_stats(stats_file)
+    return output
+
+def do_parse(infile, outfile, namespaces, visonly, full, strict,
+             profile=False, stats_file=None):
     content = infile.read()
-    output = get_output(content, namespaces, visonly, full, strict)
+    output = get_output(content, namespaces, visonly, full, strict, profile,
+                        stats_file)
     outfile.write(output)
     outfile.close()
 
+def do_stream(filename, outfile, namespaces, chunk_size):
+    """
+    Render a file chunk by chunk, see Parser.render_chunks.
+    """
+    bbcode.lib.load_all()
+    parser = bbcode.Parser(namespaces)
+    infile = open(filename, 'rb')
+    try:
+        if not os.fstat(infile.fileno()).st_size:
+            return
+        buffer = mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            for html, errors in parser.render_chunks(buffer, chunk_size):
+                outfile.write(html.encode('utf-8'))
+                for error in errors:
+                    sys.stderr.write('%s: %s\n' % (error.lineno,
+                                                   error.message))
+        finally:
+            buffer.close()
+    finally:
+        infile.close()
+    outfile.flush()
+
+def describe(exception):
+    return '%s: %s' % (exception.__class__.__name__, exception)
+
+def get_batch_items(paths, stdin):
+    """
+    Yield (id, content, error) of the files in paths or of the JSONL lines of
+    stdin. The content is None and error a message if it cannot be read.
+    """
+    if not paths:
+        for lineno, line in enumerate(stdin):
+            if line.strip():
+                try:
+                    item = json.loads(line)
+                    yield item.get('id', lineno + 1), item['content'], None
+                except (ValueError, KeyError, AttributeError), e:
+                    yield lineno + 1, None, describe(e)
+        return
+    for path in paths:
+        if os.path.isdir(path):
+            filenames = []
+            for dirpath, dirnames, files in os.walk(path):
+                filenames += [os.path.join(dirpath, f) for f in files]
+        elif os.path.exists(path):
+            filenames = [path]
+        else:
+            filenames = glob.glob(path)
+        for filename in sorted(filenames):
+            try:
+                content = open(filename, 'rb').read().decode('utf-8')
+            except (IOError, UnicodeDecodeError), e:
+                yield filename, None, describe(e)
+            else:
+                yield filename, content, None
+
+def do_batch_item(args):
+    """
+    Render (or only validate if strict) a document in a worker. Returns a
+    dictionary of its id, html, errors, size and elapsed time, with an error
+    instead of the html if the document could not be read or rendered.
+    """
+    (id, content, error), namespaces, strict = args
+    start = time.time()
+    result = {'id': id, 'size': len(content or ''), 'errors': []}
+    if error is None:
+        try:
+            if strict:
+                html = None
+                errors = bbcode.validate(content, namespaces)
+            else:
+                html, errors, head = bbcode.parse_and_validate(content,
+                                                               namespaces)
+        except Exception, e:
+            error = describe(e)
+        else:
+            # not 'error', list comprehensions leak their variable
+            result['errors'] = [{'lineno': exception.lineno,
+                                 'message': exception.message}
+                                for exception in errors]
+            if html is not None:
+                result['html'] = html
+    if error is not None:
+        result['error'] = error
+    result['elapsed'] = time.time() - start
+    return result
+
+def do_batch(items, outfile, namespaces, strict, jobs, slowest):
+    """
+    Render the (id, content, error) items using jobs worker processes, writing
+    a JSONL line per item to outfile in input order. Returns the summary.
+    """
+    args = itertools.izip(items, itertools.repeat(namespaces),
+                          itertools.repeat(strict))
+    pool = None
+    if jobs > 1:
+        # import all tags once, the workers inherit them
+        bbcode.lib.load_all()
+        pool = multiprocessing.Pool(jobs)
+        results = pool.imap(do_batch_item, args, 16)
+    else:
+        results = itertools.imap(do_batch_item, args)
+    start = time.time()
+    documents = size = errors = failed = broken = 0
+    times = []
+    try:
+        for result in results:
+            outfile.write(json.dumps(result) + '\n')
+            documents += 1
+            size += result['size']
+            errors += len(result['errors'])
+            failed += bool(result['errors'])
+            broken += 'error' in result
+            times.append((result['elapsed'], result['id']))
+    finally:
+        if pool is not None:
+            pool.terminate()
+    elapsed = time.time() - start
+    outfile.flush()
+    lines = ['%s documents, %.1fKB in %.2fs (%.1f documents/s, %.1fKB/s)' % (
+             documents, size / 1024.0, elapsed, documents / max(elapsed, 1e-6),
+             size / 1024.0 / max(elapsed, 1e-6)),
+             '%s errors in %s documents' % (errors, failed),
+             '%s documents could not be rendered' % broken]
+    if slowest and times:
+        lines.append('Slowest documents:')
+        for doc_elapsed, id in sorted(times, reverse=True)[:slowest]:
+            lines.append('  %8.2fms %s' % (doc_elapsed * 1000, id))
+    return '\n'.join(lines) + '\n'
+
 def main():
     parser = OptionParser(option_class=MyOption)
     parser.add_option('-i', '--input-file', action="store", type="string",
@@ -91,7 +310,37 @@ def main():
                       default=False)
     parser.add_option('-s', '--strict', action='store_true', dest='strict',
                       default=False)
+    parser.add_option('-b', '--batch', action='store_true', dest='batch',
+                      default=False)
+    parser.add_option('-j', '--jobs', action='store', type='int', dest='jobs',
+                      default=1)
+    parser.add_option('--slowest', action='store', type='int', dest='slowest',
+                      default=10)
+    parser.add_option('-p', '--profile', action='store_true', dest='profile',
+                      default=False)
+    parser.add_option('--pstats', action='store', type='string', dest='pstats')
+    parser.add_option('-m', '--mmap', action='store_true', dest='mmap',
+                      default=False)
+    parser.add_option('--chunk-size', action='store', type='int',
+                      dest='chunk_size', default=65536)
     options, args = parser.parse_args()
+    if options.batch or options.mmap:
+        if not options.outfile:
+            outfile = sys.stdout
+        else:
+            outfile = open(options.outfile, 'w')
+    if options.mmap:
+        if not options.infile:
+            parser.error('--mmap needs an input file')
+        do_stream(options.infile, outfile, options.namespaces,
+                  options.chunk_size)
+        return
+    if options.batch:
+        items = get_batch_items(args, sys.stdin)
+        sys.stderr.write(do_batch(items, outfile, options.namespaces,
+                                  options.strict, options.jobs,
+                                  options.slowest))
+        return
     if not options.infile:
         infile = StringIO.StringIO(' '.join(args))
     else:
@@ -101,6 +350,6 @@ def main():
     else:
         outfile = open(options.outfile, 'w')
     do_parse(infile, outfile, options.namespaces, options.visonly, options.full,
-             options.strict)
+             options.strict, options.profile, options.pstats)
 if __name__ == '__main__':
     main()
\ No newline at end of file
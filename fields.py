@@ -1,8 +1,53 @@
+import copy
 from django.db import models
 from django import forms
-validate = __import__('bbcode',level=0).validate
+bbmodule = __import__('bbcode',level=0)
 
-class BBCodeTextField(models.TextField):
+class ParsedBBCode(unicode):
+    """
+    The cleaned value of a BBCodeFormField. Behaves like the (unicode) content
+    but also holds the result of parsing it, so it doesn't need to be parsed
+    again: 'html' (the parsed content), 'errors' and 'tree' (the parse tree).
+    
+    The tree holds regex matches which can't be pickled or copied, so pickles
+    and copies only keep the content, the html and the errors, their tree is
+    None.
+    """
+    def __new__(cls, content, html, errors, tree=None):
+        obj = unicode.__new__(cls, content)
+        obj.html = html
+        obj.errors = errors
+        obj.tree = tree
+        return obj
+
+    def __reduce__(self):
+        return (ParsedBBCode, (unicode(self), self.html, self.errors))
+
+    def __deepcopy__(self, memo):
+        return ParsedBBCode(unicode(self), self.html,
+                            copy.deepcopy(self.errors, memo))
+
+
+class RenderedFieldMixin(object):
+    """
+    Stores the parsed content in the field 'rendered_field' of the model when
+    saving, if given. Uses the result of the form field if available.
+    """
+    def __init__(self, *args, **kwargs):
+        self.rendered_field = kwargs.pop('rendered_field', None)
+        super(RenderedFieldMixin, self).__init__(*args, **kwargs)
+
+    def pre_save(self, model_instance, add):
+        value = super(RenderedFieldMixin, self).pre_save(model_instance, add)
+        if self.rendered_field:
+            html = getattr(value, 'html', None)
+            if html is None:
+                html = bbmodule.parse(value or '', strict=False, auto_discover=True)[0]
+            setattr(model_instance, self.rendered_field, html)
+        return value
+
+
+class BBCodeTextField(RenderedFieldMixin, models.TextField):
     """
     BBCodeField for a database which basically is a TextField but uses the 
     BBCodeFormField form field to validate bbcode input (eg. in admin)
@@ -10,7 +55,7 @@ class BBCodeTextField(models.TextField):
     def formfield(self, **kwargs):
         return models.TextField.formfield(self, form_class=BBCodeFormField, **kwargs)
 
-class BBCodeCharField(models.CharField):
+class BBCodeCharField(RenderedFieldMixin, models.CharField):
     """
     BBCodeField for a database which basically is a CharField but uses the 
     BBCodeFormField form field to validate bbcode input (eg. in admin)
@@ -21,11 +66,14 @@ class BBCodeCharField(models.CharField):
     
 class BBCodeFormField(forms.CharField):
     """
-    A form field validating BBCode Input (it does NOT parse it)
+    A form field validating BBCode Input. The content is parsed only once, the
+    cleaned value is a ParsedBBCode which also holds the parsed content.
     """
     def clean(self, content):
         preclean = forms.CharField.clean(self, content)
-        errors = validate(preclean, auto_discover=True)
+        if not preclean:
+            return content
+        html, errors, tree = bbmodule.parse_and_validate(preclean, auto_discover=True)
         if errors:
             raise forms.ValidationError('\n'.join(map(lambda x: 'Line: %s: %s' % (x.lineno, x.message), errors)))
-        return content
\ No newline at end of file
+        return ParsedBBCode(content, html, errors, tree)
@@ -0,0 +1,89 @@
+"""
+Collects the timings of the tags used to render content, eg. to find out
+which tag makes a page slow:
+
+    collector = Collector(top=10)
+    collector.start()
+    ... render the page ...
+    collector.stop()
+    print collector.report()
+
+A collector only records events of the thread it was started in, so one can be
+used per request in threaded servers. The tags are timed by bbcode.parse_nodes
+while a collector is started, their classes are not changed, and deeply nested
+tags are parsed without recursion as usual.
+"""
+import heapq
+import threading
+bbmodule = __import__('bbcode',level=0)
+
+class Collector(object):
+    """
+    A listener (see Library.add_listener) aggregating the events per phase and
+    per tag and keeping the top slowest nodes.
+    """
+    def __init__(self, top=10, library=None):
+        if library is None:
+            library = bbmodule.lib
+        self.library = library
+        self.top = top
+        self.thread = None
+        # name: [count, elapsed, own elapsed, size, output size]
+        self.totals = {}
+        # heap of (elapsed, tag name, line number, size)
+        self.slowest = []
+
+    def start(self):
+        self.thread = threading.currentThread()
+        self.library.add_listener(self)
+
+    def stop(self):
+        self.library.remove_listener(self)
+
+    def __call__(self, event):
+        if threading.currentThread() is not self.thread:
+            return
+        if event.tag is None:
+            name = event.phase
+        else:
+            name = bbmodule.get_tag_name(event.tag)
+        totals = self.totals.setdefault(name, [0, 0.0, 0.0, 0, 0])
+        totals[0] += 1
+        totals[1] += event.elapsed
+        totals[2] += event.own_elapsed
+        totals[3] += event.size
+        totals[4] += event.output_size or 0
+        if event.tag is not None and self.top:
+            entry = (event.elapsed, name, event.lineno, event.size)
+            if len(self.slowest) < self.top:
+                heapq.heappush(self.slowest, entry)
+            else:
+                heapq.heappushpop(self.slowest, entry)
+
+    def get_totals(self):
+        """
+        Returns a list of (name, count, elapsed, own elapsed, size, output
+        size) sorted by own elapsed time, slowest first.
+        """
+        totals = [tuple([name] + values) for name, values in self.totals.items()]
+        return sorted(totals, key=lambda x: x[3], reverse=True)
+
+    def get_slowest(self):
+        """
+        Returns a list of (elapsed, tag name, line number, size) of the
+        slowest nodes, slowest first.
+        """
+        return sorted(self.slowest, reverse=True)
+
+    def report(self):
+        lines = ['%-26s %6s %10s %10s %10s %10s' % ('tag', 'count', 'total ms',
+                                                   'own ms', 'in', 'out')]
+        for name, count, elapsed, own, size, output_size in self.get_totals():
+            lines.append('%-26s %6d %10.2f %10.2f %10d %10d' % (name, count,
+                         elapsed * 1000, own * 1000, size, output_size))
+        lines.append('')
+        lines.append('Slowest nodes:')
+        for elapsed, name, lineno, size in self.get_slowest():
+            lines.append('  %8.2fms %s in line %s (%s characters)' % (
+                         elapsed * 1000, name, lineno, size))
+        return '\n'.join(lines)
@@ -0,0 +1,279 @@
+"""
+Aggregated metrics of rendering, exposed in the Prometheus text format by
+bbcode.views.metrics.
+
+The registry is a listener of the library (see Library.add_listener) counting
+renders, validations, errors, cache hits and misses and the characters in and
+out per set of namespaces, with histograms of the render and validation times.
+Per tag counters and timings need each tag to be timed (see
+bbcode.parse_nodes), which costs a few percent of rendering time, so they are
+off unless enabled. Settings:
+
+    BBCODE_METRICS: install the registry in autodiscover. Default: False
+    BBCODE_METRICS_TAGS: also collect per tag metrics. Default: False
+
+Namespaces are only used as labels if they are registered (see
+Library.get_tags), others are counted as 'other', so contents rendered with
+namespaces taken from requests cannot add label values without limit.
+
+Each thread writes to its own shard of counters, so recording takes no lock.
+The shards are only summed up when the metrics are exposed, the shards of
+finished threads are merged and dropped then or when a new thread starts
+recording. The metrics are process-local, with several worker processes each
+one reports its own.
+"""
+import bisect
+import threading
+import weakref
+bbmodule = __import__('bbcode',level=0)
+
+# Upper bounds of the histogram buckets in seconds
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+           1.0, 2.5, 5.0)
+
+# name: (type, help)
+METRICS = {
+    'bbcode_renders_total': ('counter', 'Contents rendered.'),
+    'bbcode_validations_total': ('counter', 'Contents validated.'),
+    'bbcode_errors_total': ('counter', 'Errors found rendering or validating.'),
+    'bbcode_failures_total': ('counter', 'Contents which could not be parsed.'),
+    'bbcode_cache_hits_total': ('counter', 'Rendered contents found in the cache.'),
+    'bbcode_cache_misses_total': ('counter', 'Rendered contents not found in the cache.'),
+    'bbcode_input_characters_total': ('counter', 'Characters of rendered contents.'),
+    'bbcode_output_characters_total': ('counter', 'Characters of rendered html.'),
+    'bbcode_render_seconds': ('histogram', 'Time to render a content.'),
+    'bbcode_validate_seconds': ('histogram', 'Time to validate a content.'),
+    'bbcode_phase_seconds': ('histogram', 'Time to tokenize a content or build its parse tree.'),
+    'bbcode_tag_renders_total': ('counter', 'Tags rendered.'),
+    'bbcode_tag_output_characters_total': ('counter', 'Characters of html rendered by tags.'),
+    'bbcode_tag_seconds': ('histogram', 'Time to render a tag, without nested tags.'),
+}
+
+# Label value of namespaces which are not registered
+OTHER = 'other'
+
+registry = None
+
+class Shard(object):
+    """
+    Counters and histograms of one thread. Only its thread keeps a reference
+    to the shard, the registry keeps a weak reference and the dictionaries, so
+    it can tell when the thread has finished.
+    """
+    def __init__(self):
+        self.counters = {}
+        self.histograms = {}
+
+class Registry(object):
+    """
+    Process-local store of counters and histograms. Metrics are identified by
+    their name and a tuple of (label, value) pairs.
+    """
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = tuple(buckets)
+        self.local = threading.local()
+        # (weak reference to the shard, its counters, its histograms)
+        self.shards = []
+        # the merged counters and histograms of finished threads
+        self.retired = ({}, {})
+        self.lock = threading.Lock()
+        self.library = None
+
+    def get_shard(self):
+        """
+        Get the Shard of the current thread.
+        """
+        try:
+            return self.local.shard
+        except AttributeError:
+            shard = Shard()
+            self.lock.acquire()
+            try:
+                self.retire()
+                self.shards.append((weakref.ref(shard), shard.counters,
+                                    shard.histograms))
+            finally:
+                self.lock.release()
+            self.local.shard = shard
+            return shard
+
+    def retire(self):
+        """
+        Merge the shards of finished threads into the retired counters and
+        histograms and drop them. Must be called with the lock held.
+        """
+        alive = []
+        for entry in self.shards:
+            if entry[0]() is None:
+                merge(self.retired, entry[1:])
+            else:
+                alive.append(entry)
+        self.shards = alive
+
+    def get_namespaces_label(self, namespaces):
+        """
+        Returns the label value of a set of namespaces, namespaces which are
+        not registered with the library are replaced by OTHER.
+        """
+        tags = (self.library or bbmodule.lib).tags
+        labels = set()
+        for ns in namespaces:
+            # do not use tags[...], it adds the namespace
+            if ns in tags or (ns.startswith('no-') and ns[3:] in tags):
+                labels.add(ns)
+            else:
+                labels.add(OTHER)
+        return ','.join(sorted(labels))
+
+    def inc(self, name, labels=(), value=1):
+        counters = self.get_shard().counters
+        key = (name, labels)
+        counters[key] = counters.get(key, 0) + value
+
+    def observe(self, name, labels, value):
+        histograms = self.get_shard().histograms
+        key = (name, labels)
+        try:
+            histogram = histograms[key]
+        except KeyError:
+            # a count per bucket, the +Inf bucket, the sum
+            histogram = histograms[key] = [0] * (len(self.buckets) + 1) + [0.0]
+        histogram[bisect.bisect_left(self.buckets, value)] += 1
+        histogram[-1] += value
+
+    def __call__(self, event):
+        if event.tag is not None:
+            labels = (('tag', bbmodule.get_tag_name(event.tag)),)
+            self.inc('bbcode_tag_renders_total', labels)
+            self.inc('bbcode_tag_output_characters_total', labels,
+                     event.output_size)
+            self.observe('bbcode_tag_seconds', labels, event.own_elapsed)
+        elif event.phase in ('tokenize', 'tree'):
+            self.observe('bbcode_phase_seconds', (('phase', event.phase),),
+                         event.elapsed)
+        else:
+            labels = (('namespaces',
+                       self.get_namespaces_label(event.namespaces)),)
+            if event.phase == 'render':
+                self.inc('bbcode_renders_total', labels)
+                self.inc('bbcode_input_characters_total', labels, event.size)
+                if event.output_size is None:
+                    self.inc('bbcode_failures_total', labels)
+                else:
+                    self.inc('bbcode_output_characters_total', labels,
+                             event.output_size)
+                self.observe('bbcode_render_seconds', labels, event.elapsed)
+            elif event.phase == 'validate':
+                self.inc('bbcode_validations_total', labels)
+                self.observe('bbcode_validate_seconds', labels, event.elapsed)
+            elif event.phase == 'cache hit':
+                self.inc('bbcode_cache_hits_total', labels)
+            elif event.phase == 'cache miss':
+                self.inc('bbcode_cache_misses_total', labels)
+            if event.errors:
+                self.inc('bbcode_errors_total', labels, event.errors)
+
+    def collect(self):
+        """
+        Returns the counters and the histograms of all threads summed up, as
+        dictionaries of (name, labels): value.
+        """
+        totals = ({}, {})
+        self.lock.acquire()
+        try:
+            self.retire()
+            merge(totals, self.retired)
+            shards = list(self.shards)
+        finally:
+            self.lock.release()
+        for entry in shards:
+            merge(totals, entry[1:])
+        return totals
+
+    def exposition(self):
+        """
+        Returns all metrics in the Prometheus text format (version 0.0.4).
+        """
+        counters, histograms = self.collect()
+        samples = {}
+        for (name, labels), value in counters.items():
+            samples.setdefault(name, []).append((name, labels, value))
+        bounds = ['%g' % bound for bound in self.buckets] + ['+Inf']
+        for (name, labels), histogram in histograms.items():
+            lines = samples.setdefault(name, [])
+            cumulative = 0
+            for bound, count in zip(bounds, histogram):
+                cumulative += count
+                lines.append(('%s_bucket' % name, labels + (('le', bound),),
+                              cumulative))
+            lines.append(('%s_sum' % name, labels, histogram[-1]))
+            lines.append(('%s_count' % name, labels, cumulative))
+        output = []
+        for name in sorted(samples):
+            kind, help = METRICS.get(name, ('untyped', name))
+            output.append('# HELP %s %s' % (name, help))
+            output.append('# TYPE %s %s' % (name, kind))
+            for sample, labels, value in samples[name]:
+                output.append('%s%s %s' % (sample, format_labels(labels),
+                                           format_value(value)))
+        return '\n'.join(output) + '\n'
+
+    def reset(self):
+        self.lock.acquire()
+        try:
+            self.retire()
+            self.retired = ({}, {})
+            for ref, counters, histograms in self.shards:
+                counters.clear()
+                histograms.clear()
+        finally:
+            self.lock.release()
+
+def merge(totals, shard):
+    """
+    Add the (counters, histograms) of a shard to totals.
+    """
+    counters, histograms = totals
+    # items() copies the dictionary at once, threads keep writing
+    for key, value in shard[0].items():
+        counters[key] = counters.get(key, 0) + value
+    for key, values in shard[1].items():
+        histogram = histograms.setdefault(key, [0] * len(values))
+        for i, value in enumerate(list(values)):
+            histogram[i] += value
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    escape = lambda value: value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return '{%s}' % ','.join(['%s="%s"' % (label, escape(value))
+                              for label, value in labels])
+
+def format_value(value):
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+def install(tags=None, library=None):
+    """
+    Create the registry and add it as a listener to the library, with per tag
+    metrics if tags (default: settings.BBCODE_METRICS_TAGS or False) is True.
+    Does nothing if the registry is already installed.
+    """
+    global registry
+    if registry is not None:
+        return registry
+    if tags is None:
+        tags = bbmodule.get_setting('BBCODE_METRICS_TAGS', False)
+    if library is None:
+        library = bbmodule.lib
+    registry = Registry()
+    registry.library = library
+    library.add_listener(registry, tags)
+    return registry
+
+def uninstall():
+    global registry
+    if registry is not None:
+        registry.library.remove_listener(registry)
+        registry = None
@@ -0,0 +1,230 @@
+"""
+Storing parse trees, so content can be rendered again without tokenizing it.
+
+A tree is stored with its source. Tags are referenced by the name of their
+class as registered in the library and text nodes by their offsets in the
+source (or as strings, if they are not part of the source). There are two
+formats, JSON for debugging and a packed binary format for storage:
+
+    data = pack(head) # or dumps(head) for JSON
+    html, errors = render_ast(data)
+
+Loading a tree only matches the pattern of each opening tag at its stored
+position. If the tags changed and a pattern no longer matches, ParserError is
+raised and the source should be parsed again. Errors found while building the
+tree (eg. tags which are not closed) are not stored, render_ast only returns
+the errors of rendering.
+"""
+import struct
+try:
+    import json
+except ImportError: # python < 2.6
+    from django.utils import simplejson as json
+bbmodule = __import__('bbcode',level=0)
+
+VERSION = 1
+MAGIC = 'BBT%d' % VERSION
+
+# record types of the packed format
+TEXT, STRING, TAG = 0, 1, 2
+
+def get_nodes(head):
+    """
+    Returns the nodes of a parse tree as nested lists: [start, end] for text
+    nodes (or the text if it is not at this position of the source) and
+    [tag name, start, end, child nodes] for tags.
+    """
+    source = head.raw_content
+    nodes = []
+    stack = [(iter(head.nodes), nodes, None)]
+    position = 0
+    while stack:
+        children, output, end = stack[-1]
+        for node in children:
+            if node.is_text_node:
+                text = node.text
+                if source.startswith(text, position):
+                    output.append([position, position + len(text)])
+                    position += len(text)
+                else:
+                    output.append(text)
+                continue
+            entry = [node.__class__.__name__, node.start,
+                     node.start + len(node.raw_content), []]
+            output.append(entry)
+            position = node.match.end()
+            if node.nodes:
+                stack.append((iter(node.nodes), entry[3], entry[2]))
+                break
+            position = entry[2]
+        else:
+            stack.pop()
+            if end is not None:
+                position = end
+    return nodes
+
+def build(source, nodes, library=None, context=None, parse_context=None):
+    """
+    Build a parse tree (a HeadNode) from its source and nodes as returned by
+    get_nodes.
+    """
+    if library is None:
+        library = bbmodule.lib
+    head = bbmodule.HeadNode(source, context, parse_context)
+    parse_context = head.parse_context
+    stack = [(head, iter(nodes), None)]
+    lineno = 1
+    lastpos = 0
+    while stack:
+        parent, entries, end = stack[-1]
+        for entry in entries:
+            if isinstance(entry, basestring):
+                parent.append(entry)
+                continue
+            if len(entry) == 2:
+                parent.append(source[entry[0]:entry[1]])
+                continue
+            name, start, stop, children = entry
+            if name not in library.raw_names:
+                library.load_all()
+            klass = library.raw_names.get(name)
+            match = None
+            if klass is not None:
+                match = library.get_tokenizer(klass)[1].match(source, start)
+            if match is None or match.start() != start:
+                raise bbmodule.ParserError, "Cannot load tag '%s' at %s" % (name, start)
+            lineno += source.count('\n', lastpos, start)
+            lastpos = start
+            parse_context.set_line_number(lineno)
+            node = parent.push(klass, match, source)
+            if node is not parent:
+                stack.append((node, iter(children), stop))
+                break
+        else:
+            stack.pop()
+            if end is not None:
+                parent.close(end)
+    return head
+
+def dumps(head):
+    """
+    Serialize a parse tree to JSON.
+    """
+    return json.dumps({'version': VERSION, 'source': head.raw_content,
+                       'nodes': get_nodes(head)}, separators=(',', ':'))
+
+def loads(data, library=None, context=None, parse_context=None):
+    """
+    Load a parse tree serialized with dumps.
+    """
+    data = json.loads(data)
+    if data.get('version') != VERSION:
+        raise bbmodule.ParserError, "Unsupported version %r" % data.get('version')
+    return build(data['source'], data['nodes'], library, context,
+                 parse_context)
+
+def pack(head):
+    """
+    Serialize a parse tree to the packed binary format: a header, the tag
+    names, the text nodes not in the source, the source (all utf-8) and the
+    nodes in document order as unsigned 16 bit integers (32 bit if the source
+    is longer).
+    """
+    names = []
+    indices = {}
+    strings = []
+    ints = []
+    stack = [iter(get_nodes(head))]
+    while stack:
+        for entry in stack[-1]:
+            if isinstance(entry, basestring):
+                encoded = entry.encode('utf-8')
+                strings.append(encoded)
+                ints += [STRING, len(encoded)]
+            elif len(entry) == 2:
+                ints += [TEXT, entry[0], entry[1]]
+            else:
+                name, start, end, children = entry
+                if name not in indices:
+                    indices[name] = len(names)
+                    names.append(name)
+                ints += [TAG, indices[name], start, end, len(children)]
+                stack.append(iter(children))
+                break
+        else:
+            stack.pop()
+    names = '\0'.join(names)
+    strings = ''.join(strings)
+    source = head.raw_content.encode('utf-8')
+    typecode = max(ints or [0]) < 0x10000 and 'H' or 'I'
+    return ''.join([MAGIC, typecode,
+                    struct.pack('<4I', len(names), len(strings), len(source),
+                                len(ints)),
+                    names, strings, source,
+                    struct.pack('<%d%s' % (len(ints), typecode), *ints)])
+
+def unpack(data, library=None, context=None, parse_context=None):
+    """
+    Load a parse tree serialized with pack.
+    """
+    if not data.startswith(MAGIC):
+        raise bbmodule.ParserError, "Not a packed parse tree"
+    typecode = data[len(MAGIC)]
+    position = len(MAGIC) + 17
+    sizes = struct.unpack('<4I', data[len(MAGIC) + 1:position])
+    blobs = []
+    for size in sizes[:3]:
+        blobs.append(data[position:position + size])
+        position += size
+    names = blobs[0].split('\0')
+    strings = blobs[1]
+    source = blobs[2].decode('utf-8')
+    ints = struct.unpack('<%d%s' % (sizes[3], typecode), data[position:])
+    # rebuild the nested lists of get_nodes
+    nodes = []
+    # (child nodes, number of children left)
+    stack = [(nodes, -1)]
+    index = string_position = 0
+    while index < len(ints):
+        output, left = stack[-1]
+        stack[-1] = (output, left - 1)
+        kind = ints[index]
+        if kind == TEXT:
+            output.append([ints[index + 1], ints[index + 2]])
+            index += 3
+        elif kind == STRING:
+            end = string_position + ints[index + 1]
+            output.append(strings[string_position:end].decode('utf-8'))
+            string_position = end
+            index += 2
+        else:
+            children = []
+            output.append([names[ints[index + 1]], ints[index + 2],
+                           ints[index + 3], children])
+            stack.append((children, ints[index + 4]))
+            index += 5
+        while len(stack) > 1 and not stack[-1][1]:
+            stack.pop()
+    return build(source, nodes, library, context, parse_context)
+
+def load(data, library=None, context=None, parse_context=None):
+    """
+    Load a parse tree serialized with pack or dumps.
+    """
+    if data.startswith(MAGIC):
+        return unpack(data, library, context, parse_context)
+    return loads(data, library, context, parse_context)
+
+def render_ast(data, context=None, library=None):
+    """
+    Render a parse tree serialized with pack or dumps. Returns a tuple of the
+    html and the errors, like bbcode.parse.
+    """
+    parse_context = bbmodule.ParseContext()
+    parse_context.activate()
+    try:
+        head = load(data, library, context, parse_context)
+        html = bbmodule.convert_linefeeds(head.parse())
+    finally:
+        parse_context.deactivate()
+    return html, parse_context.pull()
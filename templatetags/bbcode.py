@@ -1,10 +1,15 @@
 from django import template
+from django.utils import translation
 from django.utils.safestring import mark_safe
 
 bbmodule = __import__('bbcode',level=0)
+bbcache = __import__('bbcode.cache', {}, {}, ['parse'], 0)
 
 register = template.Library()
 
+# context variable holding the results of bbcode_prefetch
+PREFETCHED = 'bbcode_prefetched'
+
 class PseudoVar(object):
     def __init__(self, content):
         self.content = content
@@ -15,29 +20,58 @@ class PseudoVar(object):
 
 
 class BBCodeNode(template.Node):
-    def __init__(self, content, namespaces, varname):
+    def __init__(self, content, namespaces, varname, timeout=None):
         self.content = template.Variable(content)
+        # hard-coded namespaces are collected once, only variables are
+        # resolved on each render
+        self.static_namespaces = frozenset()
         self.namespaces = []
         for ns in namespaces:
             if ns[0] == ns[-1] and ns[0] in ('"',"'"):
-                self.namespaces.append(PseudoVar(ns[1:-1]))
+                self.static_namespaces = self.static_namespaces.union([ns[1:-1]])
             else:
                 self.namespaces.append(template.Variable(ns))
         self.varname = varname
-
-    def render(self, context):
-        try:
-            content = self.content.resolve(context)
-        except template.VariableDoesNotExist:
-            return ''
-        namespaces = set()
+        if timeout is not None and not timeout.isdigit():
+            timeout = template.Variable(timeout)
+        elif timeout is not None:
+            timeout = int(timeout)
+        self.timeout = timeout
+        
+    def get_namespaces(self, context):
+        if not self.namespaces:
+            return self.static_namespaces
+        namespaces = set(self.static_namespaces)
         for obj in self.namespaces:
             ns = obj.resolve(context)
             if type(ns) in (list, tuple):
                 namespaces = namespaces.union(ns)
             else:
                 namespaces.add(ns)
-        parsed, errors = bbmodule.parse(content, namespaces, False, True, context)
+        return namespaces
+
+    def get_timeout(self, context):
+        if not isinstance(self.timeout, template.Variable):
+            return self.timeout
+        try:
+            return int(self.timeout.resolve(context))
+        except (template.VariableDoesNotExist, TypeError, ValueError):
+            return None
+
+    def render(self, context):
+        try:
+            content = self.content.resolve(context)
+        except template.VariableDoesNotExist:
+            return ''
+        namespaces = self.get_namespaces(context)
+        prefetched = context.get(PREFETCHED)
+        if prefetched and content in prefetched.get(frozenset(namespaces), ()):
+            parsed, errors = prefetched[frozenset(namespaces)][content]
+        elif self.timeout is None:
+            parsed, errors = bbmodule.parse(content, namespaces, False, True, context)
+        else:
+            parsed, errors = bbcache.parse(content, namespaces, True,
+                                           timeout=self.get_timeout(context))
         if self.varname:
             context[self.varname] = mark_safe(parsed)
             return ''
@@ -51,7 +85,7 @@ def bbcode(parser, token):
     
     Usage:
         
-        {% bbcode <content> [<namespace1>, [<namespace2>...]] %}
+        {% bbcode <content> [<namespace1>, [<namespace2>...]] [cache <timeout>] [as <varname>] %}
         
     Params:
     
@@ -60,6 +94,15 @@ def bbcode(parser, token):
         
         <namespaceX> either a string or a template variable holding a string,
         list or tuple.
+        
+        <timeout> cache the rendered content for timeout seconds (a number or a
+        template variable), see bbcode.cache. The cache key is made of the
+        content, the namespaces and the registered tags (including the lazy
+        tag modules not imported yet, so the key is the same in every
+        process), tags using the template context should not be cached.
+        
+        <varname> store the rendered content in this variable instead of
+        returning it.
     
     WARNING: Errors are explicitly silenced in this tag because errors should be
     raised when 'content' is saved to the database (or where ever it is saved to).
@@ -74,11 +117,84 @@ def bbcode(parser, token):
     except ValueError:
         raise template.TemplateSyntaxError, "bbcode tag requires at least one argument"
     varname = None
-    if len(bits) > 1:
-        if bits[-2] == 'as':
-            varname = bits[-1]
+    if len(bits) > 1 and bits[-2] == 'as':
+        varname = bits[-1]
+        bits = bits[:-2]
+    timeout = None
+    if len(bits) > 1 and bits[-2] == 'cache':
+        timeout = bits[-1]
+        bits = bits[:-2]
+    return BBCodeNode(content, bits, varname, timeout)
+
+
+class BBCodePrefetchNode(BBCodeNode):
+    def __init__(self, items, attribute, namespaces, timeout=None):
+        BBCodeNode.__init__(self, items, namespaces, None, timeout)
+        if attribute[0] == attribute[-1] and attribute[0] in ('"',"'"):
+            attribute = attribute[1:-1]
+        self.attribute = template.Variable(attribute)
+
+    def render(self, context):
+        try:
+            items = self.content.resolve(context)
+        except template.VariableDoesNotExist:
+            return ''
+        contents = []
+        for item in items:
+            try:
+                contents.append(self.attribute.resolve(item))
+            except template.VariableDoesNotExist:
+                pass
+        namespaces = frozenset(self.get_namespaces(context))
+        results = bbcache.parse_many(contents, namespaces, True,
+                                     timeout=self.get_timeout(context))
+        prefetched = dict(context.get(PREFETCHED) or {})
+        prefetched[namespaces] = dict(prefetched.get(namespaces, {}))
+        prefetched[namespaces].update(zip(contents, results))
+        context[PREFETCHED] = prefetched
+        return ''
+
+@register.tag
+def bbcode_prefetch(parser, token):
+    """
+    Renders the content of several objects with one cache round trip, so the
+    bbcode tags rendering them later do not ask the cache for each one (see
+    bbcode.cache.prefetch).
+    
+    Usage:
+        
+        {% bbcode_prefetch <objects> <attribute> [<namespace1>, [<namespace2>...]] [cache <timeout>] %}
+        
+    Params:
+    
+        <objects> a template variable holding a list of objects or dicts, eg.
+        the posts of a thread.
+        
+        <attribute> the attribute (or key, or dotted lookup) of an object
+        holding its content, eg. "body".
+        
+        <namespaceX> the namespaces of the bbcode tags rendering the contents,
+        contents rendered with other namespaces are not prefetched.
+        
+        <timeout> keep new entries in the cache for timeout seconds.
+    
+    Example:
+    
+        {% bbcode_prefetch posts "body" %}
+        {% for post in posts %}{% bbcode post.body cache 3600 %}{% endfor %}
+    """
+    bbmodule.autodiscover()
+    bits = token.contents.split()
+    tag_name = bits.pop(0)
+    if len(bits) < 2:
+        raise template.TemplateSyntaxError, "bbcode_prefetch tag requires at least two arguments"
+    items = bits.pop(0)
+    attribute = bits.pop(0)
+    timeout = None
+    if len(bits) > 1 and bits[-2] == 'cache':
+        timeout = bits[-1]
         bits = bits[:-2]
-    return BBCodeNode(content, bits, varname)
+    return BBCodePrefetchNode(items, attribute, bits, timeout)
 
 
 class BBHelpVarnameNode(template.Node):
@@ -91,6 +207,11 @@ class BBHelpVarnameNode(template.Node):
         return ''
     
     
+# (registry fingerprint, {(template, tags, language): rendered help}). A new
+# fingerprint replaces the whole tuple, so threads reading the old one are not
+# disturbed and no keys are ever deleted.
+rendered_help = (None, {})
+
 class BBHelpTemplateNode(template.Node):
     def __init__(self, tags, tplfile):
         self.tags = tags
@@ -100,15 +221,27 @@ class BBHelpTemplateNode(template.Node):
             self.tplfile = template.Variable(tplfile)
             
     def render(self, context):
+        global rendered_help
         try:
             realtplfile = self.tplfile.resolve(context)
         except template.VariableDoesNotExist:
             return ''
-        rendered_tags = []
-        tpl = template.loader.get_template(realtplfile)
-        for tag in bbmodule.get_help(*self.tags):
-            rendered_tags.append(tpl.render(template.Context({'tag': tag})))
-        return '\n'.join(rendered_tags)
+        # The rendered help only changes with the tags, the template or the
+        # language
+        fingerprint = bbmodule.lib.get_fingerprint()
+        current, renders = rendered_help
+        if current != fingerprint:
+            renders = {}
+            rendered_help = (fingerprint, renders)
+        key = (realtplfile, tuple(self.tags), translation.get_language())
+        html = renders.get(key)
+        if html is None:
+            rendered_tags = []
+            tpl = template.loader.get_template(realtplfile)
+            for tag in bbmodule.get_help(*self.tags):
+                rendered_tags.append(tpl.render(template.Context({'tag': tag})))
+            html = renders[key] = '\n'.join(rendered_tags)
+        return html
         
 
 
@@ -131,6 +264,7 @@ def bbhelp(parser, token):
     Either 'using template' or 'as varname' must be present. 
     """
     bbmodule.autodiscover()
+    bbmodule.lib.load_all()
     bits = token.contents.split()
     tag_name = bits.pop(0)
     raw_tags = []
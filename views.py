@@ -1,10 +1,89 @@
+import datetime
+try:
+    import json
+except ImportError: # python < 2.6
+    from django.utils import simplejson as json
+from django.http import Http404, HttpResponse, HttpResponseNotAllowed, HttpResponseNotModified
 from django.shortcuts import render_to_response
 from django.template import RequestContext
+from django.utils import translation
+from django.utils.http import quote_etag
+from django.views.decorators.http import condition
+from django.views.decorators.vary import vary_on_headers
+import bbcode
+import bbcode.metrics
+from bbcode import cache
 
+# Default limits of the preview view, can be overwritten using
+# BBCODE_PREVIEW_MAX_SIZE (characters) and BBCODE_PREVIEW_BUDGET (seconds)
+PREVIEW_MAX_SIZE = 65536
+PREVIEW_BUDGET = 1.0
+
+def help_etag(request, template_name='bbcode/bbhelp.html', extra_context=None):
+    if extra_context:
+        return None
+    bbcode.autodiscover()
+    bbcode.lib.load_all()
+    return '%s-%s-%s' % (bbcode.lib.get_fingerprint(), template_name,
+                         translation.get_language())
+
+def help_last_modified(request, template_name='bbcode/bbhelp.html',
+                       extra_context=None):
+    if extra_context:
+        return None
+    bbcode.autodiscover()
+    bbcode.lib.load_all()
+    return datetime.datetime.utcfromtimestamp(int(bbcode.lib.modified))
+
+# the page is rendered with a RequestContext, so it depends on the language
+# and the user too
+@vary_on_headers('Accept-Language', 'Cookie')
+@condition(etag_func=help_etag, last_modified_func=help_last_modified)
 def help(request, template_name='bbcode/bbhelp.html', extra_context=None):
     if extra_context is None:
         extra_context = {}
     context = RequestContext(request)
     for key, value in extra_context.items():
         context[key] = callable(value) and value() or value
-    return render_to_response(template_name, context_instance=context)
\ No newline at end of file
+    return render_to_response(template_name, context_instance=context)
+
+def preview(request):
+    """
+    Render the POSTed 'content' using the optional 'namespaces' and return
+    the html and the errors as JSON. Rendered content is cached, the response
+    has an ETag of the content so unchanged previews are not sent again.
+    """
+    if request.method != 'POST':
+        return HttpResponseNotAllowed(['POST'])
+    content = request.POST.get('content', '')
+    namespaces = request.POST.getlist('namespaces') or None
+    if len(content) > bbcode.get_setting('BBCODE_PREVIEW_MAX_SIZE', PREVIEW_MAX_SIZE):
+        return HttpResponse('Content too long', status=413)
+    bbcode.autodiscover()
+    etag = quote_etag(cache.get_key(content, namespaces).split(':')[-1])
+    if etag in request.META.get('HTTP_IF_NONE_MATCH', ''):
+        response = HttpResponseNotModified()
+    else:
+        budget = bbcode.get_setting('BBCODE_PREVIEW_BUDGET', PREVIEW_BUDGET)
+        try:
+            html, errors = cache.parse(content, namespaces, budget=budget)
+        except bbcode.BudgetExceeded, e:
+            return HttpResponse(str(e), status=503)
+        data = {'html': html,
+                'errors': [{'lineno': error.lineno, 'message': error.message}
+                           for error in errors]}
+        response = HttpResponse(json.dumps(data),
+                                content_type='application/json')
+    response['ETag'] = etag
+    return response
+
+def metrics(request):
+    """
+    Expose the metrics of this process in the Prometheus text format. Only
+    available if settings.BBCODE_METRICS is True.
+    """
+    if not bbcode.get_setting('BBCODE_METRICS', False):
+        raise Http404
+    registry = bbcode.metrics.install()
+    return HttpResponse(registry.exposition(),
+                        content_type='text/plain; version=0.0.4; charset=utf-8')